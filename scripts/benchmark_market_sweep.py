@@ -0,0 +1,142 @@
+"""
+Fills/sec of a single market order sweeping `depth` resting orders, against in-memory
+repositories that sleep a simulated database round trip on every call.
+
+    cd src && PYTHONPATH=. python ../scripts/benchmark_market_sweep.py [round_trip_ms]
+"""
+import asyncio
+import sys
+import time
+from types import SimpleNamespace
+
+from core.currency_market import CurrencyMarket, TradeRequest
+from core.currency_market.order_book import OrderBooks
+from core.shared.models import CurrencyMarketOrder, PlanetTier
+
+DEPTHS = [1, 5, 10, 30, 100]
+TRADES_PER_DEPTH = 20
+
+
+class BenchOrder(CurrencyMarketOrder):
+    id: str = None
+
+
+class RoundTrips:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.count = 0
+
+    async def wait(self):
+        self.count += 1
+        await asyncio.sleep(self.delay)
+
+
+class FakePlanetRepository:
+    def __init__(self, round_trips: RoundTrips):
+        self.round_trips = round_trips
+
+    @staticmethod
+    def planet(planet_id: str):
+        return SimpleNamespace(
+            id=planet_id,
+            user=f"user-{planet_id}",
+            tier=PlanetTier(),
+            resources=SimpleNamespace(metal=1e12, crystal=1e12),
+        )
+
+    async def get_my_planet(self, user_id: str, planet_id: str, fetch_links=False):
+        await self.round_trips.wait()
+        return self.planet(planet_id)
+
+    async def get_many(self, planet_ids: list[str]):
+        await self.round_trips.wait()
+        return [self.planet(planet_id) for planet_id in planet_ids]
+
+    async def inc_resources(self, deltas, check_funds=False) -> bool:
+        await self.round_trips.wait()
+        return True
+
+
+class FakeSettlement:
+    def __init__(self, round_trips: RoundTrips):
+        self.round_trips = round_trips
+
+    async def settle(self, settlement):
+        # orders, trades and planets: one bulk write each
+        for _ in range(3):
+            await self.round_trips.wait()
+
+        if settlement.new_order is None:
+            return None
+
+        return BenchOrder(id="taker", **settlement.new_order.dict())
+
+
+class FakeResponsePort:
+    async def publish_response(self, response):
+        return response
+
+
+def resting_orders(depth: int) -> list[BenchOrder]:
+    return [
+        BenchOrder(
+            id=str(i),
+            order_type="sell",
+            user_id=f"user-maker-{i}",
+            planet_id=f"maker-{i}",
+            created_time=i,
+            updated_time=i,
+            market_code="METAL_CRYSTAL",
+            price=1 + i / 100,
+            amount=1,
+            amount_filled=0,
+            state="not_filled",
+        )
+        for i in range(depth)
+    ]
+
+
+async def run(depth: int, delay: float) -> tuple[float, float]:
+    round_trips = RoundTrips(delay)
+    market = CurrencyMarket(
+        FakePlanetRepository(round_trips),
+        None,
+        None,
+        FakeSettlement(round_trips),
+        OrderBooks(),
+        FakeResponsePort(),
+    )
+
+    elapsed = 0
+    for _ in range(TRADES_PER_DEPTH):
+        market.order_books.load(resting_orders(depth))
+        req = TradeRequest(
+            trade_type="market",
+            user_id="user-taker",
+            planet_id="taker",
+            order_type="buy",
+            pair1="METAL",
+            pair2="CRYSTAL",
+            total=depth * 2,
+        )
+
+        start = time.perf_counter()
+        response = await market.trade(req)
+        elapsed += time.perf_counter() - start
+        assert len(response.executed_trades) == depth
+
+    await market.close()
+    return depth * TRADES_PER_DEPTH / elapsed, round_trips.count / TRADES_PER_DEPTH
+
+
+async def main():
+    delay = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.001
+    print(f"simulated round trip: {delay * 1000:.1f}ms")
+    print(f"{'depth':>6} {'fills/sec':>12} {'round trips/trade':>18}")
+    for depth in DEPTHS:
+        fills_per_sec, round_trips = await run(depth, delay)
+        print(f"{depth:>6} {fills_per_sec:>12.0f} {round_trips:>18.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+"""
+Microseconds per planet to load a Planet from its stored dict (what a Beanie load validates),
+to dump it back (what a save encodes) and to build and serialize its PlanetResponse.
+
+    cd src && PYTHONPATH=. python ../scripts/benchmark_planet_model.py [planets]
+"""
+import sys
+import time
+
+from core.shared.models import (
+    Planet,
+    PlanetResponse,
+    PlanetTier,
+    Reserves,
+    Resources,
+)
+from core.shared.service.planet import create_planet_levels
+from core.shared.static.game_data.ResourceData import ResourceData as RD
+
+
+def stored_planet(i: int) -> dict:
+    resources_level, installation_level, research_level, defense_items = (
+        create_planet_levels()
+    )
+    for mine in resources_level:
+        mine.current_level = 1 + i % 20
+        mine.health = RD.get_item(mine.label).get_level_info(mine.current_level).health
+
+    return Planet(
+        id=str(i),
+        name=f"planet-{i}",
+        level=1 + i % 30,
+        experience=0,
+        user=f"user-{i}",
+        tier=PlanetTier(),
+        reserves=Reserves(total_metal=1e6, total_crystal=1e6, total_petrol=1e6),
+        resources=Resources(metal=1e3, crystal=1e3, petrol=1e3, energy=1e3, bkm=0),
+        resources_level=resources_level,
+        installation_level=installation_level,
+        research_level=research_level,
+        defense_items=defense_items,
+    ).dict()
+
+
+def per_planet(label: str, count: int, run, repeat: int = 5):
+    # best of a few runs, the others mostly measure the garbage collector
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f"{label:>10} {best / count * 1e6:>10.1f}us")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    stored = [stored_planet(i) for i in range(count)]
+    planets = [Planet.parse_obj(raw) for raw in stored]
+
+    print(f"{count} planets")
+    per_planet("load", count, lambda: [Planet.parse_obj(raw) for raw in stored])
+    per_planet("dump", count, lambda: [planet.dict() for planet in planets])
+    per_planet(
+        "response",
+        count,
+        lambda: [PlanetResponse.from_planet(planet).json() for planet in planets],
+    )
+
+
+if __name__ == "__main__":
+    main()
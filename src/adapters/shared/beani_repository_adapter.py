@@ -2,12 +2,18 @@ from __future__ import annotations
 
 from datetime import datetime
 from typing import AsyncIterator
+from uuid import uuid4
 
-from beanie import DeleteRules, PydanticObjectId, WriteRules
-from beanie.operators import In
+from beanie import Document, PydanticObjectId, WriteRules
+from beanie.exceptions import RevisionIdWasChanged
+from beanie.odm.utils.dump import get_dict
+from beanie.operators import NE, In
+from bson import Binary
+from pymongo import InsertOne, UpdateOne
 
 from adapters.shared.beanie_models_adapter import (
     BKMTransactionDocument,
+    CurrencyMarketCandleDocument,
     CurrencyMarketOrderDocument,
     CurrencyMarketTradeDocument,
     EmailDocument,
@@ -16,22 +22,34 @@ from adapters.shared.beanie_models_adapter import (
     UserDocument, VoucherDocument,
 )
 from core.shared.models import (
+    CANDLE_INTERVALS,
     BKMTransaction,
+    CurrencyMarketCandle,
     CurrencyMarketOrder,
+    CurrencyMarketSettlement,
+    CurrencyMarketTicker,
     CurrencyMarketTrade,
     Email,
     EnergyDeposit,
+    MarketLeaseLostException,
     OpenOrdersGroupedByPrice,
     Planet,
+    PlanetLeaderboardView,
+    PlanetNftView,
+    PlanetPositionView,
+    PlanetResourcesView,
     PlanetTier,
+    PlanetTierView,
     PriceCandleDataGroupedByTimeInterval,
+    StaleOrderException,
     User,
     UserNotFoundException,
-    Volume24Info, Voucher,
+    Voucher, candle_bucket,
 )
 from core.shared.ports import (
     BKMDepositRepositoryPort,
     CurrencyMarketOrderRepositoryPort,
+    CurrencyMarketSettlementPort,
     CurrencyMarketTradeRepositoryPort,
     EmailRepositoryPort,
     EnergyDepositRepositoryPort,
@@ -40,6 +58,70 @@ from core.shared.ports import (
 )
 
 
+def resource_delta_operations(
+    deltas: dict[str, dict[str, float]], check_funds=False
+) -> list[UpdateOne]:
+    """
+    One $inc per planet. The revision id is bumped as well so that stale PlanetDocuments
+    loaded before the increment fail on save_changes instead of overwriting it.
+    """
+    operations = []
+    for planet_id, planet_deltas in deltas.items():
+        query = {"_id": PydanticObjectId(planet_id)}
+        inc = {}
+        for resource, amount in planet_deltas.items():
+            if not amount:
+                continue
+
+            inc[f"resources.{resource}"] = amount
+            if check_funds and amount < 0:
+                query[f"resources.{resource}"] = {"$gte": -amount}
+
+        if inc:
+            operations.append(
+                UpdateOne(
+                    query,
+                    {"$inc": inc, "$set": {"revision_id": Binary.from_uuid(uuid4())}},
+                )
+            )
+
+    return operations
+
+
+async def save_in_place(document: Document):
+    """
+    save_changes, then rotates the revision like a load does, so the same instance can keep being
+    changed and saved instead of reading it back after every write.
+    """
+    if document.is_changed:
+        await document.save_changes()
+        document._swap_revision()
+
+
+def planet_projection(view_model) -> dict:
+    return {name: 1 for name in view_model.__fields__ if name != "id"}
+
+
+def planet_view(view_model, document: dict):
+    """
+    A view model from a raw planet document projected with `planet_projection`.
+    """
+    document["id"] = str(document.pop("_id"))
+    revision_id = document.get("revision_id")
+    if isinstance(revision_id, Binary):
+        document["revision_id"] = revision_id.as_uuid()
+
+    return view_model(**document)
+
+
+def revision_filter(view) -> Binary | None:
+    # matches the revision the view was read at, documents without one match None
+    if view.revision_id is None:
+        return None
+
+    return Binary.from_uuid(view.revision_id)
+
+
 class EmailRepositoryAdapter(EmailRepositoryPort):
     async def create(self, email: Email) -> Email:
         email_document = EmailDocument(
@@ -51,6 +133,7 @@ class EmailRepositoryAdapter(EmailRepositoryPort):
             read=email.read,
             planet=email.planet,
             topic=email.topic,
+            created=email.created or datetime.timestamp(datetime.now()),
         )
 
         await email_document.save()
@@ -61,33 +144,43 @@ class EmailRepositoryAdapter(EmailRepositoryPort):
         return email
 
     async def delete(self, email: Email):
-        email_document: EmailDocument = await EmailDocument.get(
-            PydanticObjectId(email.id)
-        )
-        planet = await PlanetDocument.get(PydanticObjectId(email.planet))
-        await planet.fetch_link(PlanetDocument.emails)
-        planet.emails = [x for x in planet.emails if str(x.id) != email.id]
-
-        await planet.save_changes()
-        await email_document.delete(link_rule=DeleteRules.DELETE_LINKS)
-
-    async def delete_all_by_user(self, planet_id) -> None:
-        email_documents: list[EmailDocument] = await EmailDocument.find(
-            EmailDocument.planet == planet_id
-        ).to_list()
-        for email in email_documents:
-            await email.delete(link_rule=DeleteRules.DELETE_LINKS)
+        await EmailDocument.find_one(
+            EmailDocument.id == PydanticObjectId(email.id)
+        ).delete()
 
-        planet = await PlanetDocument.get(PydanticObjectId(planet_id))
-        await planet.fetch_link(PlanetDocument.emails)
-        planet.emails = []
-
-        await planet.save_changes()
+    async def delete_all_by_user(self, planet_id) -> int:
+        result = await EmailDocument.find(EmailDocument.planet == planet_id).delete()
+        return result.deleted_count if result is not None else 0
 
     async def get(self, email_id) -> Email:
         email = await EmailDocument.get(PydanticObjectId(email_id))
         return email
 
+    async def inbox(
+        self, planet_id: str, before: float | None, before_id: str | None, limit: int
+    ) -> list[Email]:
+        query = {"planet": planet_id}
+        if before is not None:
+            older = [{"created": {"$lt": before}}]
+            if before_id is not None:
+                older.append(
+                    {"created": before, "_id": {"$lt": PydanticObjectId(before_id)}}
+                )
+
+            query["$or"] = older
+
+        return (
+            await EmailDocument.find(query)
+            .sort(-EmailDocument.created, "-_id")
+            .limit(limit)
+            .to_list()
+        )
+
+    async def unread_count(self, planet_id: str) -> int:
+        return await EmailDocument.find(
+            EmailDocument.planet == planet_id, NE(EmailDocument.read, True)
+        ).count()
+
 
 class EnergyDepositRepositoryAdapter(EnergyDepositRepositoryPort):
     async def get(self, id: str) -> EnergyDeposit | None:
@@ -156,85 +249,28 @@ class BeaniCurrencyMarketOrderRepositoryAdapter(CurrencyMarketOrderRepositoryPor
         )
 
     async def update(self, order: CurrencyMarketOrderDocument) -> CurrencyMarketOrder:
-        await order.save_changes()
+        # the same instance is kept alive by the order book and saved again later
+        await save_in_place(order)
         return order
 
-    async def find_matching_orders(
-        self, market_code: str, trade_type: str, order_type: str, price: float
+    async def all_open_orders(
+        self, market_code: str = None
     ) -> list[CurrencyMarketOrder]:
-        matching_orders = []
-
-        if trade_type == "limit":
-            if order_type == "buy":
-                matching_orders = (
-                    await CurrencyMarketOrderDocument.find(
-                        CurrencyMarketOrderDocument.market_code == market_code,
-                        CurrencyMarketOrderDocument.price <= price,
-                        CurrencyMarketOrderDocument.order_type == "sell",
-                        In(
-                            CurrencyMarketOrderDocument.state,
-                            ["not_filled", "partially_filled"],
-                        ),
-                    )
-                    .sort(
-                        +CurrencyMarketOrderDocument.price,
-                        +CurrencyMarketOrderDocument.created_time,
-                    )
-                    .to_list()
-                )
-            elif order_type == "sell":
-                matching_orders = (
-                    await CurrencyMarketOrderDocument.find(
-                        CurrencyMarketOrderDocument.market_code == market_code,
-                        CurrencyMarketOrderDocument.price >= price,
-                        CurrencyMarketOrderDocument.order_type == "buy",
-                        In(
-                            CurrencyMarketOrderDocument.state,
-                            ["not_filled", "partially_filled"],
-                        ),
-                    )
-                    .sort(
-                        -CurrencyMarketOrderDocument.price,
-                        +CurrencyMarketOrderDocument.created_time,
-                    )
-                    .to_list()
-                )
+        query = [
+            In(
+                CurrencyMarketOrderDocument.state,
+                ["not_filled", "partially_filled"],
+            )
+        ]
 
-        elif trade_type == "market":
-            if order_type == "buy":
-                matching_orders = (
-                    await CurrencyMarketOrderDocument.find(
-                        CurrencyMarketOrderDocument.market_code == market_code,
-                        CurrencyMarketOrderDocument.order_type == "sell",
-                        In(
-                            CurrencyMarketOrderDocument.state,
-                            ["not_filled", "partially_filled"],
-                        ),
-                    )
-                    .sort(
-                        +CurrencyMarketOrderDocument.price,
-                        +CurrencyMarketOrderDocument.created_time,
-                    )
-                    .to_list()
-                )
-            elif order_type == "sell":
-                matching_orders = (
-                    await CurrencyMarketOrderDocument.find(
-                        CurrencyMarketOrderDocument.market_code == market_code,
-                        CurrencyMarketOrderDocument.order_type == "buy",
-                        In(
-                            CurrencyMarketOrderDocument.state,
-                            ["not_filled", "partially_filled"],
-                        ),
-                    )
-                    .sort(
-                        -CurrencyMarketOrderDocument.price,
-                        +CurrencyMarketOrderDocument.created_time,
-                    )
-                    .to_list()
-                )
+        if market_code is not None:
+            query.append(CurrencyMarketOrderDocument.market_code == market_code)
 
-        return matching_orders
+        return (
+            await CurrencyMarketOrderDocument.find(*query)
+            .sort(+CurrencyMarketOrderDocument.created_time)
+            .to_list()
+        )
 
     async def open_orders_grouped_price(
         self, market_code: str
@@ -300,355 +336,99 @@ class BeaniCurrencyMarketOrderRepositoryAdapter(CurrencyMarketOrderRepositoryPor
 
         return buy_group, sell_group
 
-    async def create_order(
-        self, order: CurrencyMarketOrder
-    ) -> CurrencyMarketOrder | None:
-        order = CurrencyMarketOrderDocument(
-            order_type=order.order_type,
-            user_id=order.user_id,
-            planet_id=order.planet_id,
-            created_time=order.created_time,
-            updated_time=order.updated_time,
-            market_code=order.market_code,
-            price=order.price,
-            amount=order.amount,
-            amount_filled=order.amount_filled,
-            state=order.state,
-        )
-
-        await order.create()
-        return order
-
 
 class BeaniCurrencyMarketTradeRepositoryAdapter(CurrencyMarketTradeRepositoryPort):
-    async def _beani_interval_query(self, interval: str) -> dict:
-        candle_time_frame_mapping = {
-            "1m": {
-                "int": 1,
-                "pre_date_format": "%Y-%m-%dT%H:",
-                "interval_time_selector": "$minute",
-                "post_date_format": ":00.000000Z",
-            },
-            "15m": {
-                "int": 15,
-                "pre_date_format": "%Y-%m-%dT%H:",
-                "interval_time_selector": "$minute",
-                "post_date_format": ":00.000000Z",
-            },
-            "1h": {
-                "int": 1,
-                "pre_date_format": "%Y-%m-%dT",
-                "interval_time_selector": "$hour",
-                "post_date_format": ":00:00.000000Z",
-            },
-            "1d": {
-                "int": 1,
-                "pre_date_format": "%Y-%m-",
-                "interval_time_selector": "$dayOfMonth",
-                "post_date_format": "T00:00:00.000000Z",
-            },
-        }
-
-        return candle_time_frame_mapping[interval]
-
-    async def last_24_info(self, market_code: str) -> Volume24Info:
-        start = datetime.utcnow()
-        start_str = start.strftime(f"%Y-%m-%dT00:00:00.000000Z")
-        start_dt = datetime.strptime(start_str, "%Y-%m-%dT%H:%M:00.000000Z")
-
+    async def _candles(
+        self, market_code: str, interval: str, time_start: datetime
+    ) -> list[CurrencyMarketCandle]:
         return (
-            await CurrencyMarketTradeDocument.find(
-                CurrencyMarketTradeDocument.market_code == market_code
-            )
-            .aggregate(
-                [
-                    {
-                        "$match": {
-                            "created_time": {"$gte": start_dt},
-                        },
-                    },
-                    {
-                        "$group": {
-                            "_id": {
-                                "date_formatted": {
-                                    "$dateToString": {
-                                        "format": "%Y-%m-%d",
-                                        "date": "$created_time",
-                                    }
-                                }
-                            },
-                            "max_24": {"$max": "$price"},
-                            "min_24": {"$min": "$price"},
-                            "pair1_volume": {"$sum": "$amount"},
-                            "pair2_volume": {
-                                "$sum": {"$multiply": ["$amount", "$price"]}
-                            },
-                        },
-                    },
-                ],
-                projection_model=Volume24Info,
+            await CurrencyMarketCandleDocument.find(
+                CurrencyMarketCandleDocument.market_code == market_code,
+                CurrencyMarketCandleDocument.interval == interval,
+                CurrencyMarketCandleDocument.bucket >= time_start,
             )
+            .sort(+CurrencyMarketCandleDocument.bucket)
             .to_list()
         )
 
     async def price_candle_data_grouped_time_range(
         self, market_code: str, interval: str, time_start: datetime
     ) -> list[PriceCandleDataGroupedByTimeInterval]:
+        candles = await self._candles(
+            market_code, interval, candle_bucket(time_start, interval)
+        )
 
-        interval_query_info = await self._beani_interval_query(interval)
-
-        # https://stackoverflow.com/a/26814496
-        return (
-            await CurrencyMarketTradeDocument.find(
-                CurrencyMarketTradeDocument.market_code == market_code
+        return [
+            PriceCandleDataGroupedByTimeInterval(
+                _id={
+                    "date_formatted": candle.bucket.strftime(
+                        "%Y-%m-%dT%H:%M:00.000000Z"
+                    )
+                },
+                open=candle.open,
+                close=candle.close,
+                high=candle.high,
+                low=candle.low,
+                volume=candle.volume,
             )
-            .aggregate(
+            for candle in candles
+        ]
+
+    async def price_candle_data_grouped_time(
+        self, market_code: str, time_start: datetime, interval: str
+    ) -> list[CurrencyMarketCandle]:
+        return await self._candles(market_code, interval, time_start)
+
+    async def has_candles(self) -> bool:
+        return await CurrencyMarketCandleDocument.find_one() is not None
+
+    async def rebuild_candles(self):
+        for interval, (unit, bin_size) in CANDLE_DATE_TRUNC.items():
+            await CurrencyMarketTradeDocument.aggregate(
                 [
-                    {
-                        "$match": {
-                            "created_time": {"$gte": time_start},
-                        }
-                    },
                     {"$sort": {"created_time": 1}},
                     {
                         "$group": {
                             "_id": {
-                                "date_formatted": {
-                                    "$dateToString": {
-                                        "format": {
-                                            "$concat": [
-                                                interval_query_info["pre_date_format"],
-                                                {
-                                                    "$toString": {
-                                                        "$cond": {
-                                                            "if": {
-                                                                "$lt": [
-                                                                    {
-                                                                        "$subtract": [
-                                                                            {
-                                                                                interval_query_info[
-                                                                                    "interval_time_selector"
-                                                                                ]: "$created_time"
-                                                                            },
-                                                                            {
-                                                                                "$mod": [
-                                                                                    {
-                                                                                        interval_query_info[
-                                                                                            "interval_time_selector"
-                                                                                        ]: "$created_time"
-                                                                                    },
-                                                                                    interval_query_info[
-                                                                                        "int"
-                                                                                    ],
-                                                                                ]
-                                                                            },
-                                                                        ]
-                                                                    },
-                                                                    10,
-                                                                ]
-                                                            },
-                                                            "then": {
-                                                                "$concat": [
-                                                                    "0",
-                                                                    {
-                                                                        "$toString": {
-                                                                            "$subtract": [
-                                                                                {
-                                                                                    interval_query_info[
-                                                                                        "interval_time_selector"
-                                                                                    ]: "$created_time"
-                                                                                },
-                                                                                {
-                                                                                    "$mod": [
-                                                                                        {
-                                                                                            interval_query_info[
-                                                                                                "interval_time_selector"
-                                                                                            ]: "$created_time"
-                                                                                        },
-                                                                                        interval_query_info[
-                                                                                            "int"
-                                                                                        ],
-                                                                                    ]
-                                                                                },
-                                                                            ]
-                                                                        }
-                                                                    },
-                                                                ]
-                                                            },
-                                                            "else": {
-                                                                "$subtract": [
-                                                                    {
-                                                                        interval_query_info[
-                                                                            "interval_time_selector"
-                                                                        ]: "$created_time"
-                                                                    },
-                                                                    {
-                                                                        "$mod": [
-                                                                            {
-                                                                                interval_query_info[
-                                                                                    "interval_time_selector"
-                                                                                ]: "$created_time"
-                                                                            },
-                                                                            interval_query_info[
-                                                                                "int"
-                                                                            ],
-                                                                        ]
-                                                                    },
-                                                                ]
-                                                            },
-                                                        },
-                                                    }
-                                                },
-                                                interval_query_info["post_date_format"],
-                                            ]
-                                        },
+                                "market_code": "$market_code",
+                                "bucket": {
+                                    "$dateTrunc": {
                                         "date": "$created_time",
+                                        "unit": unit,
+                                        "binSize": bin_size,
                                     }
                                 },
                             },
-                            # "date": {"$first": "$created_time"},
-                            ## need to remove seconds from candle
-                            # "date": {"$dateToString": {"$date": {"$first": "$created_time"}, "$format": "%Y-%m-%dT%H:%M"}},
                             "open": {"$first": "$price"},
                             "close": {"$last": "$price"},
                             "high": {"$max": "$price"},
                             "low": {"$min": "$price"},
+                            "volume": {"$sum": "$amount"},
                         }
                     },
-                    {"$limit": 300},
-                ],
-                projection_model=PriceCandleDataGroupedByTimeInterval,
-            )
-            .to_list()
-        )
-
-    async def price_candle_data_grouped_time(
-        self, market_code: str, time_start: datetime, interval: str
-    ) -> list[PriceCandleDataGroupedByTimeInterval]:
-
-        interval_query_info = await self._beani_interval_query(interval)
-
-        # https://stackoverflow.com/a/26814496
-        return (
-            await CurrencyMarketTradeDocument.find(
-                CurrencyMarketTradeDocument.market_code == market_code
-            )
-            .aggregate(
-                [
                     {
-                        "$match": {
-                            "created_time": {"$gte": time_start},
+                        "$project": {
+                            "_id": 0,
+                            "market_code": "$_id.market_code",
+                            "interval": {"$literal": interval},
+                            "bucket": "$_id.bucket",
+                            "open": 1,
+                            "close": 1,
+                            "high": 1,
+                            "low": 1,
+                            "volume": 1,
                         }
                     },
                     {
-                        "$group": {
-                            "_id": {
-                                "date_formatted": {
-                                    "$dateToString": {
-                                        "format": {
-                                            "$concat": [
-                                                interval_query_info["pre_date_format"],
-                                                {
-                                                    "$toString": {
-                                                        "$cond": {
-                                                            "if": {
-                                                                "$lt": [
-                                                                    {
-                                                                        "$subtract": [
-                                                                            {
-                                                                                interval_query_info[
-                                                                                    "interval_time_selector"
-                                                                                ]: "$created_time"
-                                                                            },
-                                                                            {
-                                                                                "$mod": [
-                                                                                    {
-                                                                                        interval_query_info[
-                                                                                            "interval_time_selector"
-                                                                                        ]: "$created_time"
-                                                                                    },
-                                                                                    interval_query_info[
-                                                                                        "int"
-                                                                                    ],
-                                                                                ]
-                                                                            },
-                                                                        ]
-                                                                    },
-                                                                    10,
-                                                                ]
-                                                            },
-                                                            "then": {
-                                                                "$concat": [
-                                                                    "0",
-                                                                    {
-                                                                        "$toString": {
-                                                                            "$subtract": [
-                                                                                {
-                                                                                    interval_query_info[
-                                                                                        "interval_time_selector"
-                                                                                    ]: "$created_time"
-                                                                                },
-                                                                                {
-                                                                                    "$mod": [
-                                                                                        {
-                                                                                            interval_query_info[
-                                                                                                "interval_time_selector"
-                                                                                            ]: "$created_time"
-                                                                                        },
-                                                                                        interval_query_info[
-                                                                                            "int"
-                                                                                        ],
-                                                                                    ]
-                                                                                },
-                                                                            ]
-                                                                        }
-                                                                    },
-                                                                ]
-                                                            },
-                                                            "else": {
-                                                                "$subtract": [
-                                                                    {
-                                                                        interval_query_info[
-                                                                            "interval_time_selector"
-                                                                        ]: "$created_time"
-                                                                    },
-                                                                    {
-                                                                        "$mod": [
-                                                                            {
-                                                                                interval_query_info[
-                                                                                    "interval_time_selector"
-                                                                                ]: "$created_time"
-                                                                            },
-                                                                            interval_query_info[
-                                                                                "int"
-                                                                            ],
-                                                                        ]
-                                                                    },
-                                                                ]
-                                                            },
-                                                        },
-                                                    }
-                                                },
-                                                interval_query_info["post_date_format"],
-                                            ]
-                                        },
-                                        "date": "$created_time",
-                                    }
-                                },
-                            },
-                            "open": {"$first": "$price"},
-                            "close": {"$last": "$price"},
-                            "high": {"$max": "$price"},
-                            "low": {"$min": "$price"},
+                        "$merge": {
+                            "into": CurrencyMarketCandleDocument.get_collection_name(),
+                            "on": ["market_code", "interval", "bucket"],
+                            "whenMatched": "replace",
+                            "whenNotMatched": "insert",
                         }
                     },
-                    {"$limit": 300},
-                    {"$sort": {"_id.date_formatted": 1}},
-                ],
-                projection_model=PriceCandleDataGroupedByTimeInterval,
-            )
-            .to_list()
-        )
+                ]
+            ).to_list()
 
     async def price_last_candle_data_grouped_time(
         self, market_code: str, interval: int
@@ -704,16 +484,6 @@ class BeaniCurrencyMarketTradeRepositoryAdapter(CurrencyMarketTradeRepositoryPor
             .to_list()
         )
 
-    async def last(self, market_code: str) -> list[CurrencyMarketTradeDocument]:
-        return (
-            await CurrencyMarketTradeDocument.find(
-                CurrencyMarketTradeDocument.market_code == market_code
-            )
-            .sort(-CurrencyMarketTradeDocument.created_time)
-            .limit(2)
-            .to_list()
-        )
-
     async def last_from(
         self, market_code: str, starting_from: datetime
     ) -> list[CurrencyMarketTrade]:
@@ -730,6 +500,63 @@ class BeaniCurrencyMarketTradeRepositoryAdapter(CurrencyMarketTradeRepositoryPor
     async def all(self) -> list[CurrencyMarketTradeDocument] | None:
         return await CurrencyMarketTradeDocument.all().to_list()
 
+    async def all_from(self, time_start: datetime) -> list[CurrencyMarketTrade]:
+        return (
+            await CurrencyMarketTradeDocument.find(
+                CurrencyMarketTradeDocument.created_time >= time_start
+            )
+            .sort(+CurrencyMarketTradeDocument.created_time)
+            .to_list()
+        )
+
+    async def market_tickers(self, time_start: datetime) -> list[CurrencyMarketTicker]:
+        tickers = {}
+
+        # only the window is sorted, through the created_time index
+        windows = await CurrencyMarketTradeDocument.aggregate(
+            [
+                {"$match": {"created_time": {"$gte": time_start}}},
+                {"$sort": {"created_time": 1}},
+                {
+                    "$group": {
+                        "_id": "$market_code",
+                        "open_24": {"$first": "$price"},
+                        "last_price": {"$last": "$price"},
+                        "pair1_volume_24": {"$sum": "$amount"},
+                        "pair2_volume_24": {
+                            "$sum": {"$multiply": ["$amount", "$price"]}
+                        },
+                    }
+                },
+            ]
+        ).to_list()
+        for row in windows:
+            tickers[row["_id"]] = CurrencyMarketTicker(
+                market_code=row["_id"],
+                last_price=row["last_price"],
+                open_24=row["open_24"],
+                pair1_volume_24=row["pair1_volume_24"],
+                pair2_volume_24=row["pair2_volume_24"],
+            )
+
+        # quiet markets keep the price of their last trade, one indexed lookup each
+        collection = CurrencyMarketTradeDocument.get_motor_collection()
+        for market_code in await collection.distinct("market_code"):
+            if market_code in tickers:
+                continue
+
+            last = await collection.find_one(
+                {"market_code": market_code},
+                {"price": 1},
+                sort=[("created_time", -1)],
+            )
+            if last is not None:
+                tickers[market_code] = CurrencyMarketTicker(
+                    market_code=market_code, last_price=last["price"]
+                )
+
+        return list(tickers.values())
+
     async def all_descending_limit_by_day(
         self, market_code: str
     ) -> list[CurrencyMarketTradeDocument] | None:
@@ -747,18 +574,194 @@ class BeaniCurrencyMarketTradeRepositoryAdapter(CurrencyMarketTradeRepositoryPor
             .to_list()
         )
 
-    async def create_trade(
-        self, trade: CurrencyMarketTrade
-    ) -> CurrencyMarketTrade | None:
-        trade = CurrencyMarketTradeDocument(
-            market_code=trade.market_code,
-            price=trade.price,
-            amount=trade.amount,
-            created_time=datetime.utcnow(),
+
+# Candle interval -> $dateTrunc unit and binSize
+CANDLE_DATE_TRUNC = {
+    "1m": ("minute", 1),
+    "15m": ("minute", 15),
+    "1h": ("hour", 1),
+    "1d": ("day", 1),
+}
+
+
+def candle_operations(trades: list[CurrencyMarketTrade]) -> list[UpdateOne]:
+    """
+    One upsert per market, interval and candle touched by `trades` (oldest first).
+    """
+    candles = {}
+    for trade in trades:
+        for interval in CANDLE_INTERVALS:
+            key = (
+                trade.market_code,
+                interval,
+                candle_bucket(trade.created_time, interval),
+            )
+            candle = candles.get(key)
+            if candle is None:
+                candles[key] = {
+                    "open": trade.price,
+                    "high": trade.price,
+                    "low": trade.price,
+                    "close": trade.price,
+                    "volume": trade.amount,
+                }
+            else:
+                candle["high"] = max(candle["high"], trade.price)
+                candle["low"] = min(candle["low"], trade.price)
+                candle["close"] = trade.price
+                candle["volume"] += trade.amount
+
+    return [
+        UpdateOne(
+            {"market_code": market_code, "interval": interval, "bucket": bucket},
+            {
+                "$setOnInsert": {"open": candle["open"]},
+                "$max": {"high": candle["high"]},
+                "$min": {"low": candle["low"]},
+                "$set": {"close": candle["close"]},
+                "$inc": {"volume": candle["volume"]},
+            },
+            upsert=True,
+        )
+        for (market_code, interval, bucket), candle in candles.items()
+    ]
+
+
+def filled_order_operation(order: CurrencyMarketOrderDocument) -> UpdateOne:
+    """
+    Same revision check save_changes does: only applies if the order is still the one we loaded.
+    """
+    previous_revision = order._previous_revision_id
+    return UpdateOne(
+        {
+            "_id": order.id,
+            "revision_id": Binary.from_uuid(previous_revision)
+            if previous_revision
+            else None,
+        },
+        {
+            "$set": {
+                "amount_filled": order.amount_filled,
+                "state": order.state,
+                "updated_time": order.updated_time,
+                "revision_id": Binary.from_uuid(order.revision_id),
+            }
+        },
+    )
+
+
+def revert_fill_operation(order: CurrencyMarketOrderDocument) -> UpdateOne:
+    """
+    Undoes filled_order_operation, only on the orders it did write (they hold our new revision).
+    """
+    saved = order.get_saved_state() or {}
+    previous_revision = order._previous_revision_id
+    return UpdateOne(
+        {"_id": order.id, "revision_id": Binary.from_uuid(order.revision_id)},
+        {
+            "$set": {
+                "amount_filled": saved.get("amount_filled"),
+                "state": saved.get("state"),
+                "updated_time": saved.get("updated_time"),
+                "revision_id": Binary.from_uuid(previous_revision)
+                if previous_revision
+                else None,
+            }
+        },
+    )
+
+
+class BeaniCurrencyMarketSettlementAdapter(CurrencyMarketSettlementPort):
+    def __init__(self, use_transaction: bool = False):
+        # Transactions need a replica set, without them a failure half way leaves
+        # the earlier collections written (orders are always written first).
+        self.use_transaction = use_transaction
+
+    async def settle(
+        self, settlement: CurrencyMarketSettlement
+    ) -> CurrencyMarketOrder | None:
+        if not self.use_transaction:
+            return await self._settle(settlement)
+
+        client = CurrencyMarketOrderDocument.get_motor_collection().database.client
+        async with await client.start_session() as session:
+            async with session.start_transaction():
+                return await self._settle(settlement, session)
+
+    @staticmethod
+    async def _write_fills(filled_orders: list, session=None):
+        """
+        Writes the filled resting orders before anything else, nothing else is written if any
+        of them changed since it was loaded.
+        """
+        if not filled_orders:
+            return
+
+        collection = CurrencyMarketOrderDocument.get_motor_collection()
+        result = await collection.bulk_write(
+            [filled_order_operation(order) for order in filled_orders],
+            ordered=False,
+            session=session,
         )
+        if result.matched_count == len(filled_orders):
+            return
+
+        # A transaction rolls the others back by itself, without one put them back as loaded
+        if session is None:
+            await collection.bulk_write(
+                [revert_fill_operation(order) for order in filled_orders],
+                ordered=False,
+            )
+
+        raise StaleOrderException()
+
+    async def _settle(self, settlement: CurrencyMarketSettlement, session=None):
+        # Without a transaction this only narrows the window a stale owner could write in
+        if settlement.fence is not None and not await settlement.fence(session):
+            raise MarketLeaseLostException()
+
+        await self._write_fills(settlement.filled_orders, session)
 
-        await trade.create()
-        return trade
+        new_order = None
+        if settlement.new_order is not None:
+            new_order = CurrencyMarketOrderDocument(
+                id=PydanticObjectId(), **settlement.new_order.dict()
+            )
+            await CurrencyMarketOrderDocument.get_motor_collection().insert_one(
+                get_dict(new_order, to_db=True), session=session
+            )
+
+        planet_operations = resource_delta_operations(settlement.resource_deltas)
+        if planet_operations:
+            await PlanetDocument.get_motor_collection().bulk_write(
+                planet_operations, session=session
+            )
+
+        if settlement.trades:
+            await CurrencyMarketTradeDocument.get_motor_collection().bulk_write(
+                [
+                    InsertOne(
+                        get_dict(CurrencyMarketTradeDocument(**trade.dict()), to_db=True)
+                    )
+                    for trade in settlement.trades
+                ],
+                session=session,
+            )
+
+            await CurrencyMarketCandleDocument.get_motor_collection().bulk_write(
+                candle_operations(settlement.trades), session=session
+            )
+
+        # Documents now match what is stored, keep them writable for the next fill
+        for order in settlement.filled_orders:
+            order._save_state()
+            order._swap_revision()
+
+        if new_order is not None:
+            new_order._save_state()
+            new_order._swap_revision()
+
+        return new_order
 
 
 class BeaniUserRepositoryAdapter(UserRepositoryPort):
@@ -769,9 +772,12 @@ class BeaniUserRepositoryAdapter(UserRepositoryPort):
             .sort(-UserDocument.level)\
             .to_list()
 
-    async def update(self, user: UserDocument) -> User:
-        await user.save_changes()
-        return await self.find_user(str(user.wallet))
+    async def update(self, user: UserDocument, reload=False) -> User:
+        await save_in_place(user)
+        if reload:
+            return await self.find_user(str(user.wallet))
+
+        return user
 
     async def all(self) -> list[User] | None:
         return await UserDocument.all().to_list()
@@ -799,11 +805,33 @@ class BeaniUserRepositoryAdapter(UserRepositoryPort):
 
 class BeaniPlanetRepositoryAdapter(PlanetRepositoryPort):
 
-    async def planet_leaderboard(self, page: int, per_page: int) -> list[Planet] | None:
-        return await PlanetDocument.find(PlanetDocument.claimed == True).aggregate(
-            [{"$sort": {"level": -1, "experience": -1}}],
-            projection_model=PlanetDocument
-        ).to_list()
+    @staticmethod
+    async def _views(view_model, query: dict, **kwargs) -> list:
+        cursor = PlanetDocument.get_motor_collection().find(
+            query, planet_projection(view_model), **kwargs
+        )
+        return [planet_view(view_model, document) async for document in cursor]
+
+    @staticmethod
+    async def _view(view_model, planet_id: str):
+        document = await PlanetDocument.get_motor_collection().find_one(
+            {"_id": PydanticObjectId(planet_id)}, planet_projection(view_model)
+        )
+        if document is None:
+            return None
+
+        return planet_view(view_model, document)
+
+    async def planet_leaderboard(
+        self, page: int, per_page: int
+    ) -> list[PlanetLeaderboardView]:
+        return await self._views(
+            PlanetLeaderboardView,
+            {"claimed": True},
+            sort=[("level", -1), ("experience", -1)],
+            skip=page * per_page,
+            limit=per_page,
+        )
 
     async def all_claimed_planets_count(self) -> int:
         planets = await PlanetDocument.find(PlanetDocument.claimed == True).count()
@@ -831,26 +859,19 @@ class BeaniPlanetRepositoryAdapter(PlanetRepositoryPort):
 
         return planets
 
-    async def occupied_positions_by_range(
+    async def positions_by_range(
         self,
         galaxy: int,
         from_solar_system: int,
         to_solar_system: int,
-    ) -> dict[str, bool]:
-
-        planets = await PlanetDocument.find(
-            PlanetDocument.galaxy == galaxy,
-            PlanetDocument.solar_system >= from_solar_system,
-            PlanetDocument.solar_system <= to_solar_system,
-            fetch_links=False,
-        ).to_list()
-
-        re = {}
-        for planet in planets:
-            pos = f"{planet.galaxy}:{planet.solar_system}:{planet.position}"
-            re[pos] = True
-
-        return re
+    ) -> list[PlanetPositionView]:
+        return await self._views(
+            PlanetPositionView,
+            {
+                "galaxy": galaxy,
+                "solar_system": {"$gte": from_solar_system, "$lte": to_solar_system},
+            },
+        )
 
     async def all_user_planets(self, user_id: str, fetch_links=False) -> list[Planet]:
         planets = await PlanetDocument.find(
@@ -858,9 +879,52 @@ class BeaniPlanetRepositoryAdapter(PlanetRepositoryPort):
         ).to_list()
         return planets
 
-    async def update(self, planet: PlanetDocument) -> Planet:
-        await planet.save_changes()
-        return await self.get(str(planet.id))
+    async def inc_resources(
+        self, deltas: dict[str, dict[str, float]], check_funds=False
+    ) -> bool:
+        collection = PlanetDocument.get_motor_collection()
+        if not check_funds:
+            operations = resource_delta_operations(deltas)
+            if not operations:
+                return True
+
+            result = await collection.bulk_write(operations)
+            return result.matched_count == len(operations)
+
+        # One guarded update per planet, so a refused one can undo those already applied
+        applied = {}
+        for planet_id, planet_deltas in deltas.items():
+            operations = resource_delta_operations({planet_id: planet_deltas}, True)
+            if not operations:
+                continue
+
+            result = await collection.bulk_write(operations)
+            if result.matched_count != len(operations):
+                undo = {
+                    applied_id: {
+                        resource: -amount for resource, amount in applied_deltas.items()
+                    }
+                    for applied_id, applied_deltas in applied.items()
+                }
+                if undo:
+                    await collection.bulk_write(resource_delta_operations(undo))
+                return False
+
+            applied[planet_id] = planet_deltas
+
+        return True
+
+    async def update(self, planet: PlanetDocument, reload=False) -> Planet:
+        await save_in_place(planet)
+        if reload:
+            return await self.get(str(planet.id))
+
+        return planet
+
+    async def get_many(self, planet_ids: list[str]) -> list[Planet]:
+        return await PlanetDocument.find(
+            In(PlanetDocument.id, [PydanticObjectId(i) for i in planet_ids])
+        ).to_list()
 
     async def get_my_planet(
         self, user_id: str, planet_id: str, fetch_links=False
@@ -903,6 +967,71 @@ class BeaniPlanetRepositoryAdapter(PlanetRepositoryPort):
 
         return last_planet[0]
 
+    async def tier_view(self, planet_id: str) -> PlanetTierView | None:
+        return await self._view(PlanetTierView, planet_id)
+
+    async def save_tier(self, view: PlanetTierView):
+        result = await PlanetDocument.get_motor_collection().update_one(
+            {"_id": PydanticObjectId(view.id), "revision_id": revision_filter(view)},
+            {
+                "$set": {
+                    "tier": view.tier.dict(),
+                    "revision_id": Binary.from_uuid(uuid4()),
+                }
+            },
+        )
+        if result.matched_count == 0:
+            raise RevisionIdWasChanged
+
+    async def nft_view(self, planet_id: str) -> PlanetNftView | None:
+        return await self._view(PlanetNftView, planet_id)
+
+    async def resource_views(
+        self, batch_size: int = 1000
+    ) -> AsyncIterator[list[PlanetResourcesView]]:
+        cursor = PlanetDocument.get_motor_collection().find(
+            {"claimed": True},
+            planet_projection(PlanetResourcesView),
+            batch_size=batch_size,
+        )
+
+        batch = []
+        async for document in cursor:
+            batch.append(planet_view(PlanetResourcesView, document))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    async def save_resources(self, views: list[PlanetResourcesView]) -> int:
+        if not views:
+            return 0
+
+        operations = [
+            UpdateOne(
+                {
+                    "_id": PydanticObjectId(view.id),
+                    "revision_id": revision_filter(view),
+                },
+                {
+                    "$set": {
+                        "resources": view.resources.dict(),
+                        "reserves": view.reserves.dict(),
+                        # like resource_delta_operations, stale PlanetDocuments must not overwrite it
+                        "revision_id": Binary.from_uuid(uuid4()),
+                    }
+                },
+            )
+            for view in views
+        ]
+        result = await PlanetDocument.get_motor_collection().bulk_write(
+            operations, ordered=False
+        )
+
+        return result.modified_count
+
     async def create_planet(self, planet_data: Planet) -> Planet:
         user = await UserDocument.find_one(UserDocument.wallet == planet_data.user)
 
@@ -950,8 +1079,8 @@ class BeaniPlanetRepositoryAdapter(PlanetRepositoryPort):
 
 class BeaniVoucherRepositoryAdapter(VoucherRepositoryPort):
     async def update(self, voucher: VoucherDocument) -> Voucher:
-        await voucher.save_changes()
-        return await self.find_voucher(voucher.voucher_id)
+        await save_in_place(voucher)
+        return voucher
 
     async def find_voucher(self, voucher_code: str) -> Voucher | None:
         voucher = await VoucherDocument.find_one(
@@ -4,10 +4,12 @@ from datetime import datetime
 from typing import List, Optional
 
 from beanie import Document, Indexed, Link, PydanticObjectId
+from pymongo import IndexModel
 
 from core.shared.models import (
     BKMTransaction,
     BuildableItem,
+    CurrencyMarketCandle,
     CurrencyMarketOrder,
     CurrencyMarketTrade,
     Email,
@@ -30,6 +32,7 @@ class EmailDocument(Document, Email):
     read: bool = False
     planet: str
     topic: str = None
+    created: float = None
 
     # def to_email(self) -> Email:
     #     return Email(id=str(self.id), title=self.title, sub_title=self.sub_title, template=self.template,
@@ -44,6 +47,8 @@ class EmailDocument(Document, Email):
         name = "emails"
         use_revision = True
         use_state_management = True
+        # the inbox of a planet, newest first
+        indexes = [IndexModel([("planet", 1), ("created", -1), ("_id", -1)])]
 
 
 # INFO: Seems like order matters, if I put this below planet it wont create DBRef in db (no reference)
@@ -114,7 +119,6 @@ class PlanetDocument(Document, Planet):
     building_queue: BuildingQueue = None
     energy_deposits: list[Link[EnergyDepositDocument]] = []
     bkm_deposits: list[Link[BKMTransactionDocument]] = []
-    emails: list[Link[EmailDocument]] = []
 
     price_paid: int = 0
 
@@ -168,6 +172,19 @@ class CurrencyMarketTradeDocument(Document, CurrencyMarketTrade):
         name = "currency_market_trade"
         use_revision = True
         use_state_management = True
+        # last trade of a market, see market_tickers
+        indexes = [IndexModel([("market_code", 1), ("created_time", -1)])]
+
+
+class CurrencyMarketCandleDocument(Document, CurrencyMarketCandle):
+    class Settings:
+        name = "currency_market_candle"
+        # Candles are only written through upserts on this key
+        indexes = [
+            IndexModel(
+                [("market_code", 1), ("interval", 1), ("bucket", 1)], unique=True
+            )
+        ]
 
 
 class VoucherDocument(Document, Voucher):
@@ -1,11 +1,22 @@
+import asyncio
 from dataclasses import dataclass
 import pickle
 import time
 
+from decouple import config
+import emcache
 from emcache import Client
 
 from core.shared.ports import CacheServicePort
 
+# What a missing or failing memcached raises, the cache is optional so callers get a miss instead
+CACHE_ERRORS = (
+    emcache.ClusterNoAvailableNodes,
+    emcache.CommandError,
+    asyncio.TimeoutError,
+    OSError,
+)
+
 
 @dataclass
 class MemCacheCacheServiceAdapter(CacheServicePort):
@@ -24,16 +35,39 @@ class MemCacheCacheServiceAdapter(CacheServicePort):
                 # Do not ask for an explicit reply from Memcached
                 noreply=False,
             )
-        except Exception as ex:
+        except CACHE_ERRORS:
             pass
 
     async def get(self, key: str):
         try:
             item = await self.client.get(key.encode())
-        except:
+        except CACHE_ERRORS:
             return None
 
         if item is None:
             return None
 
         return pickle.loads(item.value)
+
+    async def get_many(self, keys: list[str]) -> dict:
+        try:
+            items = await self.client.get_many([key.encode() for key in keys])
+        except CACHE_ERRORS:
+            return {}
+
+        return {key.decode(): pickle.loads(item.value) for key, item in items.items()}
+
+    async def close(self):
+        await self.client.close()
+
+
+async def cache_dependency() -> MemCacheCacheServiceAdapter:
+    client = await emcache.create_client(
+        node_addresses=[
+            emcache.MemcachedHostAddress(
+                config("CACHE_HOST"), int(config("CACHE_PORT"))
+            )
+        ]
+    )
+
+    return MemCacheCacheServiceAdapter(client)
@@ -0,0 +1,64 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import CollectionInvalid
+
+from core.shared.ports import ChatRepositoryPort
+
+
+class MongoChatRepositoryAdapter(ChatRepositoryPort):
+    """
+    Chat messages of every frequency in one capped collection, the oldest ones are dropped
+    by MongoDB once it reaches `size` bytes.
+    """
+
+    def __init__(
+        self,
+        database: AsyncIOMotorDatabase,
+        collection_name: str = "chat_messages",
+        size: int = 64 * 1024 * 1024,
+    ):
+        self.database = database
+        self.collection_name = collection_name
+        self.size = size
+        self.collection = None
+
+    async def _collection(self):
+        if self.collection is None:
+            try:
+                await self.database.create_collection(
+                    self.collection_name, capped=True, size=self.size
+                )
+            except CollectionInvalid:
+                # already there
+                pass
+
+            collection = self.database[self.collection_name]
+            await collection.create_index(
+                [("frequency", ASCENDING), ("timestamp", DESCENDING)]
+            )
+            self.collection = collection
+
+        return self.collection
+
+    async def add(self, message: dict):
+        collection = await self._collection()
+        # insert_one sets _id on the dict it is given
+        await collection.insert_one(dict(message))
+
+    async def last(
+        self, frequency: str, before: float | None, limit: int
+    ) -> list[dict]:
+        query = {"frequency": frequency}
+        if before is not None:
+            query["timestamp"] = {"$lt": before}
+
+        collection = await self._collection()
+        messages = (
+            await collection.find(query, {"_id": 0})
+            .sort("timestamp", DESCENDING)
+            .limit(limit)
+            .to_list(limit)
+        )
+        messages.reverse()
+
+        return messages
@@ -0,0 +1,135 @@
+import time
+
+from decouple import config
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.shared.ports import MarketLeasePort
+
+
+class InMemoryMarketLeaseAdapter(MarketLeasePort):
+    """
+    Single process only, goes together with InMemoryPubSubAdapter.
+    """
+
+    def __init__(self):
+        self.leases: dict[str, tuple[str, float]] = {}
+        # kept when a lease is released, so a released market never reuses an epoch
+        self.epochs: dict[str, int] = {}
+
+    def _holder(self, market_code: str) -> str | None:
+        lease = self.leases.get(market_code)
+        if lease is None or lease[1] < time.monotonic():
+            return None
+
+        return lease[0]
+
+    async def acquire(self, market_code: str, owner: str, seconds: float) -> int | None:
+        holder = self._holder(market_code)
+        if holder is not None and holder != owner:
+            return None
+
+        if holder is None:
+            self.epochs[market_code] = self.epochs.get(market_code, 0) + 1
+
+        self.leases[market_code] = (owner, time.monotonic() + seconds)
+        return self.epochs[market_code]
+
+    async def owner(self, market_code: str) -> str | None:
+        return self._holder(market_code)
+
+    async def release(self, market_code: str, owner: str):
+        if self._holder(market_code) == owner:
+            del self.leases[market_code]
+
+    async def fence(self, market_code: str, owner: str, epoch: int, session=None) -> bool:
+        return (
+            self._holder(market_code) == owner
+            and self.epochs.get(market_code) == epoch
+        )
+
+
+class MongoMarketLeaseAdapter(MarketLeasePort):
+    """
+    One document per market. Taking an expired lease or renewing our own is a single
+    conditional upsert, the unique _id makes it fail while someone else holds it.
+
+    Expiry is compared against the server's clock ($$NOW), never the hosts', so clock skew
+    between workers can't hand a market to two of them. Needs MongoDB 4.2+.
+    """
+
+    def __init__(
+        self, database: AsyncIOMotorDatabase, collection_name: str = "market_leases"
+    ):
+        self.collection = database[collection_name]
+
+    async def acquire(self, market_code: str, owner: str, seconds: float) -> int | None:
+        held = {"$and": [{"$eq": ["$owner", owner]}, {"$gte": ["$expires", "$$NOW"]}]}
+        try:
+            lease = await self.collection.find_one_and_update(
+                {
+                    "_id": market_code,
+                    "$or": [
+                        {"owner": owner},
+                        {"$expr": {"$lt": ["$expires", "$$NOW"]}},
+                    ],
+                },
+                [
+                    {
+                        "$set": {
+                            # a new epoch unless we are renewing a lease we still hold
+                            "epoch": {
+                                "$cond": [
+                                    held,
+                                    "$epoch",
+                                    {"$add": [{"$ifNull": ["$epoch", 0]}, 1]},
+                                ]
+                            },
+                            "owner": {"$literal": owner},
+                            "expires": {"$add": ["$$NOW", int(seconds * 1000)]},
+                        }
+                    }
+                ],
+                projection={"epoch": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            return None
+
+        return lease["epoch"]
+
+    async def owner(self, market_code: str) -> str | None:
+        lease = await self.collection.find_one(
+            {"_id": market_code, "$expr": {"$gte": ["$expires", "$$NOW"]}}
+        )
+        return lease["owner"] if lease is not None else None
+
+    async def release(self, market_code: str, owner: str):
+        # the document stays for its epoch, an unset expiry counts as expired
+        await self.collection.update_one(
+            {"_id": market_code, "owner": owner}, {"$unset": {"expires": ""}}
+        )
+
+    async def fence(self, market_code: str, owner: str, epoch: int, session=None) -> bool:
+        # A write and not a read: inside a transaction, a takeover meanwhile conflicts with it
+        result = await self.collection.update_one(
+            {
+                "_id": market_code,
+                "owner": owner,
+                "epoch": epoch,
+                "$expr": {"$gte": ["$expires", "$$NOW"]},
+            },
+            {"$currentDate": {"fenced": True}},
+            session=session,
+        )
+        return result.matched_count == 1
+
+
+def market_lease_dependency(database) -> MarketLeasePort:
+    # Leases are only shared across processes along with their events
+    if config("PUBSUB_DRIVER", default="memory") == "mongo":
+        return MongoMarketLeaseAdapter(database)
+
+    return InMemoryMarketLeaseAdapter()
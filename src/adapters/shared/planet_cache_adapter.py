@@ -0,0 +1,247 @@
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+from beanie import PydanticObjectId
+from beanie.exceptions import RevisionIdWasChanged
+from bson import Binary
+
+from adapters.shared.beani_repository_adapter import (
+    BeaniPlanetRepositoryAdapter,
+    save_in_place,
+)
+from adapters.shared.beanie_models_adapter import PlanetDocument
+from core.shared.models import Planet, PlanetTierView
+
+
+@dataclass
+class PlanetSession:
+    """
+    The planets loaded while handling one request, one instance per planet id.
+    """
+
+    planets: dict[str, PlanetDocument] = field(default_factory=dict)
+    dirty: set[str] = field(default_factory=set)
+    open: bool = True
+    # False: `update` saves right away instead of on `flush`
+    write_behind: bool = True
+
+
+planet_session: ContextVar[PlanetSession | None] = ContextVar(
+    "planet_session", default=None
+)
+
+
+class CachedPlanetRepositoryAdapter(BeaniPlanetRepositoryAdapter):
+    """
+    Keeps hot planets resident in the worker and, inside a `session`, hands every use case the
+    same Planet instance. `update` only marks it dirty, dirty planets are saved once on `flush`
+    (write-behind) unless the session turned `write_behind` off. A resident planet is reused
+    after checking its revision id, a tiny read instead of loading the whole document again.
+
+    Outside a session it behaves exactly like BeaniPlanetRepositoryAdapter.
+    """
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.resident: OrderedDict[str, PlanetDocument] = OrderedDict()
+
+    @staticmethod
+    def _session() -> PlanetSession | None:
+        session = planet_session.get()
+        if session is None or not session.open:
+            return None
+
+        return session
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[PlanetSession]:
+        """
+        Dirty planets are flushed when the block exits without raising,
+        a RevisionIdWasChanged from that flush means their changes were not saved.
+        """
+        session = PlanetSession()
+        token = planet_session.set(session)
+        try:
+            yield session
+            await self.flush()
+        finally:
+            session.open = False
+            planet_session.reset(token)
+
+    async def flush(self):
+        session = self._session()
+        if session is None:
+            return
+
+        conflict = None
+        for planet_id in list(session.dirty):
+            try:
+                await self._save(session.planets[planet_id])
+            except RevisionIdWasChanged as ex:
+                # someone else saved it meanwhile, next get loads their version
+                session.planets.pop(planet_id, None)
+                self.resident.pop(planet_id, None)
+                conflict = ex
+            finally:
+                session.dirty.discard(planet_id)
+
+        if conflict is not None:
+            raise conflict
+
+    def discard(self):
+        """
+        Forgets the session's unsaved changes, the next get reads the planets again.
+        """
+        session = self._session()
+        if session is None:
+            return
+
+        for planet_id in session.dirty:
+            session.planets.pop(planet_id, None)
+            self.resident.pop(planet_id, None)
+
+        session.dirty.clear()
+
+    async def _save(self, planet: PlanetDocument):
+        await save_in_place(planet)
+        self._keep(planet)
+
+    def _keep(self, planet: PlanetDocument):
+        planet_id = str(planet.id)
+        # a copy, the session's instance keeps being changed until it is saved
+        self.resident[planet_id] = planet.copy(deep=True)
+        self.resident.move_to_end(planet_id)
+        while len(self.resident) > self.size:
+            self.resident.popitem(last=False)
+
+    async def _resident(self, planet_id: str) -> PlanetDocument | None:
+        resident = self.resident.get(planet_id)
+        if resident is not None:
+            current = await PlanetDocument.get_motor_collection().find_one(
+                {"_id": PydanticObjectId(planet_id)}, {"revision_id": 1}
+            )
+            revision_id = current.get("revision_id") if current else None
+            if isinstance(revision_id, Binary):
+                revision_id = revision_id.as_uuid()
+
+            # documents without a revision id can't be checked, those are always reloaded
+            if revision_id is not None and revision_id == resident._previous_revision_id:
+                self.resident.move_to_end(planet_id)
+                return resident.copy(deep=True)
+
+            self.resident.pop(planet_id, None)
+
+        planet = await super().get(planet_id)
+        if planet is not None:
+            self._keep(planet)
+
+        return planet
+
+    async def get(self, planet_id: str, fetch_links=False) -> Planet | None:
+        session = self._session()
+        if session is None:
+            return await super().get(planet_id, fetch_links)
+
+        planet = session.planets.get(planet_id)
+        if planet is not None and not fetch_links:
+            return planet
+
+        if fetch_links:
+            # resident planets come without links, load it whole and make it the session's
+            if planet_id in session.dirty:
+                session.dirty.discard(planet_id)
+                await self._save(planet)
+
+            planet = await super().get(planet_id, fetch_links)
+        else:
+            planet = await self._resident(planet_id)
+
+        if planet is not None:
+            session.planets[planet_id] = planet
+
+        return planet
+
+    async def get_my_planet(
+        self, user_id: str, planet_id: str, fetch_links=False
+    ) -> Planet | None:
+        if self._session() is None:
+            return await super().get_my_planet(user_id, planet_id, fetch_links)
+
+        planet = await self.get(planet_id, fetch_links)
+        if planet is None or planet.user != user_id:
+            return None
+
+        return planet
+
+    async def update(self, planet: PlanetDocument, reload=False) -> Planet:
+        session = self._session()
+        if session is None:
+            return await super().update(planet, reload)
+
+        planet_id = str(planet.id)
+        if session.planets.get(planet_id) is planet and not reload:
+            await self._changed(session, planet_id)
+            return planet
+
+        # not the session's instance (e.g. from all_user_planets), write it through. Changes
+        # pending on the session's instance are saved first, both changed it means a conflict.
+        if planet_id in session.dirty:
+            session.dirty.discard(planet_id)
+            await self._save(session.planets[planet_id])
+
+        self.resident.pop(planet_id, None)
+        planet = await super().update(planet, reload)
+        session.planets[planet_id] = planet
+
+        return planet
+
+    async def _changed(self, session: PlanetSession, planet_id: str):
+        session.dirty.add(planet_id)
+        if not session.write_behind:
+            await self.flush()
+
+    async def tier_view(self, planet_id: str) -> PlanetTierView | None:
+        if self._session() is None:
+            return await super().tier_view(planet_id)
+
+        # the request goes on with the whole planet anyway, load it into the session
+        planet = await self.get(planet_id)
+        if planet is None:
+            return None
+
+        return PlanetTierView(
+            id=planet_id,
+            revision_id=planet._previous_revision_id,
+            tier=planet.tier.copy(),
+        )
+
+    async def save_tier(self, view: PlanetTierView):
+        session = self._session()
+        planet = session.planets.get(view.id) if session is not None else None
+        if planet is None:
+            self.resident.pop(view.id, None)
+            return await super().save_tier(view)
+
+        planet.tier = view.tier
+        await self._changed(session, view.id)
+
+    async def inc_resources(
+        self, deltas: dict[str, dict[str, float]], check_funds=False
+    ) -> bool:
+        session = self._session()
+        if session is not None:
+            for planet_id in deltas:
+                # the $inc applies on top of what this request changed, then we reload
+                if planet_id in session.dirty:
+                    session.dirty.discard(planet_id)
+                    await self._save(session.planets[planet_id])
+
+                session.planets.pop(planet_id, None)
+
+        for planet_id in deltas:
+            self.resident.pop(planet_id, None)
+
+        return await super().inc_resources(deltas, check_funds)
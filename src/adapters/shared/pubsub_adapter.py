@@ -0,0 +1,127 @@
+import asyncio
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from decouple import config
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+from adapters.shared.logging_adapter import get_logger
+from core.shared.ports import PubSubPort
+
+logger = get_logger("pubsub")
+
+
+async def dispatch(handlers: list[Callable[[dict], Awaitable[None]]], message: dict):
+    for handler in handlers:
+        try:
+            await handler(message)
+        except Exception as ex:
+            # one failing handler must not stop the rest nor the subscription
+            logger.error(f"pubsub handler failed: {ex}")
+
+
+class InMemoryPubSubAdapter(PubSubPort):
+    """
+    Single process only, what runs with one websocket worker (and in tests).
+    """
+
+    def __init__(self):
+        self.handlers: dict[str, list[Callable[[dict], Awaitable[None]]]] = {}
+
+    async def publish(self, channel: str, message: dict):
+        await dispatch(self.handlers.get(channel, []), message)
+
+    async def subscribe(
+        self, channel: str, handler: Callable[[dict], Awaitable[None]]
+    ):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    async def close(self):
+        self.handlers = {}
+
+
+class MongoPubSubAdapter(PubSubPort):
+    """
+    Messages are inserted into a capped collection that every process follows with a
+    tailable cursor, so it needs nothing besides the database we already have.
+    """
+
+    def __init__(
+        self,
+        database: AsyncIOMotorDatabase,
+        collection_name: str = "pubsub_events",
+        size: int = 16 * 1024 * 1024,
+    ):
+        self.database = database
+        self.collection_name = collection_name
+        self.size = size
+        self.handlers: dict[str, list[Callable[[dict], Awaitable[None]]]] = {}
+        self.tail_task: asyncio.Task | None = None
+        self.collection = None
+
+    async def _collection(self):
+        if self.collection is None:
+            try:
+                await self.database.create_collection(
+                    self.collection_name, capped=True, size=self.size
+                )
+            except CollectionInvalid:
+                # already there
+                pass
+
+            self.collection = self.database[self.collection_name]
+
+        return self.collection
+
+    async def publish(self, channel: str, message: dict):
+        collection = await self._collection()
+        await collection.insert_one(
+            {"channel": channel, "message": message, "created_time": datetime.utcnow()}
+        )
+
+    async def subscribe(
+        self, channel: str, handler: Callable[[dict], Awaitable[None]]
+    ):
+        self.handlers.setdefault(channel, []).append(handler)
+        if self.tail_task is None:
+            collection = await self._collection()
+            self.tail_task = asyncio.create_task(self._tail(collection))
+
+    async def _tail(self, collection):
+        # Only what is published from now on
+        newest = await collection.find().sort("$natural", -1).limit(1).to_list(1)
+        last_id = newest[0]["_id"] if newest else None
+
+        while True:
+            query = {} if last_id is None else {"_id": {"$gt": last_id}}
+            cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                while cursor.alive:
+                    async for event in cursor:
+                        last_id = event["_id"]
+                        await dispatch(
+                            self.handlers.get(event["channel"], []), event["message"]
+                        )
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                logger.error(f"pubsub tail failed: {ex}")
+
+            # tailable cursors die on an empty collection, retry shortly
+            await asyncio.sleep(0.5)
+
+    async def close(self):
+        if self.tail_task is not None:
+            self.tail_task.cancel()
+            await asyncio.gather(self.tail_task, return_exceptions=True)
+            self.tail_task = None
+
+
+def pubsub_dependency(database) -> PubSubPort:
+    # "memory" only works while the http app and a single websocket worker share a process
+    if config("PUBSUB_DRIVER", default="memory") == "mongo":
+        return MongoPubSubAdapter(database)
+
+    return InMemoryPubSubAdapter()
@@ -63,6 +63,13 @@ async def smart_contract_recover_by_planet_cronjob(controller: CronjobController
         await controller.recover_staking(str(planet.id))
 
 
+async def resources_accrual(controller: CronjobController):
+    await dependencies.logging_adapter.info("Running task: resources_accrual")
+
+    saved = await controller.accrue_resources()
+    await dependencies.logging_adapter.info(f"Resources accrued for {saved} planets")
+
+
 # @TODO: add emails when something got imported
 async def main():
     await dependencies.logging_adapter.info("Cronjobs started")
@@ -90,6 +97,7 @@ async def main():
     #schedule.every(1200).seconds.do(smart_contract_recover_by_user_cronjob, controller)
     schedule.every(50).hours.do(asteroid, controller)
     schedule.every(20).hours.do(space_pirate, controller)
+    schedule.every(600).seconds.do(resources_accrual, controller)
 
     while True:
         await schedule.run_pending()
@@ -2,7 +2,6 @@ import json
 from pathlib import Path
 
 from decouple import config
-import emcache
 
 from adapters.cronjobs import BlackHoleResponsePort
 from adapters.shared.beani_repository_adapter import (
@@ -12,7 +11,7 @@ from adapters.shared.beani_repository_adapter import (
     EmailRepositoryAdapter,
     EnergyDepositRepositoryAdapter,
 )
-from adapters.shared.cache_adapter import MemCacheCacheServiceAdapter
+from adapters.shared.cache_adapter import cache_dependency
 from adapters.shared.evm_adapter import EvmChainServiceAdapter, TokenPriceAdapter
 from adapters.shared.logging_adapter import LoggingAdapter, get_logger
 from controllers.cronjobs import CronjobController
@@ -20,6 +19,7 @@ from core.mint_planet import MintPlanet
 from core.planet_bkm import PlanetBKM
 from core.planet_email import PlanetEmail
 from core.planet_energy import PlanetEnergy
+from core.planet_resources import PlanetResources
 from core.experience_points import ExperiencePoints
 from core.planet_staking import Staking
 from core.pve.asteroid import Asteroid
@@ -30,15 +30,6 @@ response_adapter = BlackHoleResponsePort()
 logging_adapter = LoggingAdapter(get_logger("cronjobs_app"))
 
 
-async def cache_dependency():
-
-    client = await emcache.create_client(
-        [emcache.MemcachedHostAddress(config("CACHE_HOST"), int(config("CACHE_PORT")))]
-    )
-
-    return MemCacheCacheServiceAdapter(client)
-
-
 async def contract_dependency(cache: CacheServicePort):
     root = Path(__file__).parent.parent.parent
     env = config("ENV")
@@ -148,6 +139,8 @@ async def cronjob_controller():
         bkm_repository, planet_repository, logging_adapter, contract, response_adapter
     )
 
+    planet_resources = PlanetResources(planet_repository, response_adapter)
+
     return CronjobController(
         energy_planet_use_case,
         staking_use_case,
@@ -156,4 +149,5 @@ async def cronjob_controller():
         asteroid_pve,
         space_pirate_pve,
         planet_bkm,
+        planet_resources,
     )
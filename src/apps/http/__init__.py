@@ -15,6 +15,7 @@ from starlette.middleware.base import BaseHTTPMiddleware
 # Info, seems like this need to be at the top, also some have src before and others not (maybe due to relationship?)
 from adapters.shared.beanie_models_adapter import (
     BKMTransactionDocument,
+    CurrencyMarketCandleDocument,
     CurrencyMarketOrderDocument,
     CurrencyMarketTradeDocument,
     EmailDocument,
@@ -22,8 +23,9 @@ from adapters.shared.beanie_models_adapter import (
     PlanetDocument,
     UserDocument, VoucherDocument,
 )
+from adapters.shared.cache_adapter import cache_dependency
+from adapters.shared.pubsub_adapter import pubsub_dependency
 import apps.http.dependencies as dependencies
-from apps.http.dependencies import get_middleware
 import apps.http.settings
 from apps.http.urls import register_fastapi_routes
 from core.buildable_items import FinishBuildRequest
@@ -121,15 +123,38 @@ class MyBaseHTTPMiddleware(BaseHTTPMiddleware):
 
 class UpdateDataMiddleWare(MyBaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
+        if request.method == "OPTIONS":
+            return await call_next(request)
+
+        planet_repository = dependencies.planet_repository
         try:
-            if request.method == "OPTIONS":
+            # The tick and the endpoint share one in memory Planet
+            async with planet_repository.session() as session:
+                await self.tick(request)
+                # Only the tick is written behind
+                try:
+                    await planet_repository.flush()
+                except beanie.exceptions.RevisionIdWasChanged as ex:
+                    # flush dropped the stale planet, the endpoint reads it again
+                    await dependencies.logging_adapter.error(
+                        f"planet tick lost a write conflict: {ex}"
+                    )
+
+                session.write_behind = False
                 return await call_next(request)
+        except beanie.exceptions.RevisionIdWasChanged:
+            return JSONResponse(
+                status_code=409,
+                content={"message": "Planet changed meanwhile, please try again"},
+            )
 
+    async def tick(self, request: Request):
+        try:
             (
                 items_use_case,
                 planet_resources_use_case,
                 planet_staking,
-            ) = await get_middleware()
+            ) = request.app.state.middleware
             active_planet = request.headers.get("x-active-planet")
             if active_planet is not None:
                 await planet_staking.tier_expired_reset(planet_id=active_planet)
@@ -139,10 +164,11 @@ class UpdateDataMiddleWare(MyBaseHTTPMiddleware):
                 await planet_resources_use_case(
                     PlanetResourcesUpdateRequest(planet_id=active_planet)
                 )
-        except Exception as e:
-            pass
-
-        return await call_next(request)
+        except Exception as ex:
+            # a failing tick must not fail the request, it's tried again on the next one.
+            # What it half changed is dropped so the endpoint starts from a fresh read.
+            dependencies.planet_repository.discard()
+            await dependencies.logging_adapter.error(f"planet tick failed: {ex}")
 
 
 app.add_middleware(UpdateDataMiddleWare)
@@ -167,6 +193,7 @@ async def app_init():
         # password="example"
     )
 
+    app.state.db_client = client
     db = client[config("DB_NAME")]
     await init_beanie(
         database=db,
@@ -178,15 +205,37 @@ async def app_init():
             EmailDocument,
             CurrencyMarketOrderDocument,
             CurrencyMarketTradeDocument,
+            CurrencyMarketCandleDocument,
             VoucherDocument
         ],
     )
 
-    http_controller = await dependencies.http_controller()
+    # Clients and use cases shared by every request, closed on shutdown
+    cache = await cache_dependency()
+    contract_service = await dependencies.contract_dependency(
+        cache, config("RPCS_URL")
+    )
+    app.state.cache = cache
+    app.state.middleware = await dependencies.get_middleware(cache, contract_service)
+
+    pubsub = pubsub_dependency(db)
+    app.state.pubsub = pubsub
+    http_controller = await dependencies.http_controller(
+        db, cache, contract_service, pubsub
+    )
+    app.state.http_controller = http_controller
     urls = await register_fastapi_routes(http_controller)
     for url in urls:
         app.router.add_api_route(**url)
 
 
+@app.on_event("shutdown")
+async def app_shutdown():
+    await app.state.http_controller.currency_market.close()
+    await app.state.pubsub.close()
+    await app.state.cache.close()
+    app.state.db_client.close()
+
+
 # if __name__ == "__main__":
 #    uvicorn.run("__main__:app", port=8010, host='0.0.0.0', reload=True, workers=1, debug=True)
@@ -2,19 +2,19 @@ import json
 from pathlib import Path
 
 from decouple import config
-import emcache
 
 from adapters.http import HttpResponsePort
 from adapters.shared.beani_repository_adapter import (
     BeaniCurrencyMarketOrderRepositoryAdapter,
+    BeaniCurrencyMarketSettlementAdapter,
     BeaniCurrencyMarketTradeRepositoryAdapter,
-    BeaniPlanetRepositoryAdapter,
     BeaniUserRepositoryAdapter,
     BKMDepositRepositoryAdapter,
     EmailRepositoryAdapter,
     EnergyDepositRepositoryAdapter, BeaniVoucherRepositoryAdapter,
 )
-from adapters.shared.cache_adapter import MemCacheCacheServiceAdapter
+from adapters.shared.planet_cache_adapter import CachedPlanetRepositoryAdapter
+from adapters.shared.market_lease_adapter import market_lease_dependency
 from adapters.shared.evm_adapter import EvmChainServiceAdapter, TokenPriceAdapter
 from adapters.shared.logging_adapter import LoggingAdapter, get_logger
 from adapters.shared.medium_parser import MediumContentParser
@@ -23,6 +23,7 @@ from core.account import Account
 from core.authenticate import Authenticate
 from core.buildable_items import BuildableItems
 from core.currency_market import CurrencyMarket
+from core.currency_market.order_book import OrderBooks
 from core.favourite_planet import FavouritePlanet
 from core.fetch_chain_data import FetchChainData
 from core.get_planets import GetPlanets
@@ -42,26 +43,19 @@ from core.shared.ports import (
     ChainServicePort,
     EmailRepositoryPort,
     PlanetRepositoryPort,
+    PubSubPort,
     TokenPricePort,
     UserRepositoryPort,
 )
 
 http_response_port = HttpResponsePort()
+# Shared by the tick middleware and the endpoints, see CachedPlanetRepositoryAdapter.session
+planet_repository = CachedPlanetRepositoryAdapter(
+    config("PLANET_CACHE_SIZE", default=1024, cast=int)
+)
 logging_adapter = LoggingAdapter(get_logger("http_app"))
 
 
-async def cache_dependency():
-    client = await emcache.create_client(
-        node_addresses=[
-            emcache.MemcachedHostAddress(
-                config("CACHE_HOST"), int(config("CACHE_PORT"))
-            )
-        ]
-    )
-
-    return MemCacheCacheServiceAdapter(client)
-
-
 async def contract_dependency(cache: CacheServicePort, rpc_urls: str):
     root = Path(__file__).parent.parent.parent
     env = config("ENV")
@@ -169,9 +163,14 @@ async def fetch_chain_data_use_case(
     )
 
 
-async def get_planets_use_case(planet_repository: PlanetRepositoryPort):
+async def get_planets_use_case(
+    planet_repository: PlanetRepositoryPort, email_use_case: PlanetEmail
+):
     return GetPlanets(
-        planet_repository, config("PLANET_IMAGES_BUCKET_PATH"), http_response_port
+        planet_repository,
+        config("PLANET_IMAGES_BUCKET_PATH"),
+        http_response_port,
+        email_use_case,
     )
 
 
@@ -301,10 +300,10 @@ async def get_redeem_voucher_use_case(
 # Controllers
 
 
-async def get_middleware():
-    cache = await cache_dependency()
-    contract_service = await contract_dependency(cache, config("RPCS_URL"))
-    planet_repository = BeaniPlanetRepositoryAdapter()
+async def get_middleware(cache: CacheServicePort, contract_service: ChainServicePort):
+    """
+    The use cases of the tick middleware, built once at startup.
+    """
     email_repository = EmailRepositoryAdapter()
     user_repository = BeaniUserRepositoryAdapter()
 
@@ -326,18 +325,23 @@ async def get_middleware():
     return items_use_case, planet_resources, planet_staking
 
 
-async def http_controller():
+async def http_controller(
+    database,
+    cache: CacheServicePort,
+    contract_service: ChainServicePort,
+    pubsub: PubSubPort,
+):
     user_repository = BeaniUserRepositoryAdapter()
-    planet_repository = BeaniPlanetRepositoryAdapter()
     energy_repository = EnergyDepositRepositoryAdapter()
     bkm_repository = BKMDepositRepositoryAdapter()
     email_repository = EmailRepositoryAdapter()
     currency_market_order_repository = BeaniCurrencyMarketOrderRepositoryAdapter()
     currency_market_trade_repository = BeaniCurrencyMarketTradeRepositoryAdapter()
+    currency_market_settlement = BeaniCurrencyMarketSettlementAdapter(
+        config("CURRENCY_MARKET_TRANSACTIONS", default=False, cast=bool)
+    )
     redeem_voucher_repository = BeaniVoucherRepositoryAdapter()
 
-    cache = await cache_dependency()
-    contract_service = await contract_dependency(cache, config("RPCS_URL"))
     contract_mainnet_service = await contract_dependency(
         cache, config("RPCS_URL_MAINNET")
     )
@@ -354,7 +358,7 @@ async def http_controller():
     a = await authenticate_use_case(user_repository, auth_contract_service, planet_repository, email_use_case)
     b = await buy_planet_use_case(token_price, contract_service, planet_repository)
     c = await fetch_chain_data_use_case(token_price, contract_service)
-    d = await get_planets_use_case(planet_repository)
+    d = await get_planets_use_case(planet_repository, email_use_case)
     e = await get_buildable_items_use_case(planet_repository, planet_level_use_case)
     f = await get_planet_energy_use_case(
         token_price,
@@ -378,12 +382,19 @@ async def http_controller():
 
     j = await get_staking_use_case(planet_repository, token_price, contract_service)
 
+    # Books are only resident on the websocket workers holding the markets, this one asks them
     trading_use_case = CurrencyMarket(
         planet_repository,
         currency_market_order_repository,
         currency_market_trade_repository,
+        currency_market_settlement,
+        OrderBooks(),
         http_response_port,
+        cache=cache,
+        pubsub=pubsub,
+        market_leases=market_lease_dependency(database),
     )
+    await trading_use_case.start()
 
     planet_bkm_use_case = await get_planet_bkm_use_case(
         bkm_repository, planet_repository, logging_adapter, contract_service
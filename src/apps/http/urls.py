@@ -11,6 +11,7 @@ from core.get_planets import (
 from core.mint_planet import FetchPlanetCostDataResponse, FetchPlanetCostResponse
 from core.nft_metadata import OpenseaMetadataNftResponse
 from core.planet_bkm import BKMWithdrawResponse
+from core.planet_email import EmailInboxResponse
 from core.planet_staking import CreateStakingResponse, TierInfoResponse
 from core.redeem_voucher import RedeemVoucherResponse
 from core.shared.models import (
@@ -84,6 +85,11 @@ async def register_fastapi_routes(http_controller: HttpController) -> list:
             endpoint=http_controller.fetch_planet_by_id,
             methods=["get"],
         ),
+        dict(
+            path=r"/gamedata",
+            endpoint=http_controller.game_data,
+            methods=["get"],
+        ),
         dict(
             path=r"/planet/build",
             response_model=BuildableResponse,
@@ -143,6 +149,12 @@ async def register_fastapi_routes(http_controller: HttpController) -> list:
             endpoint=http_controller.email_delete,
             methods=["post"],
         ),
+        dict(
+            path=r"/planet/{planet_id}/emails",
+            response_model=EmailInboxResponse,
+            endpoint=http_controller.email_inbox,
+            methods=["get"],
+        ),
         dict(
             path=r"/planet/{planet_id}/email",
             endpoint=http_controller.email_delete_all,
@@ -6,6 +6,7 @@ import uvicorn
 
 # Info, seems like this need to be at the top, also some have src before and others not (maybe due to relationship?)
 from adapters.shared.beanie_models_adapter import (
+    CurrencyMarketCandleDocument,
     CurrencyMarketOrderDocument,
     CurrencyMarketTradeDocument,
     EmailDocument,
@@ -13,6 +14,7 @@ from adapters.shared.beanie_models_adapter import (
     PlanetDocument,
     UserDocument,
 )
+from adapters.shared.cache_adapter import cache_dependency
 import apps.websockets.dependencies as dependencies
 from elasticapm.contrib.starlette import make_apm_client, ElasticAPM
 import elasticapm
@@ -45,10 +47,14 @@ async def app_init():
             EmailDocument,
             CurrencyMarketOrderDocument,
             CurrencyMarketTradeDocument,
+            CurrencyMarketCandleDocument,
         ],
     )
 
-    ws_entry_point = await dependencies.ws_entry_point()
+    # Closed on shutdown
+    app.state.cache = await cache_dependency()
+    ws_entry_point = await dependencies.ws_entry_point(db, app.state.cache)
+    app.state.ws_entry_point = ws_entry_point
     app.add_api_websocket_route(path="/ws", endpoint=ws_entry_point)
 
     async def health():
@@ -56,6 +62,18 @@ async def app_init():
 
     app.router.add_api_route(path=r"/health", endpoint=health)
 
+    async def stats():
+        # live subscribers per topic of this worker
+        return dependencies.websocket_manager.stats()
+
+    app.router.add_api_route(path=r"/stats", endpoint=stats)
+
+
+@app.on_event("shutdown")
+async def app_shutdown():
+    await app.state.ws_entry_point.close()
+    await app.state.cache.close()
+
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -1,66 +1,292 @@
+import asyncio
+from bisect import bisect_left, bisect_right
+from collections import deque
 import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import json
+from operator import itemgetter
+from uuid import uuid4
 
+from decouple import config
 from fastapi import WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 from starlette.websockets import WebSocketState
 
 from adapters.shared.beani_repository_adapter import (
     BeaniCurrencyMarketOrderRepositoryAdapter,
+    BeaniCurrencyMarketSettlementAdapter,
     BeaniCurrencyMarketTradeRepositoryAdapter,
     BeaniPlanetRepositoryAdapter,
 )
+from adapters.shared.chat_adapter import MongoChatRepositoryAdapter
+from adapters.shared.logging_adapter import get_logger
+from adapters.shared.market_lease_adapter import market_lease_dependency
+from adapters.shared.pubsub_adapter import pubsub_dependency
+from apps.websockets.framing import Frame, negotiate
 from controllers.websockets import WebsocketController
 from core.currency_market import CurrencyMarket, TradeRequest
+from core.currency_market.market_stats import MarketStats
+from core.currency_market.order_book import OrderBookLevels, OrderBooks
 from core.shared.models import AppBaseException, MetadataResponse
-from core.shared.ports import ResponsePort
-
+from core.shared.ports import (
+    CacheServicePort,
+    ChatRepositoryPort,
+    PubSubPort,
+    ResponsePort,
+)
 
-class WebsocketConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
+logger = get_logger("websockets")
 
-        self.active_connections.append(websocket)
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+@dataclass
+class WebsocketConnection:
+    """
+    Messages to a socket go through its own bounded queue, drained by its own writer task,
+    so a slow client only ever delays itself.
+    """
+
+    websocket: WebSocket
+    queue: asyncio.Queue
+    writer: asyncio.Task = None
+    encoding: str = "json"  # negotiated at connect, see apps.websockets.framing
+    # reverse index of WebsocketConnectionManager.topics
+    topics: set[str] = field(default_factory=set)
+
+    async def write(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                if self.websocket.client_state != WebSocketState.CONNECTED:
+                    return
+
+                if isinstance(message, Frame):
+                    message = message.encode(self.encoding)
+
+                if isinstance(message, bytes):
+                    await self.websocket.send_bytes(message)
+                else:
+                    await self.websocket.send_text(message)
+            except Exception as ex:
+                # client went away, the receive loop will disconnect it
+                if self.websocket.client_state != WebSocketState.CONNECTED:
+                    return
+
+                # anything else (e.g. a frame that can't be encoded) would leave it silently muted
+                logger.error(f"websocket writer failed, closing it: {ex}")
+                try:
+                    await self.websocket.close(code=1011)
+                except Exception:
+                    pass
+
+                return
+            finally:
+                self.queue.task_done()
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
 
-    async def broadcast(self, message):
-        for connection in self.active_connections:
-            if connection.client_state == WebSocketState.CONNECTED:
-                await connection.send_text(message)
+class WebsocketConnectionManager:
+    def __init__(self, send_queue_size: int = 256, slow_consumer: str = "drop"):
+        self.send_queue_size = send_queue_size
+        # "drop": skip messages a full queue can't take, "disconnect": close that socket
+        self.slow_consumer = slow_consumer
+        self.active_connections: dict[WebSocket, WebsocketConnection] = {}
+        self.topics: dict[str, set[WebSocket]] = {}
 
-    async def broadcast_except(self, message, websocket: WebSocket):
-        for connection in self.active_connections:
-            if connection == websocket:
-                continue
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
 
-            if connection.client_state == WebSocketState.CONNECTED:
-                await connection.send_text(message)
+        connection = WebsocketConnection(
+            websocket,
+            asyncio.Queue(maxsize=self.send_queue_size),
+            encoding=negotiate(websocket.query_params.get("encoding")),
+        )
+        connection.writer = asyncio.create_task(connection.write())
+        self.active_connections[websocket] = connection
 
-    async def broadcast_from_list_except(self, message, websockets: list[WebSocket], websocket: WebSocket):
-        print("broadcast_from_list_except 0")
-        for connection in websockets:
-            print("broadcast_from_list_except 1")
-            if connection == websocket:
-                print("broadcast_from_list_except if")
-                continue
+    def disconnect(self, websocket: WebSocket):
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+
+        connection.writer.cancel()
+        for topic in connection.topics:
+            self._remove_subscriber(topic, websocket)
+
+    async def drain(self, websocket: WebSocket, timeout: float = 5):
+        """
+        Gives the writer a chance to send what is already queued, e.g. an error before closing.
+        """
+        connection = self.active_connections.get(websocket)
+        if connection is None or connection.writer.done():
+            return
 
-            if connection.client_state == WebSocketState.CONNECTED:
-                print("broadcast_from_list_except if2")
-                await connection.send_text(message)
-                print("broadcast_from_list_except if3")
+        try:
+            await asyncio.wait_for(connection.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def subscribe(self, websocket: WebSocket, topic: str):
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            # already disconnected, it would never be removed
+            return
+
+        connection.topics.add(topic)
+        self.topics.setdefault(topic, set()).add(websocket)
+
+    def unsubscribe(self, websocket: WebSocket, topic: str):
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            connection.topics.discard(topic)
+
+        self._remove_subscriber(topic, websocket)
+
+    def _remove_subscriber(self, topic: str, websocket: WebSocket):
+        subscribers = self.topics.get(topic)
+        if subscribers is None:
+            return
+
+        subscribers.discard(websocket)
+        if not subscribers:
+            # topics come from clients, don't keep the empty ones around
+            del self.topics[topic]
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.active_connections),
+            "topics": {
+                topic: len(subscribers) for topic, subscribers in self.topics.items()
+            },
+        }
+
+    def _send(self, message, websocket: WebSocket):
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            return
 
+        try:
+            connection.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            if self.slow_consumer == "disconnect":
+                self.disconnect(websocket)
+                asyncio.create_task(websocket.close(code=1013))  # try again later
 
+    async def send_personal_message(self, message: str | Frame, websocket: WebSocket):
+        self._send(message, websocket)
 
-websocket_manager = WebsocketConnectionManager()
+    async def broadcast(self, message):
+        for websocket in list(self.active_connections):
+            self._send(message, websocket)
+
+    async def publish(self, topic: str, message, websocket: WebSocket = None):
+        """
+        Queues `message` for every subscriber of `topic` except `websocket`, never waits on a socket.
+        """
+        for subscriber in list(self.topics.get(topic, ())):
+            if subscriber != websocket:
+                self._send(message, subscriber)
+
+
+def market_topic(market_code: str, stream: str) -> str:
+    return f"market:{market_code}:{stream}"
+
+
+def chat_topic(frequency: str) -> str:
+    return f"chat:{frequency}"
+
+
+# PubSub channel carrying messages for the sockets held by other workers
+WEBSOCKET_CHANNEL = "websocket"
+
+# Chat messages per replay page when the client doesn't ask for a limit
+CHAT_PAGE_SIZE = 50
+
+
+class ChatHistory:
+    """
+    The newest `size` messages of each frequency stay in memory and older pages are read from
+    the repository, so replaying a chat costs the same however long the chat gets.
+    """
+
+    def __init__(self, repository: ChatRepositoryPort, size: int = 500):
+        self.repository = repository
+        self.size = size
+        self.frequencies: dict[str, deque] = {}
+
+    async def _buffer(self, frequency: str) -> deque:
+        buffer = self.frequencies.get(frequency)
+        if buffer is None:
+            messages = await self.repository.last(frequency, None, self.size)
+            buffer = self.frequencies.setdefault(
+                frequency, deque(messages, maxlen=self.size)
+            )
+
+        return buffer
+
+    def _insert(self, buffer: deque, message: dict):
+        """
+        Keeps the buffer ordered by timestamp, `page` bisects on it. Messages from other
+        workers can arrive after newer ones.
+        """
+        timestamp = message["timestamp"]
+        if not buffer or buffer[-1]["timestamp"] <= timestamp:
+            buffer.append(message)
+            return
+
+        if len(buffer) == self.size:
+            if timestamp < buffer[0]["timestamp"]:
+                # older than everything kept, pages that far back read the repository
+                return
+
+            buffer.popleft()
+
+        buffer.insert(bisect_right(buffer, timestamp, key=itemgetter("timestamp")), message)
+
+    async def add(self, message: dict):
+        buffer = await self._buffer(message["frequency"])
+        self._insert(buffer, message)
+        await self.repository.add(message)
+
+    def remember(self, message: dict):
+        """
+        A message persisted by another worker, frequencies not loaded yet will read it
+        from the repository.
+        """
+        buffer = self.frequencies.get(message["frequency"])
+        if buffer is not None:
+            self._insert(buffer, message)
+
+    async def page(
+        self, frequency: str, before: float = None, limit: int = CHAT_PAGE_SIZE
+    ) -> list[dict]:
+        """
+        Up to `limit` messages older than `before` (the newest ones if None), oldest first.
+        """
+        limit = max(1, min(limit, self.size))
+        buffer = await self._buffer(frequency)
+
+        end = len(buffer)
+        if before is not None:
+            end = bisect_left(buffer, before, key=itemgetter("timestamp"))
+
+        start = max(0, end - limit)
+        messages = [buffer[i] for i in range(start, end)]
+
+        # A full buffer may have dropped older messages, the rest of the page comes from the repository
+        if len(messages) < limit and len(buffer) == self.size:
+            older_than = messages[0]["timestamp"] if messages else before
+            older = await self.repository.last(
+                frequency, older_than, limit - len(messages)
+            )
+            messages = older + messages
+
+        return messages
+
+
+websocket_manager = WebsocketConnectionManager(
+    config("WEBSOCKET_SEND_QUEUE_SIZE", default=256, cast=int),
+    config("WEBSOCKET_SLOW_CONSUMER", default="drop"),
+)
 
 
 @dataclass
@@ -76,14 +302,59 @@ response_port = WebsocketResponsePort()
 class WebsocketEntryPoint:
     websocket_manager: WebsocketConnectionManager
     websocket_controller: WebsocketController
-    chat_messages: dict[str, list[dict[str, str]]]
-    websocket_frequency: dict
+    chat_history: ChatHistory
+    pubsub: PubSubPort
+    worker_id: str = field(default_factory=lambda: uuid4().hex)
+
+    async def start(self):
+        await self.pubsub.subscribe(WEBSOCKET_CHANNEL, self._on_remote_message)
+        await self.websocket_controller.listen_market_changes(
+            self._on_order_book_delta
+        )
 
-    # chat = {
-    #     "1.1": [
-    #         {"sender": "wallet1", "message": "hello"}
-    #     ]
-    # }
+    async def close(self):
+        await self.websocket_controller.close()
+        await self.pubsub.close()
+
+    async def publish(
+        self,
+        topic: str,
+        message: str | Frame,
+        websocket: WebSocket = None,
+        chat: dict = None,
+    ):
+        """
+        Sends to the subscribers of `topic` on this worker and forwards it to the other workers.
+        """
+        await self.websocket_manager.publish(topic, message, websocket)
+
+        event = {"topic": topic, "chat": chat, "origin": self.worker_id}
+        if isinstance(message, Frame):
+            event["frame"] = message.wire()
+        else:
+            event["message"] = message
+
+        await self.pubsub.publish(WEBSOCKET_CHANNEL, event)
+
+    async def _on_remote_message(self, event: dict):
+        if event["origin"] == self.worker_id:
+            return
+
+        chat = event.get("chat")
+        if chat is not None:
+            self.chat_history.remember(chat)
+
+        message = event.get("message")
+        if event.get("frame") is not None:
+            message = Frame.from_wire(event["frame"])
+
+        await self.websocket_manager.publish(event["topic"], message)
+
+    async def _on_order_book_delta(self, delta: OrderBookLevels):
+        # Deltas come from whichever worker holds the market, every worker relays them
+        await self.websocket_manager.publish(
+            market_topic(delta.market_code, "book"), Frame("order_book_delta", delta)
+        )
 
     async def __call__(self, websocket: WebSocket):
         await self.websocket_manager.connect(websocket)
@@ -100,11 +371,15 @@ class WebsocketEntryPoint:
                         '{"response_type": "ping", "data": "pong"}', websocket
                     )
 
+                elif use_case == "subscribe":
+                    self.websocket_manager.subscribe(websocket, data["data"]["topic"])
+
+                elif use_case == "unsubscribe":
+                    self.websocket_manager.unsubscribe(websocket, data["data"]["topic"])
+
                 elif use_case == "subscribe_frequency":
                     frequency = data["data"]["frequency"]
-                    if frequency not in self.websocket_frequency:
-                        self.websocket_frequency[frequency] = []
-                    self.websocket_frequency[frequency].append(websocket)
+                    self.websocket_manager.subscribe(websocket, chat_topic(frequency))
 
                 elif use_case == "emit_frequency":
                     timestamp = datetime.datetime.timestamp(datetime.datetime.now())
@@ -113,14 +388,7 @@ class WebsocketEntryPoint:
                     sender = data["data"]["sender"]
                     sender_alias = data["data"]["sender_alias"]
 
-                    if frequency not in self.websocket_frequency:
-                        self.websocket_frequency[frequency] = [websocket]
-
-                    if websocket not in self.websocket_frequency[frequency]:
-                        self.websocket_frequency[frequency].append(websocket)
-
-                    if frequency not in self.chat_messages:
-                        self.chat_messages[frequency] = []
+                    self.websocket_manager.subscribe(websocket, chat_topic(frequency))
 
                     msg = {
                         "sender": sender,
@@ -130,8 +398,10 @@ class WebsocketEntryPoint:
                         "timestamp": timestamp
                     }
 
-                    self.chat_messages[frequency].append(msg)
-                    await self.websocket_manager.broadcast_from_list_except(json.dumps(msg), self.websocket_frequency[frequency], websocket)
+                    await self.chat_history.add(msg)
+                    await self.publish(
+                        chat_topic(frequency), json.dumps(msg), websocket, chat=msg
+                    )
 
                 elif use_case == "receive_full_chat":
                     frequency = data["data"]["frequency"]
@@ -140,44 +410,46 @@ class WebsocketEntryPoint:
                         "data": []
                     }
 
-                    if frequency in self.chat_messages:
-                        msgs["data"] = self.chat_messages[frequency]
-
-                    if frequency not in self.websocket_frequency:
-                        self.websocket_frequency[frequency] = [websocket]
+                    # A page at a time, older pages by passing the oldest timestamp as `before`
+                    msgs["data"] = await self.chat_history.page(
+                        frequency,
+                        data["data"].get("before"),
+                        data["data"].get("limit", CHAT_PAGE_SIZE),
+                    )
 
-                    if websocket not in self.websocket_frequency[frequency]:
-                        self.websocket_frequency[frequency].append(websocket)
+                    self.websocket_manager.subscribe(websocket, chat_topic(frequency))
 
                     await self.websocket_manager.send_personal_message(json.dumps(msgs), websocket)
 
                 elif use_case == "trade":
                     trade_re = await self.trade(data)
-                    fetch_data_ob = (
-                        await self.websocket_controller.trade_fetch_order_book_data(
-                            data["data"]["market_code"]
+                    market_code = f"{data['data']['pair1']}_{data['data']['pair2']}".upper()
+
+                    # The book delta reaches every worker from the market's holder
+                    re1 = Frame("trade", trade_re.copy(exclude={"order_book_delta"}))
+                    await self.publish(market_topic(market_code, "trades"), re1)
+
+                elif use_case == "order_book_snapshot":
+                    self.websocket_manager.subscribe(
+                        websocket, market_topic(data["data"]["market_code"], "book")
+                    )
+                    snapshot = (
+                        await self.websocket_controller.trade_fetch_order_book_snapshot(
+                            data["data"]["market_code"], data["data"].get("depth")
                         )
                     )
-
-                    re1 = MetadataResponse(response_type="trade", data=trade_re)
-                    re2 = MetadataResponse(
-                        response_type="trade_fetch_order_book_data", data=fetch_data_ob
+                    await self.websocket_manager.send_personal_message(
+                        Frame("order_book_snapshot", snapshot), websocket
                     )
 
-                    await self.websocket_manager.broadcast(re1.json())
-                    await self.websocket_manager.broadcast(re2.json())
-
                 elif use_case == "trade_fetch_order_book_data":
                     fetch_data_ob = (
                         await self.websocket_controller.trade_fetch_order_book_data(
                             data["data"]["market_code"]
                         )
                     )
-                    re = MetadataResponse(
-                        response_type="trade_fetch_order_book_data", data=fetch_data_ob
-                    )
                     await self.websocket_manager.send_personal_message(
-                        re.json(), websocket
+                        Frame("trade_fetch_order_book_data", fetch_data_ob), websocket
                     )
 
                 elif use_case == "trade_fetch_current_candle":
@@ -187,25 +459,23 @@ class WebsocketEntryPoint:
                             data["data"]["candle_time_frame"],
                         )
                     )
-                    re3 = MetadataResponse(
-                        response_type="trade_fetch_current_candle", data=fetch_data_cc
-                    )
                     await self.websocket_manager.send_personal_message(
-                        re3.json(), websocket
+                        Frame("trade_fetch_current_candle", fetch_data_cc), websocket
                     )
 
                 elif use_case == "trade_fetch_historical_data":
+                    # Whoever loads a market's chart follows its trades
+                    self.websocket_manager.subscribe(
+                        websocket, market_topic(data["data"]["market_code"], "trades")
+                    )
                     fetch_data_re = (
                         await self.websocket_controller.trade_fetch_historical_data(
                             data["data"]["market_code"],
                             data["data"]["candle_time_frame"],
                         )
                     )
-                    re = MetadataResponse(
-                        response_type="trade_fetch_historical_data", data=fetch_data_re
-                    )
                     await self.websocket_manager.send_personal_message(
-                        re.json(), websocket
+                        Frame("trade_fetch_historical_data", fetch_data_re), websocket
                     )
                 # else:
                 #     # request not found
@@ -214,8 +484,12 @@ class WebsocketEntryPoint:
         except AppBaseException as ex:
             re = MetadataResponse(response_type="error", data=ex.msg)
             await self.websocket_manager.send_personal_message(re.json(), websocket)
+            await self.websocket_manager.drain(websocket)
 
         except WebSocketDisconnect:
+            pass
+
+        finally:
             self.websocket_manager.disconnect(websocket)
 
     async def trade(self, data: dict):
@@ -237,19 +511,48 @@ class WebsocketEntryPoint:
 planet_repository = BeaniPlanetRepositoryAdapter()
 currency_market_order_repository = BeaniCurrencyMarketOrderRepositoryAdapter()
 currency_market_trade_repository = BeaniCurrencyMarketTradeRepositoryAdapter()
+currency_market_settlement = BeaniCurrencyMarketSettlementAdapter(
+    config("CURRENCY_MARKET_TRANSACTIONS", default=False, cast=bool)
+)
 
 
-async def ws_controller():
+order_books = OrderBooks()
+market_stats = MarketStats()
+
+
+async def ws_controller(pubsub: PubSubPort, database, cache: CacheServicePort):
     trading_use_case = CurrencyMarket(
         planet_repository,
         currency_market_order_repository,
         currency_market_trade_repository,
+        currency_market_settlement,
+        order_books,
         response_port,
+        market_stats=market_stats,
+        cache=cache,
+        pubsub=pubsub,
+        market_leases=market_lease_dependency(database),
+        hold_markets=True,
     )
+    # Books are loaded for the markets this worker gets to hold
+    await trading_use_case.start()
+    await trading_use_case.load_candles()
+    await trading_use_case.load_market_stats()
+    await trading_use_case.warm_market_tickers()
 
     return WebsocketController(trading_use_case)
 
 
-async def ws_entry_point():
-    ws_controller_dependency = await ws_controller()
-    return WebsocketEntryPoint(websocket_manager, ws_controller_dependency, {}, {})
+async def ws_entry_point(database, cache: CacheServicePort):
+    pubsub = pubsub_dependency(database)
+    ws_controller_dependency = await ws_controller(pubsub, database, cache)
+    chat_history = ChatHistory(
+        MongoChatRepositoryAdapter(database),
+        config("CHAT_HISTORY_SIZE", default=500, cast=int),
+    )
+    entry_point = WebsocketEntryPoint(
+        websocket_manager, ws_controller_dependency, chat_history, pubsub
+    )
+    await entry_point.start()
+
+    return entry_point
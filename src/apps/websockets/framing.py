@@ -0,0 +1,120 @@
+"""
+Wire encodings a client can ask for when connecting, with `/ws?encoding=...`:
+
+- json (default): `MetadataResponse.json()`, as always
+- compact: the same envelope with market data in compact shapes, trades as [time, price, amount]
+  rows and candles as columns keyed by unix seconds
+- msgpack: the compact shapes in binary msgpack frames
+
+Only market data is framed, chat and errors stay JSON text whatever the encoding.
+"""
+from calendar import timegm
+import json
+
+from fastapi.encoders import jsonable_encoder
+
+from core.currency_market import FetchHistoricalData, TradeResponse
+from core.shared.models import CurrencyMarketTrade, MetadataResponse
+
+try:
+    import msgpack
+except ImportError:
+    # optional, without it msgpack clients get the compact shapes as JSON text
+    msgpack = None
+
+ENCODINGS = ("json", "compact", "msgpack")
+
+
+def negotiate(requested: str | None) -> str:
+    if requested not in ENCODINGS:
+        return "json"
+
+    if requested == "msgpack" and msgpack is None:
+        return "compact"
+
+    return requested
+
+
+def trade_row(trade: CurrencyMarketTrade) -> list:
+    created_time = None
+    if trade.created_time is not None:
+        created_time = timegm(trade.created_time.utctimetuple())
+
+    return [created_time, trade.price, trade.amount]
+
+
+def compact(data):
+    if isinstance(data, TradeResponse):
+        return {
+            "order": jsonable_encoder(data.order),
+            "executed_trades": [trade_row(trade) for trade in data.executed_trades],
+        }
+
+    if isinstance(data, FetchHistoricalData):
+        return {
+            "last_trades": [trade_row(trade) for trade in data.last_trades],
+            "open_buy_orders": jsonable_encoder(data.open_buy_orders),
+            "open_sell_orders": jsonable_encoder(data.open_sell_orders),
+            "price_candle_data": jsonable_encoder(data.price_candle_data),
+            "last_24_info": jsonable_encoder(data.last_24_info),
+        }
+
+    return jsonable_encoder(data)
+
+
+class Frame:
+    """
+    A market data message, encoded at most once per encoding however many sockets it goes to.
+    """
+
+    def __init__(self, response_type: str, data=None, text: str = None, payload=None):
+        self.response_type = response_type
+        self.data = data
+        self._text = text
+        self._payload = payload
+        self.encoded: dict[str, str | bytes] = {}
+
+    @classmethod
+    def from_wire(cls, wire: dict) -> "Frame":
+        return cls(wire["response_type"], text=wire["text"], payload=wire["payload"])
+
+    def wire(self) -> dict:
+        """
+        What other workers need to send it in any encoding, see `from_wire`.
+        """
+        return {
+            "response_type": self.response_type,
+            "text": self.text(),
+            "payload": self.payload(),
+        }
+
+    def text(self) -> str:
+        if self._text is None:
+            self._text = MetadataResponse(
+                response_type=self.response_type, data=self.data
+            ).json()
+
+        return self._text
+
+    def payload(self) -> dict:
+        if self._payload is None:
+            self._payload = {
+                "response_type": self.response_type,
+                "data": compact(self.data),
+            }
+
+        return self._payload
+
+    def encode(self, encoding: str) -> str | bytes:
+        encoded = self.encoded.get(encoding)
+        if encoded is None:
+            if encoding == "msgpack":
+                encoded = msgpack.packb(self.payload())
+            elif encoding == "compact":
+                encoded = json.dumps(self.payload(), separators=(",", ":"))
+            else:
+                encoded = self.text()
+
+            self.encoded[encoding] = encoded
+
+        return encoded
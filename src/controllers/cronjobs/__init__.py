@@ -3,6 +3,7 @@ from dataclasses import dataclass
 from core.mint_planet import MintPlanet
 from core.planet_bkm import PlanetBKM, RecoverBKMTransactionRequest
 from core.planet_energy import PlanetEnergy, PlanetEnergyRecoverEnergyDepositsRequest
+from core.planet_resources import PlanetResources
 from core.experience_points import ExperiencePoints
 from core.planet_staking import Staking
 from core.pve.asteroid import Asteroid
@@ -18,6 +19,7 @@ class CronjobController:
     asteroid: Asteroid
     space_pirate: SpacePirates
     bkm_planet: PlanetBKM
+    planet_resources: PlanetResources
 
     async def recover_planets(self, user: str):
         return await self.mint_planet.recover_planet(user)
@@ -33,3 +35,6 @@ class CronjobController:
 
     async def recover_bkm_deposits(self, req: RecoverBKMTransactionRequest):
         return await self.bkm_planet.recover_transactions(req)
+
+    async def accrue_resources(self):
+        return await self.planet_resources.accrue_all()
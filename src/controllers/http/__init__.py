@@ -2,7 +2,7 @@ from dataclasses import dataclass
 
 from beanie import PydanticObjectId
 from bson import ObjectId
-from fastapi import Depends
+from fastapi import Depends, Request, Response
 from fastapi.encoders import jsonable_encoder
 
 from adapters.http.security import jwt_bearer
@@ -23,7 +23,7 @@ from core.mint_planet import (
 )
 from core.nft_metadata import NftData
 from core.planet_bkm import BKMTransactionRequest, PlanetBKM
-from core.planet_email import PlanetEmail
+from core.planet_email import EMAIL_PAGE_SIZE, PlanetEmail
 from core.planet_energy import EnergyDepositRequest, PlanetEnergy
 from core.planet_staking import (
     ConfirmStakingRequest,
@@ -33,6 +33,7 @@ from core.planet_staking import (
 )
 from core.redeem_voucher import RedeemVoucher, RedeemVoucherRequest
 from core.shared.models import Planet
+from core.shared.static.game_data.StakingData import StakingData as SD
 from core.medium_scraper import MediumScraper
 
 object_id_encoder = {PydanticObjectId: lambda x: str(x)}
@@ -115,6 +116,14 @@ class HttpController:
         re = await self.get_planets.fetch_by_planet_id(user, planet_id)
         return jsonable_encoder(re)
 
+    async def game_data(self, request: Request, tier: str = SD.TIER_0):
+        catalog = await self.get_planets.fetch_game_data(tier)
+        headers = {"ETag": catalog.etag, "Cache-Control": "public, max-age=3600"}
+        if request.headers.get("if-none-match") == catalog.etag:
+            return Response(status_code=304, headers=headers)
+
+        return Response(catalog.body, media_type="application/json", headers=headers)
+
     async def build(self, request: BuildableRequest, user=Depends(jwt_bearer)):
         re = await self.buildable_items.build(user, request)
         return jsonable_encoder(re)
@@ -149,6 +158,17 @@ class HttpController:
         re = await self.planet_emails.delete(email_id)
         return jsonable_encoder(re)
 
+    async def email_inbox(
+        self,
+        planet_id: str,
+        before: float = None,
+        before_id: str = None,
+        limit: int = EMAIL_PAGE_SIZE,
+        user=Depends(jwt_bearer),
+    ):
+        re = await self.planet_emails.inbox(user, planet_id, before, before_id, limit)
+        return jsonable_encoder(re)
+
     async def email_delete_all(self, planet_id, user=Depends(jwt_bearer)):
         re = await self.planet_emails.delete_all(planet_id)
         return jsonable_encoder(re)
@@ -10,6 +10,12 @@ class WebsocketController:
     async def trade(self, req: TradeRequest):
         return await self.trading_use_case.trade(req)
 
+    async def close(self):
+        await self.trading_use_case.close()
+
+    async def listen_market_changes(self, on_delta):
+        await self.trading_use_case.listen_market_changes(on_delta)
+
     async def trade_fetch_historical_data(
         self, market_code: str, candle_time_frame: str
     ):
@@ -20,6 +26,9 @@ class WebsocketController:
     async def trade_fetch_order_book_data(self, market_code: str):
         return await self.trading_use_case.fetch_order_book_data(market_code)
 
+    async def trade_fetch_order_book_snapshot(self, market_code: str, depth: int = None):
+        return await self.trading_use_case.fetch_order_book_snapshot(market_code, depth)
+
     async def trade_fetch_current_candle(
         self, market_code: str, candle_time_frame: str
     ):
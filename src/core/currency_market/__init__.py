@@ -1,21 +1,40 @@
-from dataclasses import dataclass
+from calendar import timegm
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+from functools import partial
+from typing import Awaitable, Callable, Iterable
+from uuid import uuid4
 
+import numpy as np
+import pandas as pd
 from pydantic import BaseModel
 
+from core.currency_market.market_router import MarketRouter
+from core.currency_market.market_stats import MarketStats
+from core.currency_market.matching_actor import MarketMatchingActors
+from core.currency_market.order_book import OrderBookLevels, OrderBooks
 from core.shared.models import (
+    CANDLE_INTERVALS,
     AppBaseException,
     CurrencyMarketOrder,
+    CurrencyMarketSettlement,
+    CurrencyMarketTicker,
     CurrencyMarketTrade,
+    MarketLeaseLostException,
     OpenOrdersGroupedByPrice,
     Planet,
     PriceCandleDataGroupedByTimeInterval,
+    StaleOrderException,
     Volume24Info,
 )
 from core.shared.ports import (
+    CacheServicePort,
     CurrencyMarketOrderRepositoryPort,
+    CurrencyMarketSettlementPort,
     CurrencyMarketTradeRepositoryPort,
+    MarketLeasePort,
     PlanetRepositoryPort,
+    PubSubPort,
     ResponsePort,
 )
 from core.shared.service.tier_benefit import tier_benefit_trading_fee
@@ -33,16 +52,36 @@ class TradeRequest(BaseModel):
     total: float = None  # total = price_unit * amount ; only used for limit orders
 
 
+class RoutedOrder(CurrencyMarketOrder):
+    """
+    Order of a trade matched by another process, the stored document only exists over there.
+    """
+
+    id: str | None = None
+
+
 class TradeResponse(BaseModel):
     order: CurrencyMarketOrder
     executed_trades: list[CurrencyMarketTrade]
+    order_book_delta: OrderBookLevels | None = None
+
+
+class PriceCandleColumns(BaseModel):
+    time: list[int]  # candle start, unix seconds
+    open: list[float]
+    high: list[float]
+    low: list[float]
+    close: list[float]
+    volume: list[float]
 
 
 class FetchHistoricalData(BaseModel):
     last_trades: list[CurrencyMarketTrade]
     open_buy_orders: list[OpenOrdersGroupedByPrice]
     open_sell_orders: list[OpenOrdersGroupedByPrice]
-    price_candle_data: dict[str, PriceCandleDataGroupedByTimeInterval | None]
+    price_candle_data: PriceCandleColumns | dict[
+        str, PriceCandleDataGroupedByTimeInterval | None
+    ]
     last_24_info: Volume24Info | None
 
 
@@ -58,6 +97,54 @@ class MyOpenOrdersResponse(BaseModel):
 class MarketInfoResponse(BaseModel):
     market: str
     last_price: float
+    change_24: float = 0  # %
+    pair1_volume_24: float = 0
+    pair2_volume_24: float = 0
+
+    @staticmethod
+    def from_ticker(ticker: CurrencyMarketTicker):
+        pairs = ticker.market_code.split("_")
+        change_24 = 0
+        if ticker.open_24:
+            change_24 = (ticker.last_price - ticker.open_24) / ticker.open_24 * 100
+
+        return MarketInfoResponse(
+            market=f"{pairs[0]}/{pairs[1]}",
+            last_price=ticker.last_price,
+            change_24=change_24,
+            pair1_volume_24=ticker.pair1_volume_24,
+            pair2_volume_24=ticker.pair2_volume_24,
+        )
+
+
+MARKETS = [
+    "METAL_CRYSTAL",
+    "METAL_PETROL",
+    "METAL_BKM",
+    "CRYSTAL_PETROL",
+    "CRYSTAL_BKM",
+    "PETROL_BKM",
+]
+
+# PubSub channel of market events shared by the http app and every websocket worker
+CURRENCY_MARKET_CHANNEL = "currency_market"
+
+# Refreshed on every trade, so this only bounds how stale 24h figures of idle markets get
+MARKET_TICKER_EXPIRY = 60
+
+
+def add_resource_delta(
+    deltas: dict[str, dict[str, float]], planet_id: str, resource: str, amount: float
+):
+    planet_deltas = deltas.setdefault(planet_id, {})
+    planet_deltas[resource] = planet_deltas.get(resource, 0) + amount
+
+
+@dataclass
+class Fill:
+    order: CurrencyMarketOrder  # resting order, already updated in memory
+    amount: float  # in pair 1
+    trade: CurrencyMarketTrade
 
 
 class NotEnoughFundsException(AppBaseException):
@@ -77,49 +164,226 @@ class CurrencyMarket:
     planet_repository: PlanetRepositoryPort
     currency_market_order_repository: CurrencyMarketOrderRepositoryPort
     currency_market_trade_repository: CurrencyMarketTradeRepositoryPort
+    currency_market_settlement: CurrencyMarketSettlementPort
+    order_books: OrderBooks
     response_port: ResponsePort
+    market_stats: MarketStats = field(default_factory=MarketStats)
+    cache: CacheServicePort = None
+    pubsub: PubSubPort = None
+    # With pubsub, routes every market to the one process holding its lease
+    market_leases: MarketLeasePort = None
+    # Whether this process matches orders (websocket workers) or only routes them (http app)
+    hold_markets: bool = False
+    # Tells our own events apart from other processes'
+    instance_id: str = field(default_factory=lambda: uuid4().hex)
+    matching_actors: MarketMatchingActors = field(init=False)
+    router: MarketRouter | None = field(init=False, default=None)
+
+    def __post_init__(self):
+        self.matching_actors = MarketMatchingActors(self._execute_trade)
+        if self.pubsub is not None and self.market_leases is not None:
+            self.router = MarketRouter(
+                self.pubsub,
+                self.market_leases,
+                CURRENCY_MARKET_CHANNEL,
+                self.instance_id,
+                can_own=self.hold_markets,
+                handlers={
+                    "trade": self._routed_trade,
+                    "cancel": self._routed_cancel,
+                    "snapshot": self._routed_snapshot,
+                },
+                on_acquired=self._acquire_market,
+            )
 
-    async def get_all_market_info(self) -> list[MarketInfoResponse]:
-        re = []
+    async def start(self):
+        """
+        Takes the markets this process can hold, every book is loaded when it runs unrouted.
+        """
+        if self.router is None:
+            await self.load_order_books()
+            return
 
-        markets = [
-            "METAL_CRYSTAL",
-            "METAL_PETROL",
-            "METAL_BKM",
-            "CRYSTAL_PETROL",
-            "CRYSTAL_BKM",
-            "PETROL_BKM",
-        ]
-
-        for market in markets:
-            last_trade_arr = await self.currency_market_trade_repository.last(
-                market_code=market
-            )
+        await self.router.start(MARKETS)
 
-            last_price = 0
-            if len(last_trade_arr) > 0:
-                last_price = last_trade_arr[0].price
+    async def close(self):
+        if self.router is not None:
+            await self.router.close()
 
-            pairs = market.split("_")
-            market_front_code = f"{pairs[0]}/{pairs[1]}"
-            re.append(
-                MarketInfoResponse(market=market_front_code, last_price=last_price)
+        await self.matching_actors.close()
+
+    def _holds(self, market_code: str) -> bool:
+        return self.router is None or self.router.owns(market_code)
+
+    def _fence(self, market_code: str):
+        """
+        Lets the settlement check we still hold the market's lease before it writes anything.
+        """
+        if self.router is None:
+            return None
+
+        return partial(
+            self.market_leases.fence,
+            market_code,
+            self.instance_id,
+            self.router.epoch(market_code),
+        )
+
+    async def _acquire_market(self, market_code: str):
+        # Another process may have matched it meanwhile, its clients resync from the delta gap
+        delta = await self.matching_actors.submit(
+            market_code, market_code, self._refresh_order_book
+        )
+        await self._publish_market_changed(market_code, delta)
+
+    async def _routed_trade(self, market_code: str, payload: dict) -> dict:
+        response = await self.matching_actors.submit(
+            market_code, TradeRequest.parse_obj(payload)
+        )
+        re = response.dict(exclude={"order_book_delta"})
+        re["order"] = response.order.dict(include=set(CurrencyMarketOrder.__fields__))
+        if getattr(response.order, "id", None) is not None:
+            re["order"]["id"] = str(response.order.id)
+
+        return re
+
+    async def _routed_snapshot(self, market_code: str, payload: dict) -> dict:
+        return self.order_books.get(market_code).snapshot(payload.get("depth")).dict()
+
+    async def load_order_books(self, market_code: str = None):
+        """
+        (Re)builds the resident order books from the persisted open orders.
+        :param market_code: only rebuild this market, all of them if None
+        """
+        open_orders = await self.currency_market_order_repository.all_open_orders(
+            market_code
+        )
+        self.order_books.load(open_orders, market_code)
+
+    async def load_market_stats(self):
+        """
+        Rebuilds the rolling 24h stats from the persisted trades.
+        """
+        trades = await self.currency_market_trade_repository.all_from(
+            datetime.utcnow() - timedelta(days=1)
+        )
+        self.market_stats.load(trades)
+
+    async def load_candles(self):
+        """
+        Fills the candle store from the trade history when it is still empty (first deploy).
+        """
+        if not await self.currency_market_trade_repository.has_candles():
+            await self.currency_market_trade_repository.rebuild_candles()
+
+    async def _publish_market_changed(
+        self,
+        market_code: str,
+        delta: OrderBookLevels | None,
+        trades: list[CurrencyMarketTrade] = (),
+    ):
+        """
+        Sent by the holder of the market, carries what every other process needs to follow it.
+        """
+        if self.pubsub is None or (delta is None and not trades):
+            return
+
+        await self.pubsub.publish(
+            CURRENCY_MARKET_CHANNEL,
+            {
+                "event": "market_changed",
+                "market_code": market_code,
+                "delta": delta.dict() if delta is not None else None,
+                "trades": [trade.dict() for trade in trades],
+                "origin": self.instance_id,
+            },
+        )
+
+    async def listen_market_changes(
+        self, on_delta: Callable[[OrderBookLevels], Awaitable[None]]
+    ):
+        """
+        Keeps the 24h stats in step with trades matched by other processes, `on_delta`
+        receives the book deltas of every market, whichever process holds it.
+        """
+
+        async def on_event(event: dict):
+            if event["event"] != "market_changed":
+                return
+
+            # The holder added its own trades when it matched them
+            if event["origin"] != self.instance_id:
+                self.market_stats.add_trades(
+                    [CurrencyMarketTrade.parse_obj(trade) for trade in event["trades"]]
+                )
+
+            if event["delta"] is not None:
+                await on_delta(OrderBookLevels.parse_obj(event["delta"]))
+
+        await self.pubsub.subscribe(CURRENCY_MARKET_CHANNEL, on_event)
+
+    async def _refresh_order_book(self, market_code: str) -> OrderBookLevels | None:
+        await self.load_order_books(market_code)
+        return self.order_books.get(market_code).flush_delta()
+
+    async def get_all_market_info(self) -> list[MarketInfoResponse]:
+        cached = {}
+        if self.cache is not None:
+            cached = await self.cache.get_many(
+                [self._ticker_key(market) for market in MARKETS]
             )
 
-            re.sort(key=lambda x: x.last_price, reverse=True)
+        tickers = {ticker.market_code: ticker for ticker in cached.values()}
+        if len(tickers) < len(MARKETS):
+            tickers = await self.warm_market_tickers()
+
+        re = [MarketInfoResponse.from_ticker(tickers[market]) for market in MARKETS]
+        re.sort(key=lambda x: x.last_price, reverse=True)
         return re
 
-    async def _price_candle_data(self, market_code: str, candle_time_frame: str):
-        # @TODO: ADD caching
-        # @TODO: Created time index
-        # amount of bars
-        candle_time_frame_mapping = {
-            "1m": dict(minutes=1),
-            "15m": dict(minutes=15),
-            "1h": dict(hours=1),
-            "1d": dict(days=1),
+    async def warm_market_tickers(self) -> dict[str, CurrencyMarketTicker]:
+        """
+        Recomputes the ticker of every market from the stored trades and caches it.
+        """
+        tickers = {
+            ticker.market_code: ticker
+            for ticker in await self.currency_market_trade_repository.market_tickers(
+                datetime.utcnow() - timedelta(days=1)
+            )
         }
 
+        for market in MARKETS:
+            ticker = tickers.setdefault(market, CurrencyMarketTicker(market_code=market))
+            await self._cache_ticker(ticker)
+
+        return tickers
+
+    @staticmethod
+    def _ticker_key(market_code: str) -> str:
+        return f"{CacheServicePort.MARKET_TICKER}_{market_code}"
+
+    async def _cache_ticker(self, ticker: CurrencyMarketTicker):
+        if self.cache is not None:
+            await self.cache.set(
+                self._ticker_key(ticker.market_code), ticker, MARKET_TICKER_EXPIRY
+            )
+
+    async def _update_market_ticker(self, market_code: str, last_price: float):
+        info = self.market_stats.info(market_code)
+        await self._cache_ticker(
+            CurrencyMarketTicker(
+                market_code=market_code,
+                last_price=last_price,
+                open_24=info.open_24,
+                pair1_volume_24=info.pair1_volume,
+                pair2_volume_24=info.pair2_volume,
+            )
+        )
+
+    async def _price_candle_data(
+        self, market_code: str, candle_time_frame: str
+    ) -> PriceCandleColumns:
+        # amount of bars
         candle_time_frame_mapping_format = {
             "1m": "%Y-%m-%dT%H:00:00.000000Z",
             "15m": "%Y-%m-%dT%H:00:00.000000Z",
@@ -134,76 +398,64 @@ class CurrencyMarket:
         )
         day1ago = datetime.strptime(day1ago_str, "%Y-%m-%dT%H:00:00.000000Z")
 
-        price_candle_data = (
+        candles = (
             await self.currency_market_trade_repository.price_candle_data_grouped_time(
                 market_code, day1ago, candle_time_frame
             )
         )
 
-        price_candle_tmp = {}
-        for p in price_candle_data:
-            price_candle_tmp[p.id["date_formatted"]] = p
+        # Every bucket start (unix seconds) from day1ago to now
+        buckets = np.arange(
+            timegm(day1ago.timetuple()),
+            timegm(now.timetuple()) + 1,
+            CANDLE_INTERVALS[candle_time_frame],
+        )
+        frame = pd.DataFrame(
+            [
+                (
+                    timegm(c.bucket.timetuple()),
+                    c.open,
+                    c.high,
+                    c.low,
+                    c.close,
+                    c.volume,
+                )
+                for c in candles
+            ],
+            columns=["time", "open", "high", "low", "close", "volume"],
+            dtype="float64",
+        )
+        frame = frame.set_index(frame["time"].astype("int64")).reindex(buckets)
 
-        if day1ago.strftime("%Y-%m-%dT%H:%M:00.000000Z") not in price_candle_tmp:
-            # we need to get last trade previous to day1ago.
+        gaps = frame["close"].isna().to_numpy()
+        close = frame["close"].to_numpy(copy=True)
+        if gaps.size and gaps[0]:
+            # Window doesn't start with a trade, carry the last price before it
             last_trade_from_arr = await self.currency_market_trade_repository.last_from(
                 market_code, day1ago
             )
             if len(last_trade_from_arr) > 0:
-                price_candle_tmp[
-                    last_trade_from_arr[0].created_time.strftime(
-                        "%Y-%m-%dT%H:%M:00.000000Z"
-                    )
-                ] = last_trade_from_arr[0]
-
-        current_price = None
-        if not len(price_candle_data):
-            last_trade_arr = await self.currency_market_trade_repository.last(
-                market_code
-            )
-            if len(last_trade_arr) > 0:
-                last_trade = last_trade_arr[0]
-                minute = day1ago.strftime("%M")
-                date_formatted = day1ago.strftime("%Y-%m-%dT%H:%M:00.000000Z")
-                current_price = PriceCandleDataGroupedByTimeInterval(
-                    _id={
-                        "minute": minute,
-                        "date_formatted": date_formatted,
-                        "interval": minute,
-                    },
-                    open=last_trade.price,
-                    close=last_trade.price,
-                    high=last_trade.price,
-                    low=last_trade.price,
-                )
-                price_candle_tmp[date_formatted] = current_price
-
-        prices = {}
-        while day1ago <= now:
-            date_formatted = day1ago.strftime("%Y-%m-%dT%H:%M:00.000000Z")
-            minute = day1ago.strftime("%M")
-
-            if date_formatted in price_candle_tmp:
-                current_price = price_candle_tmp[date_formatted]
-            elif current_price is not None:
-                current_price = PriceCandleDataGroupedByTimeInterval(
-                    _id={
-                        "minute": minute,
-                        "date_formatted": date_formatted,
-                        "interval": minute,
-                    },
-                    open=current_price.close,
-                    close=current_price.close,
-                    high=current_price.close,
-                    low=current_price.close,
-                )
-
-            if current_price is not None:
-                prices[date_formatted] = current_price
-
-            day1ago += timedelta(**candle_time_frame_mapping[candle_time_frame])
-
-        return prices
+                close[0] = last_trade_from_arr[0].price
+
+        # Empty buckets are flat candles at the previous close
+        close = pd.Series(close).ffill().to_numpy()
+        for column in ("open", "high", "low"):
+            frame[column] = np.where(gaps, close, frame[column].to_numpy())
+        frame["close"] = close
+        frame["volume"] = frame["volume"].fillna(0)
+
+        # Nothing to draw until the first known price
+        frame = frame[~np.isnan(close)]
+
+        # Already typed, skip validating thousands of floats
+        return PriceCandleColumns.construct(
+            time=frame.index.tolist(),
+            open=frame["open"].tolist(),
+            high=frame["high"].tolist(),
+            low=frame["low"].tolist(),
+            close=frame["close"].tolist(),
+            volume=frame["volume"].tolist(),
+        )
 
     async def fetch_current_candle_data(self, market_code: str, candle_time_frame: str):
         candle_time_frame_mapping = {
@@ -257,17 +509,12 @@ class CurrencyMarket:
 
         price_candle_data_formatted = {start_str: tmp}
 
-        last_24_info = await self.currency_market_trade_repository.last_24_info(
-            market_code
-        )
-        last_24_info = last_24_info[0] if len(last_24_info) > 0 else None
-
         return FetchHistoricalData(
             last_trades=[],
             open_buy_orders=[],
             open_sell_orders=[],
             price_candle_data=price_candle_data_formatted,
-            last_24_info=last_24_info,
+            last_24_info=self.market_stats.info(market_code),
         )
 
     async def fetch_historical_data(self, market_code: str, candle_time_frame: str):
@@ -285,10 +532,6 @@ class CurrencyMarket:
         # price_candle_data =
         # await self.currency_market_trade_repository.price_candle_data_grouped_time(market_code, 1)
         prices = await self._price_candle_data(market_code, candle_time_frame)
-        last_24_info = await self.currency_market_trade_repository.last_24_info(
-            market_code
-        )
-        last_24_info = last_24_info[0] if len(last_24_info) > 0 else None
 
         # a = await self.fetch_last_candle_data(market_code)
 
@@ -297,7 +540,20 @@ class CurrencyMarket:
             open_buy_orders=buy_group,
             open_sell_orders=sell_group[::-1],
             price_candle_data=prices,
-            last_24_info=last_24_info,
+            last_24_info=self.market_stats.info(market_code),
+        )
+
+    async def fetch_order_book_snapshot(
+        self, market_code: str, depth: int = None
+    ) -> OrderBookLevels:
+        """
+        Aggregated levels of the book, clients follow it with order_book_delta messages.
+        """
+        if self._holds(market_code):
+            return self.order_books.get(market_code).snapshot(depth)
+
+        return OrderBookLevels.parse_obj(
+            await self.router.request(market_code, "snapshot", {"depth": depth})
         )
 
     async def fetch_order_book_data(self, market_code: str):
@@ -315,97 +571,110 @@ class CurrencyMarket:
             last_24_info=None,
         )
 
-    async def _order_complete_transfer_balance(
-        self, pair1: str, pair2: str, planet: Planet, order: CurrencyMarketOrder
-    ) -> Planet:
-        if order.order_type == "buy":
-            pair1_qty_available = getattr(planet.resources, pair1)
-            pair1_qty_available += order.amount
-            setattr(planet.resources, pair1, pair1_qty_available)
-
-        elif order.order_type == "sell":
-            pair2_qty_available = getattr(planet.resources, pair2)
-            pair2_qty_available += order.amount * order.price
-            setattr(planet.resources, pair2, pair2_qty_available)
-        return planet
-
-    async def _transfer_balance(self, matching_order, planet, amount_traded, req):
-        matching_order_planet = await self.planet_repository.get(
-            matching_order.planet_id, False
+    async def _trading_fees(
+        self, planet: Planet, fills: list[Fill]
+    ) -> dict[str, float]:
+        """
+        Trading fee of every planet involved in the fills, counterparties fetched in a single query.
+        """
+        counterparty_ids = list({fill.order.planet_id for fill in fills})
+        counterparties = (
+            await self.planet_repository.get_many(counterparty_ids)
+            if counterparty_ids
+            else []
         )
 
-        matching_order_planet_fee = tier_benefit_trading_fee(matching_order_planet)
-        planet_fee = tier_benefit_trading_fee(planet)
+        fees = {str(p.id): tier_benefit_trading_fee(p) for p in counterparties}
+        fees[str(planet.id)] = tier_benefit_trading_fee(planet)
+        return fees
+
+    def _add_fill_deltas(
+        self,
+        deltas: dict[str, dict[str, float]],
+        fill: Fill,
+        fees: dict[str, float],
+        req: TradeRequest,
+    ):
+        """
+        Adds to `deltas` what both sides of a fill receive, trading fees already deducted.
+        """
+        matching_order = fill.order
+        matching_order_planet_fee = fees[matching_order.planet_id]
+        planet_fee = fees[req.planet_id]
+
+        pair1 = req.pair1.lower()
+        pair2 = req.pair2.lower()
+        amount_traded = fill.amount
+        amount_traded_price = amount_traded * matching_order.price
 
         if matching_order.order_type == "buy":
-            pair1_amt_matching_planet = getattr(
-                matching_order_planet.resources, req.pair1.lower()
+            add_resource_delta(
+                deltas,
+                matching_order.planet_id,
+                pair1,
+                amount_traded - amount_traded * matching_order_planet_fee,  # rest fee
             )
-            pair1_amt_matching_planet += (
-                amount_traded - amount_traded * matching_order_planet_fee
-            )  # rest fee
-
-            setattr(
-                matching_order_planet.resources,
-                req.pair1.lower(),
-                pair1_amt_matching_planet,
+            add_resource_delta(
+                deltas,
+                req.planet_id,
+                pair2,
+                amount_traded_price - amount_traded_price * planet_fee,  # rest fee
             )
 
-            pair2_amt_planet = getattr(planet.resources, req.pair2.lower())
-            pair2_amt_planet += (amount_traded * matching_order.price) - (
-                (amount_traded * matching_order.price) * planet_fee
-            )  # rest fee
-            setattr(planet.resources, req.pair2.lower(), pair2_amt_planet)
-
         elif matching_order.order_type == "sell":
-            pair2_amt_matching_planet = getattr(
-                matching_order_planet.resources, req.pair2.lower()
+            add_resource_delta(
+                deltas,
+                matching_order.planet_id,
+                pair2,
+                amount_traded_price
+                - amount_traded_price * matching_order_planet_fee,  # rest fee
             )
-            pair2_amt_matching_planet += (amount_traded * matching_order.price) - (
-                (amount_traded * matching_order.price) * matching_order_planet_fee
-            )  # rest fee
-            setattr(
-                matching_order_planet.resources,
-                req.pair2.lower(),
-                pair2_amt_matching_planet,
+            add_resource_delta(
+                deltas,
+                req.planet_id,
+                pair1,
+                amount_traded - amount_traded * planet_fee,  # rest fee
             )
 
-            pair1_amt_planet = getattr(planet.resources, req.pair1.lower())
-            pair1_amt_planet += amount_traded - amount_traded * planet_fee  # rest fee
-            setattr(planet.resources, req.pair1.lower(), pair1_amt_planet)
+    async def _withdraw(self, planet_id: str, resource: str, amount: float) -> dict:
+        """
+        Checks and takes the funds in the same atomic update, returns what to give back
+        if the trade fails afterwards.
+        """
+        if amount <= 0:
+            return {}
+
+        withdrawn = await self.planet_repository.inc_resources(
+            {planet_id: {resource.lower(): -amount}}, check_funds=True
+        )
+        if not withdrawn:
+            raise NotEnoughFundsException.from_resource_name(resource)
+
+        return {planet_id: {resource.lower(): amount}}
+
+    @staticmethod
+    def _limit_order_cost(req: TradeRequest) -> tuple[str, float]:
+        if req.order_type == "buy":
+            return req.pair2, req.amount * req.price_unit
+
+        return req.pair1, req.amount
+
+    @staticmethod
+    def _market_order_cost(req: TradeRequest, fills: list[Fill]) -> tuple[str, float]:
+        if req.order_type == "buy":
+            return req.pair2, sum(fill.amount * fill.order.price for fill in fills)
 
-        await self.planet_repository.update(planet)
-        await self.planet_repository.update(matching_order_planet)
-        return await self.planet_repository.get_my_planet(req.user_id, req.planet_id)
+        return req.pair1, sum(fill.amount for fill in fills)
 
     async def _limit_order_trade(
         self,
         req: TradeRequest,
+        planet: Planet,
         market_code: str,
-        matching_orders: list[CurrencyMarketOrder],
+        matching_orders: Iterable[CurrencyMarketOrder],
     ):
         amount_left = req.amount
-        completed_trades = []
-
-        planet = await self.planet_repository.get_my_planet(req.user_id, req.planet_id)
-
-        if req.order_type == "buy":
-            total_price = req.amount * req.price_unit
-            pair2_qty_available = getattr(planet.resources, req.pair2.lower())
-            if total_price > pair2_qty_available:
-                raise NotEnoughFundsException.from_resource_name(req.pair2)
-
-            pair2_qty_available -= total_price
-            setattr(planet.resources, req.pair2.lower(), pair2_qty_available)
-        elif req.order_type == "sell":
-            pair1_qty = getattr(planet.resources, req.pair1.lower())
-            if req.amount > pair1_qty:
-                raise NotEnoughFundsException.from_resource_name(req.pair1)
-
-            pair1_qty -= req.amount
-            setattr(planet.resources, req.pair1.lower(), pair1_qty)
-
-        planet = await self.planet_repository.update(planet)
+        fills = []
 
         # We can match buy/sell offers
         for matching_order in matching_orders:
@@ -427,10 +696,6 @@ class CurrencyMarket:
                 amount_traded = amount_left
                 amount_left = 0
 
-            planet = await self._transfer_balance(
-                matching_order, planet, amount_traded, req
-            )
-
             completed_trade = CurrencyMarketTrade(
                 market_code=market_code,
                 price=matching_order.price,
@@ -441,9 +706,7 @@ class CurrencyMarket:
             matching_order.update_state()
             matching_order.updated_time = now
 
-            await self.currency_market_order_repository.update(matching_order)
-            await self.currency_market_trade_repository.create_trade(completed_trade)
-            completed_trades.append(completed_trade)
+            fills.append(Fill(matching_order, amount_traded, completed_trade))
 
             if amount_left <= 0:
                 break
@@ -468,30 +731,19 @@ class CurrencyMarket:
             state=state,
         )
 
-        await self.planet_repository.update(planet)
-        return order, completed_trades
+        return order, fills
 
     async def _market_order_trade(
         self,
         req: TradeRequest,
+        planet: Planet,
         market_code: str,
-        matching_orders: list[CurrencyMarketOrder],
+        matching_orders: Iterable[CurrencyMarketOrder],
     ):
         # Weighted average calculation
         # ((quantity 1 * price 1) + (quantity 2 * price 2)) / (quantity 1 + quantity 2)
-        planet = await self.planet_repository.get_my_planet(req.user_id, req.planet_id)
-
-        if req.order_type == "buy":
-            pair2_qty_available = getattr(planet.resources, req.pair2.lower())
-            if req.total > pair2_qty_available:
-                raise NotEnoughFundsException.from_resource_name(req.pair2)
-        elif req.order_type == "sell":
-            pair1_qty = getattr(planet.resources, req.pair1.lower())
-            if req.total > pair1_qty:
-                raise NotEnoughFundsException.from_resource_name(req.pair1)
-
         total_left = req.total
-        completed_trades = []
+        fills = []
 
         total_cost = 0
         total_amount = 0
@@ -524,31 +776,6 @@ class CurrencyMarket:
                 total_cost += amount * matching_order.price
                 total_amount += amount
 
-            # user sold
-            if matching_order.order_type == "buy":
-                to_withdraw = amount_traded
-                current_balance = getattr(planet.resources, req.pair1.lower())
-                setattr(
-                    planet.resources, req.pair1.lower(), current_balance - to_withdraw
-                )
-
-            # user bought
-            elif matching_order.order_type == "sell":
-                to_withdraw = amount_traded * matching_order.price
-                current_balance = getattr(planet.resources, req.pair2.lower())
-                setattr(
-                    planet.resources, req.pair2.lower(), current_balance - to_withdraw
-                )
-
-            await self.planet_repository.update(planet)
-            planet = await self.planet_repository.get_my_planet(
-                req.user_id, req.planet_id
-            )
-
-            planet = await self._transfer_balance(
-                matching_order, planet, amount_traded, req
-            )
-
             completed_trade = CurrencyMarketTrade(
                 market_code=market_code,
                 price=matching_order.price,
@@ -559,9 +786,7 @@ class CurrencyMarket:
             matching_order.update_state()
             matching_order.updated_time = now
 
-            await self.currency_market_order_repository.update(matching_order)
-            await self.currency_market_trade_repository.create_trade(completed_trade)
-            completed_trades.append(completed_trade)
+            fills.append(Fill(matching_order, amount_traded, completed_trade))
 
             if total_left <= 0:
                 break
@@ -582,34 +807,108 @@ class CurrencyMarket:
                 state="fully_filled",
             )
 
-            await self.planet_repository.update(planet)
+        return order, fills
+
+    async def _settlement(
+        self,
+        req: TradeRequest,
+        planet: Planet,
+        order: CurrencyMarketOrder | None,
+        fills: list[Fill],
+    ) -> CurrencyMarketSettlement:
+        settlement = CurrencyMarketSettlement(new_order=order)
+        fees = await self._trading_fees(planet, fills)
+
+        for fill in fills:
+            settlement.filled_orders.append(fill.order)
+            settlement.trades.append(fill.trade)
+
+            self._add_fill_deltas(settlement.resource_deltas, fill, fees, req)
 
-        return order, completed_trades
+        return settlement
 
     async def trade(self, req: TradeRequest):
         market_code = f"{req.pair1.upper()}_{req.pair2.upper()}"
+        if self._holds(market_code):
+            return await self.matching_actors.submit(market_code, req)
 
-        matching_orders = (
-            await self.currency_market_order_repository.find_matching_orders(
-                market_code, req.trade_type, req.order_type, req.price_unit
+        re = await self.router.request(market_code, "trade", req.dict())
+        return await self.response_port.publish_response(
+            TradeResponse(
+                order=RoutedOrder.parse_obj(re["order"]),
+                executed_trades=re["executed_trades"],
             )
         )
 
-        order, completed_trades = None, None
-        if req.trade_type == "limit":
-            order, completed_trades = await self._limit_order_trade(
-                req, market_code, matching_orders
-            )
-        elif req.trade_type == "market":
-            order, completed_trades = await self._market_order_trade(
-                req, market_code, matching_orders
-            )
+    async def _execute_trade(self, req: TradeRequest):
+        """
+        Runs on the market's matching actor, never concurrently with another trade on the same market.
+        """
+        market_code = f"{req.pair1.upper()}_{req.pair2.upper()}"
+        order_book = self.order_books.get(market_code)
 
-        if order:
-            order = await self.currency_market_order_repository.create_order(order)
+        planet = await self.planet_repository.get_my_planet(req.user_id, req.planet_id)
+
+        order, fills = None, []
+        refund, settling = {}, False
+        try:
+            if req.trade_type == "limit":
+                refund = await self._withdraw(req.planet_id, *self._limit_order_cost(req))
+                order, fills = await self._limit_order_trade(
+                    req,
+                    planet,
+                    market_code,
+                    order_book.matching_orders(req.order_type, req.price_unit),
+                )
+            elif req.trade_type == "market":
+                order, fills = await self._market_order_trade(
+                    req, planet, market_code, order_book.matching_orders(req.order_type)
+                )
+                # What the fills cost is only known now, taken before anything is written
+                refund = await self._withdraw(
+                    req.planet_id, *self._market_order_cost(req, fills)
+                )
+
+            settlement = await self._settlement(req, planet, order, fills)
+            settlement.fence = self._fence(market_code)
+            settling = True
+            stored_order = await self.currency_market_settlement.settle(settlement)
+        except Exception as ex:
+            # A stale settlement writes nothing, any other failure in it may be half written
+            if refund and (not settling or isinstance(ex, StaleOrderException)):
+                await self.planet_repository.inc_resources(refund)
+
+            if isinstance(ex, MarketLeaseLostException):
+                self.router.lost(market_code)
+
+            # Fills may have been applied in memory but not persisted, rebuild from db.
+            await self.load_order_books(market_code)
+            raise
+
+        for fill in fills:
+            order_book.update(fill.order)
+
+        if stored_order:
+            order = stored_order
+            order_book.add(order)
+
+        # Flushed here, on the market's actor, so deltas leave in sequence order
+        order_book_delta = order_book.flush_delta()
+        completed_trades = [fill.trade for fill in fills]
+        await self._publish_market_changed(
+            market_code, order_book_delta, completed_trades
+        )
+
+        self.market_stats.add_trades(completed_trades)
+        if completed_trades:
+            await self._update_market_ticker(market_code, completed_trades[-1].price)
 
         return await self.response_port.publish_response(
-            TradeResponse(order=order, executed_trades=completed_trades)
+            TradeResponse(
+                order=order,
+                executed_trades=completed_trades,
+                order_book_delta=order_book_delta,
+            )
         )
 
     async def fetch_my_open_orders(
@@ -640,32 +939,49 @@ class CurrencyMarket:
 
     async def cancel_open_order(self, order_id: str):
         order = await self.currency_market_order_repository.get_by_id(order_id)
-        planet = await self.planet_repository.get(order.planet_id)
-
-        pairs = order.market_code.split("_")
-        pair1 = pairs[0].lower()
-        pair2 = pairs[1].lower()
-
         if not order:
             return
 
-        if order.state == "fully_filled":
-            # do nothing
+        market_code = order.market_code
+        if self._holds(market_code):
+            await self.matching_actors.submit(market_code, order_id, self._cancel_order)
+        elif await self.router.owner(market_code) is None:
+            # No process holds its book, whoever takes it next loads it without the order
+            await self._cancel_order(order_id)
+        else:
+            await self.router.request(market_code, "cancel", {"order_id": order_id})
+
+    async def _routed_cancel(self, market_code: str, payload: dict):
+        await self.matching_actors.submit(
+            market_code, payload["order_id"], self._cancel_order
+        )
+
+    async def _cancel_order(self, order_id: str):
+        """
+        Runs on the market's matching actor, the order is read again so it can't be filled meanwhile.
+        """
+        order = await self.currency_market_order_repository.get_by_id(order_id)
+        if not order or order.state in ("fully_filled", "cancelled"):
             return
 
+        pairs = order.market_code.split("_")
+        pair1 = pairs[0].lower()
+        pair2 = pairs[1].lower()
+
         order.state = "cancelled"
         await self.currency_market_order_repository.update(order)
 
-        pair1_amt = getattr(planet.resources, pair1)
-        pair2_amt = getattr(planet.resources, pair2)
+        order_book = self.order_books.get(order.market_code)
+        order_book.remove(str(order.id))
 
+        refund = {}
         if order.order_type == "buy":
-            pair2_amt += order.to_be_filled() * order.price
+            add_resource_delta(
+                refund, order.planet_id, pair2, order.to_be_filled() * order.price
+            )
 
         elif order.order_type == "sell":
-            pair1_amt += order.to_be_filled()
-
-        setattr(planet.resources, pair1, pair1_amt)
-        setattr(planet.resources, pair2, pair2_amt)
+            add_resource_delta(refund, order.planet_id, pair1, order.to_be_filled())
 
-        await self.planet_repository.update(planet)
+        await self.planet_repository.inc_resources(refund)
+        await self._publish_market_changed(order.market_code, order_book.flush_delta())
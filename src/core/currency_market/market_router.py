@@ -0,0 +1,198 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+from uuid import uuid4
+
+from core.shared.models import AppBaseException
+from core.shared.ports import MarketLeasePort, PubSubPort
+
+
+class MarketUnavailableException(AppBaseException):
+    msg = "This market is not available right now, please try again"
+
+
+class MarketTimeoutException(AppBaseException):
+    msg = "The market did not answer in time, check your open orders before trying again"
+
+
+class RemoteMarketException(AppBaseException):
+    """
+    Raised by the owner of a market while handling our request.
+    """
+
+    @staticmethod
+    def from_reply(reply: dict):
+        ex = RemoteMarketException()
+        ex.msg = reply["error"]
+        ex.code = reply.get("code", ex.code)
+        return ex
+
+
+@dataclass
+class MarketRouter:
+    """
+    Every market is matched by one process only, the holder of its lease, so its book and orders
+    keep a single writer however many workers run. Other processes send what touches that book
+    (trades, cancels, snapshots) to the holder over pubsub and wait for its reply.
+    """
+
+    pubsub: PubSubPort
+    leases: MarketLeasePort
+    channel: str
+    instance_id: str
+    # websocket workers hold markets, the http app only sends them requests
+    can_own: bool = False
+    lease_seconds: float = 15
+    timeout: float = 10
+    # kind -> handler(market_code, payload), run by the owner
+    handlers: dict[str, Callable[[str, dict], Awaitable[Any]]] = field(
+        default_factory=dict
+    )
+    # runs before a newly held market starts taking requests
+    on_acquired: Callable[[str], Awaitable[None]] = None
+    # market -> epoch of the lease we hold on it
+    owned: dict[str, int] = field(default_factory=dict)
+    pending: dict[str, asyncio.Future] = field(default_factory=dict)
+    tasks: set[asyncio.Task] = field(default_factory=set)
+    renew_task: asyncio.Task = None
+
+    async def start(self, markets: list[str]):
+        await self.pubsub.subscribe(self.channel, self._on_event)
+        if self.can_own:
+            await self._renew(markets)
+            self.renew_task = asyncio.create_task(self._renew_forever(markets))
+
+    async def close(self):
+        if self.renew_task is not None:
+            self.renew_task.cancel()
+            await asyncio.gather(self.renew_task, return_exceptions=True)
+            self.renew_task = None
+
+        # hands the markets over now instead of once the leases expire
+        for market_code in list(self.owned):
+            try:
+                await self.leases.release(market_code, self.instance_id)
+            except Exception:
+                pass
+
+        self.owned.clear()
+        for task in self.tasks:
+            task.cancel()
+
+    def owns(self, market_code: str) -> bool:
+        return market_code in self.owned
+
+    def epoch(self, market_code: str) -> int | None:
+        return self.owned.get(market_code)
+
+    def lost(self, market_code: str):
+        """
+        The lease moved on without us noticing, the next renewal takes it again if it can.
+        """
+        self.owned.pop(market_code, None)
+
+    async def owner(self, market_code: str) -> str | None:
+        return await self.leases.owner(market_code)
+
+    async def _renew(self, markets: list[str]):
+        for market_code in markets:
+            try:
+                epoch = await self.leases.acquire(
+                    market_code, self.instance_id, self.lease_seconds
+                )
+            except Exception:
+                # can't tell whether it's still ours, stop matching it until we can
+                epoch = None
+
+            if epoch is None:
+                self.owned.pop(market_code, None)
+                continue
+
+            if self.owned.get(market_code) == epoch:
+                continue
+
+            # new to us, or someone else held it in between and its book must be loaded again
+            self.owned.pop(market_code, None)
+
+            try:
+                if self.on_acquired is not None:
+                    await self.on_acquired(market_code)
+            except Exception:
+                # not ready to serve it, tried again on the next renewal
+                continue
+
+            self.owned[market_code] = epoch
+
+    async def _renew_forever(self, markets: list[str]):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await self._renew(markets)
+
+    async def request(self, market_code: str, kind: str, payload: dict):
+        """
+        Runs `kind` on the owner of `market_code` and returns what its handler returned.
+        """
+        owner = await self.leases.owner(market_code)
+        if owner is None:
+            raise MarketUnavailableException()
+
+        request_id = uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            await self.pubsub.publish(
+                self.channel,
+                {
+                    "event": "market_request",
+                    "request_id": request_id,
+                    "market_code": market_code,
+                    "kind": kind,
+                    "payload": payload,
+                    "owner": owner,
+                    "origin": self.instance_id,
+                },
+            )
+            reply = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise MarketTimeoutException()
+        finally:
+            self.pending.pop(request_id, None)
+
+        if reply.get("error") is not None:
+            raise RemoteMarketException.from_reply(reply)
+
+        return reply.get("result")
+
+    async def _on_event(self, event: dict):
+        if event["event"] == "market_reply":
+            future = self.pending.get(event["request_id"])
+            if future is not None and not future.done():
+                future.set_result(event)
+
+        elif event["event"] == "market_request" and event["owner"] == self.instance_id:
+            # on its own task, the pubsub listener must not wait on the matching actors
+            task = asyncio.create_task(self._handle(event))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _handle(self, event: dict):
+        reply = {
+            "event": "market_reply",
+            "request_id": event["request_id"],
+            "origin": self.instance_id,
+        }
+        try:
+            # the lease moved on since the sender looked it up
+            if not self.owns(event["market_code"]):
+                raise MarketUnavailableException()
+
+            handler = self.handlers[event["kind"]]
+            reply["result"] = await handler(event["market_code"], event["payload"])
+        except AppBaseException as ex:
+            reply["error"] = ex.msg
+            reply["code"] = ex.code
+        except Exception:
+            reply["error"] = "Something went wrong, please try again"
+            reply["code"] = 500
+
+        await self.pubsub.publish(self.channel, reply)
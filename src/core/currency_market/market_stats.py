@@ -0,0 +1,121 @@
+from calendar import timegm
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from core.shared.models import CurrencyMarketTrade, Volume24Info
+
+WINDOW_SECONDS = 24 * 60 * 60
+BUCKET_SECONDS = 60
+
+
+@dataclass
+class StatsBucket:
+    start: int  # unix seconds
+    open: float
+    max: float
+    min: float
+    pair1_volume: float
+    pair2_volume: float
+
+
+@dataclass
+class RollingMarketStats:
+    """
+    Max/min price and volumes of the trailing 24h, in one minute buckets.
+    Volumes are running sums and max/min come from monotonic deques, so adding a trade and
+    reading the stats are O(1) amortized.
+    """
+
+    buckets: deque = field(default_factory=deque)
+    maxs: deque = field(default_factory=deque)  # (bucket start, price), decreasing price
+    mins: deque = field(default_factory=deque)  # (bucket start, price), increasing price
+    pair1_volume: float = 0
+    pair2_volume: float = 0
+
+    def add(self, trade: CurrencyMarketTrade):
+        start = timegm(trade.created_time.utctimetuple())
+        start -= start % BUCKET_SECONDS
+
+        if self.buckets and self.buckets[-1].start >= start:
+            bucket = self.buckets[-1]
+            bucket.max = max(bucket.max, trade.price)
+            bucket.min = min(bucket.min, trade.price)
+        else:
+            bucket = StatsBucket(start, trade.price, trade.price, trade.price, 0, 0)
+            self.buckets.append(bucket)
+
+        bucket.pair1_volume += trade.amount
+        bucket.pair2_volume += trade.amount * trade.price
+        self.pair1_volume += trade.amount
+        self.pair2_volume += trade.amount * trade.price
+
+        while self.maxs and self.maxs[-1][1] <= trade.price:
+            self.maxs.pop()
+        self.maxs.append((bucket.start, trade.price))
+
+        while self.mins and self.mins[-1][1] >= trade.price:
+            self.mins.pop()
+        self.mins.append((bucket.start, trade.price))
+
+    def _expire(self, now: datetime):
+        cutoff = timegm(now.utctimetuple()) - WINDOW_SECONDS
+
+        while self.buckets and self.buckets[0].start < cutoff:
+            bucket = self.buckets.popleft()
+            self.pair1_volume -= bucket.pair1_volume
+            self.pair2_volume -= bucket.pair2_volume
+
+        while self.maxs and self.maxs[0][0] < cutoff:
+            self.maxs.popleft()
+
+        while self.mins and self.mins[0][0] < cutoff:
+            self.mins.popleft()
+
+        if not self.buckets:
+            # no float drift left behind once the window empties
+            self.pair1_volume = 0
+            self.pair2_volume = 0
+
+    def info(self, now: datetime) -> Volume24Info | None:
+        self._expire(now)
+        if not self.buckets:
+            return None
+
+        return Volume24Info(
+            max_24=self.maxs[0][1],
+            min_24=self.mins[0][1],
+            pair1_volume=self.pair1_volume,
+            pair2_volume=self.pair2_volume,
+            open_24=self.buckets[0].open,
+        )
+
+
+@dataclass
+class MarketStats:
+    """
+    Rolling 24h stats of every market, fed with each trade as it is settled.
+    """
+
+    markets: dict[str, RollingMarketStats] = field(default_factory=dict)
+
+    def get(self, market_code: str) -> RollingMarketStats:
+        stats = self.markets.get(market_code)
+        if stats is None:
+            stats = self.markets[market_code] = RollingMarketStats()
+
+        return stats
+
+    def add_trades(self, trades: list[CurrencyMarketTrade]):
+        for trade in trades:
+            self.get(trade.market_code).add(trade)
+
+    def load(self, trades: list[CurrencyMarketTrade]):
+        """
+        Rebuilds the stats from the trades of the last 24h, `trades` must come sorted by created_time.
+        """
+        self.markets = {}
+        self.add_trades(trades)
+
+    def info(self, market_code: str) -> Volume24Info | None:
+        return self.get(market_code).info(datetime.utcnow())
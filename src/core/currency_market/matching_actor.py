@@ -0,0 +1,64 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+
+@dataclass
+class MarketMatchingActors:
+    """
+    One asyncio task per market_code draining its own queue of trade requests, so trades on
+    the same market run one after another (single writer of its book and orders) while different
+    markets still run concurrently. Callers await a future resolved with the handler's result.
+    """
+
+    handler: Callable[[Any], Awaitable[Any]]
+    queues: dict[str, asyncio.Queue] = field(default_factory=dict)
+    tasks: dict[str, asyncio.Task] = field(default_factory=dict)
+
+    async def submit(
+        self,
+        market_code: str,
+        request,
+        handler: Callable[[Any], Awaitable[Any]] = None,
+    ):
+        """
+        :param handler: runs `request` through it instead of the default handler
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue(market_code).put_nowait((request, handler or self.handler, future))
+        return await future
+
+    def _queue(self, market_code: str) -> asyncio.Queue:
+        queue = self.queues.get(market_code)
+        if queue is None:
+            queue = self.queues[market_code] = asyncio.Queue()
+            self.tasks[market_code] = asyncio.create_task(self._run(queue))
+
+        return queue
+
+    async def _run(self, queue: asyncio.Queue):
+        while True:
+            request, handler, future = await queue.get()
+            try:
+                # Caller went away (e.g. websocket closed) before its turn
+                if future.done():
+                    continue
+
+                try:
+                    result = await handler(request)
+                except Exception as ex:
+                    if not future.done():
+                        future.set_exception(ex)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            finally:
+                queue.task_done()
+
+    async def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks = {}
+        self.queues = {}
@@ -0,0 +1,221 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from pydantic import BaseModel
+
+from core.shared.models import CurrencyMarketOrder
+
+OPEN_ORDER_STATES = ["not_filled", "partially_filled"]
+
+
+def is_open(order: CurrencyMarketOrder) -> bool:
+    return order.state in OPEN_ORDER_STATES and order.to_be_filled() > 0
+
+
+class OrderBookLevels(BaseModel):
+    """
+    Snapshot or delta of a book. On deltas every level holds its new size, 0 meaning removed.
+    A client applies deltas whose sequence follows its last one and asks for a snapshot on gaps.
+    """
+
+    market_code: str
+    sequence: int
+    bids: list[tuple[float, float]]  # (price, size in pair 1)
+    asks: list[tuple[float, float]]
+
+
+@dataclass
+class OrderBookSide:
+    """
+    One side (bids or asks) of a market. Prices are kept sorted ascending in `prices`,
+    every price level is a FIFO queue so the oldest order at the best price matches first.
+    """
+
+    descending: bool
+    prices: list[float] = field(default_factory=list)
+    levels: dict[float, deque] = field(default_factory=dict)
+
+    def add(self, order: CurrencyMarketOrder):
+        level = self.levels.get(order.price)
+        if level is None:
+            level = self.levels[order.price] = deque()
+            insort(self.prices, order.price)
+
+        level.append(order)
+
+    def remove(self, order: CurrencyMarketOrder):
+        level = self.levels.get(order.price)
+        if level is None:
+            return
+
+        for resting in level:
+            if resting is order:
+                level.remove(resting)
+                break
+
+        if not level:
+            del self.levels[order.price]
+            del self.prices[bisect_left(self.prices, order.price)]
+
+    def size(self, price: float) -> float:
+        level = self.levels.get(price)
+        if level is None:
+            return 0
+
+        return sum(order.to_be_filled() for order in level if is_open(order))
+
+    def best_prices(self, depth: int = None) -> list[float]:
+        prices = self.prices[::-1] if self.descending else self.prices
+        return prices if depth is None else prices[:depth]
+
+    def next_price(self, after: float = None) -> float | None:
+        """
+        Next price level starting from the best one, None when the side is exhausted
+        """
+        if self.descending:
+            idx = len(self.prices) - 1 if after is None else bisect_left(self.prices, after) - 1
+            return self.prices[idx] if idx >= 0 else None
+
+        idx = 0 if after is None else bisect_right(self.prices, after)
+        return self.prices[idx] if idx < len(self.prices) else None
+
+    def crosses(self, price: float, limit_price: float = None) -> bool:
+        if limit_price is None:
+            return True
+
+        if self.descending:
+            return price >= limit_price
+
+        return price <= limit_price
+
+    def orders(self, limit_price: float = None) -> Iterator[CurrencyMarketOrder]:
+        """
+        Resting orders in price-time priority up to `limit_price` (no limit for market orders).
+        Every level is copied before yielding so callers may fill/remove orders while iterating.
+        """
+        price = self.next_price()
+        while price is not None and self.crosses(price, limit_price):
+            for order in list(self.levels[price]):
+                yield order
+
+            price = self.next_price(price)
+
+
+@dataclass
+class OrderBook:
+    market_code: str
+    bids: OrderBookSide = field(default_factory=lambda: OrderBookSide(descending=True))
+    asks: OrderBookSide = field(default_factory=lambda: OrderBookSide(descending=False))
+    orders_by_id: dict[str, CurrencyMarketOrder] = field(default_factory=dict)
+    sequence: int = 0
+    # (order_type, price) levels changed since the last delta
+    touched: set[tuple[str, float]] = field(default_factory=set)
+
+    def side(self, order_type: str) -> OrderBookSide:
+        return self.bids if order_type == "buy" else self.asks
+
+    def add(self, order: CurrencyMarketOrder):
+        if not is_open(order) or str(order.id) in self.orders_by_id:
+            return
+
+        self.orders_by_id[str(order.id)] = order
+        self.side(order.order_type).add(order)
+        self.touched.add((order.order_type, order.price))
+
+    def remove(self, order_id: str):
+        order = self.orders_by_id.pop(order_id, None)
+        if order is None:
+            return
+
+        self.side(order.order_type).remove(order)
+        self.touched.add((order.order_type, order.price))
+
+    def update(self, order: CurrencyMarketOrder):
+        """
+        Call after an order got (partially) filled or changed state, drops it once it is not open anymore.
+        """
+        self.touched.add((order.order_type, order.price))
+        if not is_open(order):
+            self.remove(str(order.id))
+
+    def snapshot(self, depth: int = None) -> OrderBookLevels:
+        return OrderBookLevels(
+            market_code=self.market_code,
+            sequence=self.sequence,
+            bids=[(p, self.bids.size(p)) for p in self.bids.best_prices(depth)],
+            asks=[(p, self.asks.size(p)) for p in self.asks.best_prices(depth)],
+        )
+
+    def flush_delta(self) -> OrderBookLevels | None:
+        """
+        New size of every level changed since the previous call, None if nothing changed.
+        """
+        if not self.touched:
+            return None
+
+        self.sequence += 1
+        delta = OrderBookLevels(
+            market_code=self.market_code, sequence=self.sequence, bids=[], asks=[]
+        )
+        for order_type, price in sorted(self.touched):
+            levels = delta.bids if order_type == "buy" else delta.asks
+            levels.append((price, self.side(order_type).size(price)))
+
+        self.touched = set()
+        return delta
+
+    def matching_orders(
+        self, order_type: str, limit_price: float = None
+    ) -> Iterator[CurrencyMarketOrder]:
+        """
+        Orders on the opposite side that an incoming `order_type` order can match against.
+        """
+        opposite = self.asks if order_type == "buy" else self.bids
+        return opposite.orders(limit_price)
+
+
+@dataclass
+class OrderBooks:
+    """
+    Resident order books, one per market_code.
+    """
+
+    books: dict[str, OrderBook] = field(default_factory=dict)
+
+    def get(self, market_code: str) -> OrderBook:
+        book = self.books.get(market_code)
+        if book is None:
+            book = self.books[market_code] = OrderBook(market_code)
+
+        return book
+
+    def load(self, orders: list[CurrencyMarketOrder], market_code: str = None):
+        """
+        Rebuilds the books from the persisted open orders, `orders` must come sorted by created_time.
+        When `market_code` is given only that market is rebuilt.
+        """
+        if market_code is None:
+            previous, self.books = self.books, {}
+        else:
+            previous = {}
+            if market_code in self.books:
+                previous[market_code] = self.books.pop(market_code)
+
+        for order in orders:
+            if market_code is None or order.market_code == market_code:
+                self.get(order.market_code).add(order)
+
+        for code, book in self.books.items():
+            if code not in previous and (market_code is None or code == market_code):
+                # Nobody holds an older version of a book loaded for the first time
+                book.touched = set()
+
+        # Keep sequences going and report the levels that vanished on the next delta
+        for code, old_book in previous.items():
+            book = self.get(code)
+            book.sequence = old_book.sequence
+            book.touched |= old_book.touched
+            for side, order_type in ((old_book.bids, "buy"), (old_book.asks, "sell")):
+                book.touched |= {(order_type, price) for price in side.prices}
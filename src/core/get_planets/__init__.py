@@ -8,7 +8,9 @@ from core.shared.models import (
     Planet,
     PlanetResponse,
 )
+from core.planet_email import PlanetEmail
 from core.shared.ports import PlanetRepositoryPort, ResponsePort
+from core.shared.service.game_catalog import GameCatalog, get_catalog
 
 
 class FetchByPlanetIdResponse(BaseModel):
@@ -19,6 +21,10 @@ class FetchByPlanetIdResponse(BaseModel):
     defense: dict
     emails: list
     building_queue: dict
+    unread_emails: int = 0
+    # `before` and `before_id` of the next inbox page, see /planet/{planet_id}/emails
+    emails_next_before: float | None = None
+    emails_next_before_id: str | None = None
 
 
 class FetchByPlanetPositionRangeRequest(BaseModel):
@@ -72,6 +78,7 @@ class GetPlanets:
     planet_repository: PlanetRepositoryPort
     planet_images_bucket_path: str
     response_port: ResponsePort
+    planet_email: PlanetEmail
 
     async def fetch_by_planet_id(self, user: str, planet_id: str):
         planet: Planet = await self.planet_repository.get_my_planet(
@@ -85,7 +92,8 @@ class GetPlanets:
         re = planet.get_planet_research_data()
         ii = planet.get_planet_installation_data()
         di = planet.get_planet_defense_data()
-        em = planet.get_emails()
+        # the first page only, the inbox isn't part of the planet anymore
+        inbox = await self.planet_email.page(planet_id)
 
         planet.set_image_url(self.planet_images_bucket_path)
 
@@ -95,12 +103,19 @@ class GetPlanets:
             research=re,
             installation=ii,
             defense=di,
-            emails=em,
+            emails=inbox.emails,
+            unread_emails=inbox.unread,
+            emails_next_before=inbox.next_before,
+            emails_next_before_id=inbox.next_before_id,
             building_queue=planet.building_queue
         )
 
         return await self.response_port.publish_response(response)
 
+    async def fetch_game_data(self, tier_code: str) -> GameCatalog:
+        # names, descriptions and upgrades aren't in the planet response, clients fetch them once
+        return get_catalog(tier_code)
+
     async def fetch_all_planets(self, user: str) -> list[PlanetResponse]:
         planets = await self.planet_repository.all_user_planets(user, True)
 
@@ -33,7 +33,7 @@ class NftData:
 
     async def planet_nft_view(self, planet_id: str):
 
-        planet = await self.planet_repository_port.get(planet_id)
+        planet = await self.planet_repository_port.nft_view(planet_id)
         if planet is None:
             return
 
@@ -2,14 +2,26 @@ from dataclasses import dataclass
 
 from pydantic import BaseModel
 
-from core.shared.models import AppBaseException, Email
+from core.shared.models import AppBaseException, Email, NoPlanetFoundException
 from core.shared.ports import EmailRepositoryPort, PlanetRepositoryPort, ResponsePort
 
 
+EMAIL_PAGE_SIZE = 20
+EMAIL_PAGE_SIZE_MAX = 100
+
+
 class EmailNotFoundException(AppBaseException):
     msg = "Email not found"
 
 
+class EmailInboxResponse(BaseModel):
+    emails: list[dict]
+    unread: int
+    # cursor of the next page, None when there are no older emails
+    next_before: float | None = None
+    next_before_id: str | None = None
+
+
 class PlanetSendEmailRequest(BaseModel):
     planet_id_receiver: str
     title: str
@@ -20,6 +32,20 @@ class PlanetSendEmailRequest(BaseModel):
     topic: str
 
 
+def inbox_item(email: Email) -> dict:
+    return {
+        "id": str(email.id),
+        "sender": email.sender,
+        "title": email.title,
+        "subTitle": email.sub_title,
+        "template": email.template,
+        "body": email.body,
+        "read": email.read,
+        "topic": email.topic,
+        "created": email.created,
+    }
+
+
 @dataclass
 class PlanetEmail:
     planet_repository_port: PlanetRepositoryPort
@@ -27,7 +53,6 @@ class PlanetEmail:
     response_port: ResponsePort
 
     async def create(self, email_request: PlanetSendEmailRequest):
-        planet = await self.planet_repository_port.get(email_request.planet_id_receiver)
         email = Email(
             title=email_request.title,
             sub_title=email_request.sub_title,
@@ -40,11 +65,46 @@ class PlanetEmail:
         )
 
         email = await self.email_repository_port.create(email)
-        planet.emails.append(email)
-        await self.planet_repository_port.update(planet)
 
         return await self.response_port.publish_response(email)
 
+    async def page(
+        self,
+        planet_id: str,
+        before: float = None,
+        before_id: str = None,
+        limit: int = EMAIL_PAGE_SIZE,
+    ) -> EmailInboxResponse:
+        limit = max(1, min(limit, EMAIL_PAGE_SIZE_MAX))
+        emails = await self.email_repository_port.inbox(
+            planet_id, before, before_id, limit
+        )
+        unread = await self.email_repository_port.unread_count(planet_id)
+
+        re = EmailInboxResponse(
+            emails=[inbox_item(email) for email in emails], unread=unread
+        )
+        if len(emails) == limit:
+            re.next_before = emails[-1].created
+            re.next_before_id = str(emails[-1].id)
+
+        return re
+
+    async def inbox(
+        self,
+        user: str,
+        planet_id: str,
+        before: float = None,
+        before_id: str = None,
+        limit: int = EMAIL_PAGE_SIZE,
+    ):
+        planet = await self.planet_repository_port.get_my_planet(user, planet_id)
+        if planet is None:
+            raise NoPlanetFoundException()
+
+        re = await self.page(planet_id, before, before_id, limit)
+        return await self.response_port.publish_response(re)
+
     async def mark_as_read(self, email_id: str):
         email: Email = await self.email_repository_port.get(email_id)
 
@@ -65,5 +125,5 @@ class PlanetEmail:
         return await self.response_port.publish_response({})
 
     async def delete_all(self, planet_id):
-        await self.email_repository_port.delete_all_by_user(planet_id)
-        return await self.response_port.publish_response({})
+        deleted = await self.email_repository_port.delete_all_by_user(planet_id)
+        return await self.response_port.publish_response({"deleted": deleted})
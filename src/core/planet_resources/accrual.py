@@ -0,0 +1,291 @@
+from dataclasses import dataclass
+import math
+
+import numpy as np
+
+from core.shared.models import (
+    BuildableItem,
+    Planet,
+    PlanetResourcesView,
+    Reserves,
+    Resources,
+)
+from core.shared.static.game_data.ResourceData import ResourceData as RD
+
+# mine: (resource, reserve, last updated stamp, warehouse)
+MINES = {
+    RD.METAL_MINE: ("metal", "total_metal", "metal_last_updated", RD.METAL_WAREHOUSE),
+    RD.CRYSTAL_MINE: (
+        "crystal",
+        "total_crystal",
+        "crystal_last_updated",
+        RD.CRYSTAL_WAREHOUSE,
+    ),
+    RD.PETROL_MINE: (
+        "petrol",
+        "total_petrol",
+        "petrol_last_updated",
+        RD.PETROL_WAREHOUSE,
+    ),
+}
+
+
+@dataclass
+class Accrual:
+    resources: Resources
+    reserves: Reserves
+
+    def changed(self, planet: Planet) -> bool:
+        return self.resources != planet.resources or self.reserves != planet.reserves
+
+    def apply(self, planet: Planet):
+        planet.resources = self.resources
+        planet.reserves = self.reserves
+
+
+def energy_health_factor(health_percentage: float) -> float:
+    # damaged mines use less energy, the full amount from 2/3 of their health up
+    if health_percentage < 1:
+        return min(health_percentage * 1.5, 1)
+
+    return 1
+
+
+def warehouse_capacity(label: str, warehouse: BuildableItem | None) -> float:
+    level = warehouse.current_level if warehouse is not None else 0
+    info = RD.get_item(label).get_level_info(level)
+    if level > 0 and info.health:
+        return info.capacity * warehouse.health / info.health
+
+    return info.capacity
+
+
+def accrue(planet: Planet | PlanetResourcesView, now: float) -> Accrual:
+    """
+    Production of every mine since its last update, in one pass and without side effects.
+
+    Mines run in the planet's order and share its energy, a mine runs the full elapsed time or,
+    whichever comes first, until the energy, its reserve or its warehouse runs out. Energy and
+    reserves are only spent for what ends up stored. Whole minutes are accrued, the remainder is
+    kept for the next accrual.
+    """
+    resources = planet.resources.copy()
+    reserves = planet.reserves.copy()
+    items = {item.label: item for item in planet.resources_level}
+
+    for mine in planet.resources_level:
+        if mine.label not in MINES:
+            continue
+
+        resource, reserve, stamp, warehouse = MINES[mine.label]
+        last_updated = getattr(resources, stamp)
+        if last_updated is None:
+            setattr(resources, stamp, now)
+            continue
+
+        minutes = math.trunc(max(0, now - last_updated) / 60)
+        if minutes <= 0:
+            continue
+
+        if mine.building or mine.repairing:
+            setattr(resources, stamp, now)
+            continue
+
+        setattr(resources, stamp, last_updated + minutes * 60)
+
+        info = RD.get_item(mine.label).get_level_info(mine.current_level)
+        health = mine.health / info.health if info.health else 1
+        energy_rate = info.energy_usage * energy_health_factor(health)
+
+        powered = minutes
+        if resources.energy <= 0:
+            powered = 0
+        elif energy_rate * minutes > resources.energy:
+            powered = resources.energy / energy_rate
+
+        production = info.production * health * powered
+        stored = min(
+            production,
+            getattr(reserves, reserve),
+            max(
+                0,
+                warehouse_capacity(warehouse, items.get(warehouse))
+                - getattr(resources, resource),
+            ),
+        )
+        if stored <= 0:
+            continue
+
+        resources.energy -= energy_rate * powered * stored / production
+        setattr(resources, resource, getattr(resources, resource) + stored)
+        setattr(reserves, reserve, getattr(reserves, reserve) - stored)
+
+    return Accrual(resources, reserves)
+
+
+def accrue_many(
+    planets: list[Planet | PlanetResourcesView], now: float
+) -> list[Accrual]:
+    """
+    `accrue` for many planets at once, each mine slot is computed over NumPy arrays of all the
+    planets. Same operations in the same order, so the results are exactly the same.
+    """
+    n = len(planets)
+    labels = list(MINES)
+    resource_names = [resource for resource, _, _, _ in MINES.values()]
+    reserve_names = [reserve for _, reserve, _, _ in MINES.values()]
+    stamp_names = [stamp for _, _, stamp, _ in MINES.values()]
+    warehouse_names = [warehouse for _, _, _, warehouse in MINES.values()]
+    slot_count = max((len(planet.resources_level) for planet in planets), default=0)
+
+    # Plain lists first, one array conversion each is much cheaper than per element writes
+    rows = {
+        name: []
+        for name in (
+            "energy",
+            "amount",
+            "reserve",
+            "stamp",
+            "warehouse_level",
+            "warehouse_health",
+            "kind",
+            "level",
+            "busy",
+            "mine_health",
+        )
+    }
+    empty_slots = [-1] * slot_count
+    for planet in planets:
+        resources = planet.resources
+        items = {item.label: item for item in planet.resources_level}
+        warehouses = [items.get(warehouse) for warehouse in warehouse_names]
+
+        rows["energy"].append(resources.energy)
+        rows["amount"].append([getattr(resources, name) for name in resource_names])
+        rows["reserve"].append([getattr(planet.reserves, name) for name in reserve_names])
+        rows["stamp"].append([getattr(resources, name) for name in stamp_names])
+        rows["warehouse_level"].append(
+            [item.current_level if item is not None else 0 for item in warehouses]
+        )
+        rows["warehouse_health"].append(
+            [item.health if item is not None else 0 for item in warehouses]
+        )
+
+        kind, level, busy, health = (
+            empty_slots.copy(),
+            [0] * slot_count,
+            [False] * slot_count,
+            [0] * slot_count,
+        )
+        for j, mine in enumerate(planet.resources_level):
+            if mine.label in MINES:
+                kind[j] = labels.index(mine.label)
+                level[j] = mine.current_level
+                busy[j] = mine.building or mine.repairing
+                health[j] = mine.health
+
+        rows["kind"].append(kind)
+        rows["level"].append(level)
+        rows["busy"].append(busy)
+        rows["mine_health"].append(health)
+
+    shape = (n, len(MINES))
+    # per planet and resource, None (no value) as nan
+    amount = np.array(rows["amount"], dtype=float).reshape(shape)
+    reserve = np.array(rows["reserve"], dtype=float).reshape(shape)
+    stamp = np.array(rows["stamp"], dtype=float).reshape(shape)
+    warehouse_level = np.array(rows["warehouse_level"], dtype=int).reshape(shape)
+    warehouse_health = np.array(rows["warehouse_health"], dtype=float).reshape(shape)
+    energy = np.array(rows["energy"], dtype=float)
+
+    # per planet and mine slot, in the planet's order
+    shape = (n, slot_count)
+    kind = np.array(rows["kind"], dtype=int).reshape(shape)
+    level = np.array(rows["level"], dtype=int).reshape(shape)
+    busy = np.array(rows["busy"], dtype=bool).reshape(shape)
+    mine_health = np.array(rows["mine_health"], dtype=float).reshape(shape)
+
+    # level info from the game data tables, a gather per mine and warehouse type
+    production_rate = np.zeros((n, slot_count))
+    energy_usage = np.zeros((n, slot_count))
+    level_health = np.zeros((n, slot_count))
+    capacity = np.zeros((n, len(MINES)))
+    for r, (label, (_, _, _, warehouse)) in enumerate(MINES.items()):
+        table = RD.get_item(label).table
+        mines = kind == r
+        index = table.index(level[mines])
+        production_rate[mines] = table.production[index]
+        energy_usage[mines] = table.energy_usage[index]
+        level_health[mines] = table.health[index]
+
+        table = RD.get_item(warehouse).table
+        index = table.index(warehouse_level[:, r])
+        by_health = (warehouse_level[:, r] > 0) & (table.health[index] != 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            capacity[:, r] = np.where(
+                by_health,
+                table.capacity[index] * warehouse_health[:, r] / table.health[index],
+                table.capacity[index],
+            )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for j in range(slot_count):
+            row_index = np.nonzero(kind[:, j] >= 0)[0]
+            r = kind[row_index, j]
+            last = stamp[row_index, r]
+
+            fresh = np.isnan(last)
+            minutes = np.trunc(np.maximum(0, now - last) / 60)
+            elapsed = ~fresh & (minutes > 0)
+            active = elapsed & ~busy[row_index, j]
+
+            new_stamp = np.where(active, last + minutes * 60, now)
+            touched = fresh | elapsed
+            stamp[row_index[touched], r[touched]] = new_stamp[touched]
+
+            health = np.where(
+                level_health[row_index, j] != 0,
+                mine_health[row_index, j] / level_health[row_index, j],
+                1,
+            )
+            factor = np.where(health < 1, np.minimum(health * 1.5, 1), 1)
+            energy_rate = energy_usage[row_index, j] * factor
+
+            e = energy[row_index]
+            powered = np.where(
+                e <= 0, 0, np.where(energy_rate * minutes > e, e / energy_rate, minutes)
+            )
+            production = production_rate[row_index, j] * health * powered
+            stored = np.minimum(
+                np.minimum(production, reserve[row_index, r]),
+                np.maximum(0, capacity[row_index, r] - amount[row_index, r]),
+            )
+
+            ok = active & (stored > 0)
+            row_index, r = row_index[ok], r[ok]
+            energy[row_index] = energy[row_index] - (
+                energy_rate[ok] * powered[ok] * stored[ok] / production[ok]
+            )
+            amount[row_index, r] = amount[row_index, r] + stored[ok]
+            reserve[row_index, r] = reserve[row_index, r] - stored[ok]
+
+    accruals = []
+    for planet, planet_energy, amounts, reserves, stamps in zip(
+        planets, energy.tolist(), amount.tolist(), reserve.tolist(), stamp.tolist()
+    ):
+        resources = {"energy": planet_energy}
+        for name, value in zip(resource_names, amounts):
+            if value == value:  # not nan
+                resources[name] = value
+        for name, value in zip(stamp_names, stamps):
+            if value == value:
+                resources[name] = value
+
+        accruals.append(
+            Accrual(
+                planet.resources.copy(update=resources),
+                planet.reserves.copy(update=dict(zip(reserve_names, reserves))),
+            )
+        )
+
+    return accruals
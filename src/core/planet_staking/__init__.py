@@ -254,13 +254,13 @@ class Staking:
         :param planet_id:
         :return:
         """
-        planet = await self.planet_repository_port.get(planet_id)
+        planet = await self.planet_repository_port.tier_view(planet_id)
 
         now = int(datetime.timestamp(datetime.now()))
         if planet.tier.staked and planet.tier.time_release < now:
             planet.tier.tier_code = StakingData.TIER_0
             planet.tier.tier_name = StakingData.TIER_NAMES[StakingData.TIER_0]
-            planet = await self.planet_repository_port.update(planet)
+            await self.planet_repository_port.save_tier(planet)
 
         return await self.response_port.publish_response(planet.tier)
 
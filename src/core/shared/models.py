@@ -1,10 +1,11 @@
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
-from typing import Any, Optional
+from typing import Any, Awaitable, Callable, Optional
+from uuid import UUID
 
-from pydantic import BaseModel, Field, root_validator
+from pydantic import BaseModel, Field
 
-from core.shared.service.tier_benefit import tier_benefit_buildable_items
 from core.shared.static.game_data.Common import (
     BuildableItemBaseType,
     BuildableItemLevelInfo,
@@ -144,6 +145,7 @@ class Email(BaseModel):
     read: bool = False
     planet: str = None
     topic: str = None
+    created: float = None
 
 
 class BuildingQueueItem(BaseModel):
@@ -161,6 +163,79 @@ class BuildingQueue(BaseModel):
     reduced_time: bool = False  # has paid to reduce time?
 
 
+class PlanetResourcesView(BaseModel):
+    """
+    The part of a planet that resource accrual reads and writes, for batch jobs.
+    """
+
+    id: str
+    revision_id: UUID = None
+    resources: Resources
+    reserves: Reserves
+    resources_level: list[BuildableItem]
+
+
+class PlanetTierView(BaseModel):
+    """
+    The staking tier of a planet, for the checks that run before every request.
+    """
+
+    id: str
+    revision_id: UUID = None
+    tier: PlanetTier = None
+
+
+class PlanetPositionView(BaseModel):
+    id: str
+    galaxy: int = None
+    solar_system: int = None
+    position: int = None
+
+
+class PlanetNftView(BaseModel):
+    """
+    What the NFT metadata of a planet shows.
+    """
+
+    id: str
+    name: str = None
+    rarity: str = None
+    image: str = None
+    level: int = None
+    experience: int = None
+    diameter: int = None
+    slots: int = None
+    slots_used: int = None
+    min_temperature: int = None
+    max_temperature: int = None
+    galaxy: int = None
+    solar_system: int = None
+    position: int = None
+    reserves: Reserves = None
+
+
+class PlanetLeaderboardView(BaseModel):
+    id: str
+    name: str = None
+    level: int = None
+    experience: int = None
+    rarity: str = None
+    image: str = None
+    type: str = None
+    image_url_bg: str = None
+
+    def set_image_url(self, url: str):
+        _, self.image_url_bg = planet_image_urls(url, self.type, self.rarity, self.image)
+
+
+def planet_image_urls(
+    url: str, type: str, rarity: str, image: str
+) -> tuple[str, str]:
+    # without and with background
+    name = f"{url}/{type}-{rarity}-{image}"
+    return f"{name}.webp", f"{name}-bg.webp"
+
+
 class Planet(BaseModel):
     id: str = None
     request_id: str = None
@@ -173,7 +248,6 @@ class Planet(BaseModel):
     image_url_bg: str = None  # image with bg
     level: int = None
     experience: int = None
-    experience_needed: int = None
     diameter: int = None
     slots: int = None  # = Diameter/1000
     slots_used: int = None
@@ -206,21 +280,17 @@ class Planet(BaseModel):
 
     energy_deposits: list[EnergyDeposit] = []
     bkm_deposits: list[BKMTransaction] = []
-    emails: list[Email] = []
 
     def set_image_url(self, url: str):
-        self.image_url = f"{url}/{self.type}-{self.rarity}-{self.image}.webp"
-        self.image_url_bg = f"{url}/{self.type}-{self.rarity}-{self.image}-bg.webp"
-
-    # @TODO: Pydantic bug dont serialize properties, using root_validator is a workaround
-    # @SEE: https://github.com/samuelcolvin/pydantic/pull/2625
-    @root_validator
-    def compute_energy_usage(cls, values):
-        mines: list[BuildableItem] = values["resources_level"]
+        self.image_url, self.image_url_bg = planet_image_urls(
+            url, self.type, self.rarity, self.image
+        )
+
+    def get_energy_usage(self) -> float:
         energy_usage = 0
         mine: BuildableItem
 
-        for mine in mines:
+        for mine in self.resources_level:
             mine_info: BuildableItemBaseType = RD.get_item(mine.label)
 
             if mine_info.category is not RD.MINE_CATEGORY:
@@ -240,14 +310,13 @@ class Planet(BaseModel):
 
                 energy_usage *= energy_health_factor
 
-        values["resources"].energy_usage = energy_usage
+        return energy_usage
 
+    def get_experience_needed(self) -> int | None:
         try:
-            values["experience_needed"] = PlanetLevelData.get_level_experience(values["level"]+1)
+            return PlanetLevelData.get_level_experience(self.level + 1)
         except:
-            pass
-
-        return values
+            return None
 
     def get_planet_resource_data(self):
         re = {}
@@ -273,11 +342,8 @@ class Planet(BaseModel):
             tmp["type"] = RD.TYPE
 
             resources_data: BuildableItemBaseType = RD.get_item(label)
-            tmp["name"] = resources_data.name
             tmp["label"] = resources_data.label
-            tmp["description"] = resources_data.description
             tmp["health"] = resource_level.health
-            tmp["upgrades"] = {}
 
             if resources_data.category == RD.MINE_CATEGORY:
                 tmp["production"] = current_level_info.production
@@ -285,13 +351,6 @@ class Planet(BaseModel):
             if resources_data.category == RD.WAREHOUSE_CATEGORY:
                 tmp["capacity"] = current_level_info.capacity
 
-            for upgrade in resources_data.builds:
-                upgrade_data: BuildableItemLevelInfo = resources_data.builds[upgrade]
-                # upgrade_data = resources_data.builds[upgrade]
-                tmp["upgrades"][upgrade_data.level] = tier_benefit_buildable_items(
-                    self.tier.tier_code, upgrade_data
-                )
-
             re[label] = tmp
 
         return re
@@ -315,16 +374,7 @@ class Planet(BaseModel):
 
             tmp["level"] = current_level
             tmp["type"] = RE.TYPE
-            tmp["name"] = research_data.name
             tmp["label"] = research_data.label
-            tmp["description"] = research_data.description
-
-            tmp["upgrades"] = {}
-            for upgrade in research_data.builds:
-                upgrade_data: BuildableItemLevelInfo = research_data.builds[upgrade]
-                tmp["upgrades"][upgrade_data.level] = tier_benefit_buildable_items(
-                    self.tier.tier_code, upgrade_data
-                )
 
             re[label] = tmp
 
@@ -349,16 +399,7 @@ class Planet(BaseModel):
 
             tmp["level"] = current_level
             tmp["type"] = ID.TYPE
-            tmp["name"] = installation_data.name
             tmp["label"] = installation_data.label
-            tmp["description"] = installation_data.description
-
-            tmp["upgrades"] = {}
-            for upgrade in installation_data.builds:
-                upgrade_data: BuildableItemLevelInfo = installation_data.builds[upgrade]
-                tmp["upgrades"][upgrade_data.level] = tier_benefit_buildable_items(
-                    self.tier.tier_code, upgrade_data
-                )
 
             re[label] = tmp
 
@@ -371,17 +412,11 @@ class Planet(BaseModel):
         defense_item: BuildableItem
         for defense_item in defense_items:
             label = defense_item.label
-            defense_data: BuildableItemBaseType = DD.get_item(label)
 
             tmp = {}
             tmp["type"] = DD.TYPE
-            tmp["name"] = defense_data.name
             tmp["label"] = label
-            tmp["description"] = defense_data.description
             tmp["available"] = defense_item.quantity
-            tmp["data"] = tier_benefit_buildable_items(
-                self.tier.tier_code, defense_data.get_level_info()
-            )
 
             tmp["building"] = False
             tmp["finish"] = False
@@ -395,23 +430,6 @@ class Planet(BaseModel):
 
         return re
 
-    def get_emails(self):
-        re = []
-        for email in self.emails:
-            re.append(
-                {
-                    "id": email.id,
-                    "sender": email.sender,
-                    "title": email.title,
-                    "subTitle": email.sub_title,
-                    "template": email.template,
-                    "body": email.body,
-                    "read": email.read,
-                    "topic": email.topic,
-                }
-            )
-        return re
-
 
 class PlanetResponse(BaseModel):
     id: str
@@ -455,7 +473,6 @@ class PlanetResponse(BaseModel):
 
     building_queue: BuildingQueue = None
     energy_deposits: list[EnergyDeposit] = []
-    emails: list[Email] = []
 
     @staticmethod
     def from_planet(p: Planet) -> "PlanetResponse":
@@ -481,17 +498,16 @@ class PlanetResponse(BaseModel):
         re.claimable = p.claimable
         re.claimed = p.claimed
         re.tier = p.tier
-        re.resources = p.resources
+        re.resources = p.resources.copy(update={"energy_usage": p.get_energy_usage()})
         re.price_paid = p.price_paid
         re.resources_level = p.resources_level
         re.installation_level = p.installation_level
         re.research_level = p.research_level
         re.defense_items = p.defense_items
         re.energy_deposits = p.energy_deposits
-        re.emails = p.emails
         re.building_queue = p.building_queue
         re.is_favourite = p.is_favourite
-        re.experience_needed = p.experience_needed
+        re.experience_needed = p.get_experience_needed()
         re.type = p.type
         return re
 
@@ -531,6 +547,30 @@ class CurrencyMarketTrade(BaseModel):
     created_time: datetime = None
 
 
+class StaleOrderException(AppBaseException):
+    msg = "Some orders changed meanwhile, please try again"
+
+
+class MarketLeaseLostException(StaleOrderException):
+    msg = "This market moved to another process meanwhile, please try again"
+
+
+@dataclass
+class CurrencyMarketSettlement:
+    """
+    Everything a single trade writes: the resting orders it filled, the taker order (if any),
+    the executed trades and the resulting {planet_id: {resource: amount}} balance changes.
+    Plain dataclass so the filled orders are kept by reference (they live in the order book).
+    """
+
+    filled_orders: list[CurrencyMarketOrder] = field(default_factory=list)
+    new_order: CurrencyMarketOrder | None = None
+    trades: list[CurrencyMarketTrade] = field(default_factory=list)
+    resource_deltas: dict[str, dict[str, float]] = field(default_factory=dict)
+    # fence(session) -> bool, False once the market's lease moved on (see MarketLeasePort.fence)
+    fence: Callable[[Any], Awaitable[bool]] | None = None
+
+
 class MetadataResponse(BaseModel):
     response_type: str
     data: Any
@@ -551,6 +591,31 @@ class PriceCandleDataGroupedByTimeInterval(BaseModel):
     close: float = None
     high: float = None
     low: float = None
+    volume: float = None
+
+
+# Candle interval -> length in seconds, buckets are aligned to the unix epoch (UTC)
+CANDLE_INTERVALS = {"1m": 60, "15m": 900, "1h": 3600, "1d": 86400}
+
+
+def candle_bucket(created_time: datetime, interval: str) -> datetime:
+    """
+    Start of the `interval` candle a naive UTC datetime falls into.
+    """
+    seconds = int((created_time - datetime(1970, 1, 1)).total_seconds())
+    return datetime.utcfromtimestamp(seconds - seconds % CANDLE_INTERVALS[interval])
+
+
+# OHLCV bar of a market, kept up to date as trades land
+class CurrencyMarketCandle(BaseModel):
+    market_code: str
+    interval: str  # 1m, 15m, 1h, 1d
+    bucket: datetime  # candle start
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float = 0  # in pair 1
 
 
 class Volume24Info(BaseModel):
@@ -558,6 +623,15 @@ class Volume24Info(BaseModel):
     min_24: float = None
     pair1_volume: float = None
     pair2_volume: float = None
+    open_24: float = None  # first price of the window
+
+
+class CurrencyMarketTicker(BaseModel):
+    market_code: str
+    last_price: float = 0
+    open_24: float = None
+    pair1_volume_24: float = 0
+    pair2_volume_24: float = 0
 
 
 class Voucher(BaseModel):
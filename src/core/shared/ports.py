@@ -1,18 +1,26 @@
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import TypedDict, AsyncIterator
+from typing import AsyncIterator, Awaitable, Callable, TypedDict
 
 from core.shared.models import (
     BKMTransaction,
+    CurrencyMarketCandle,
     CurrencyMarketOrder,
+    CurrencyMarketSettlement,
+    CurrencyMarketTicker,
     CurrencyMarketTrade,
     Email,
     EnergyDeposit,
     OpenOrdersGroupedByPrice,
     Planet,
+    PlanetLeaderboardView,
+    PlanetNftView,
+    PlanetPositionView,
+    PlanetResourcesView,
+    PlanetTierView,
     PriceCandleDataGroupedByTimeInterval,
     User,
-    Volume24Info, Voucher,
+    Voucher,
 )
 
 
@@ -40,13 +48,30 @@ class EmailRepositoryPort(ABC):
         pass
 
     @abstractmethod
-    async def delete_all_by_user(self, planet_id) -> None:
+    async def delete_all_by_user(self, planet_id) -> int:
+        """
+        Deletes the whole inbox of a planet in one go, returns how many emails were deleted.
+        """
         pass
 
     @abstractmethod
     async def get(self, email_id) -> Email:
         pass
 
+    @abstractmethod
+    async def inbox(
+        self, planet_id: str, before: float | None, before_id: str | None, limit: int
+    ) -> list[Email]:
+        """
+        Emails of a planet, newest first, `limit` of the ones after the (`before`, `before_id`)
+        cursor. The id breaks ties between emails created the same second.
+        """
+        pass
+
+    @abstractmethod
+    async def unread_count(self, planet_id: str) -> int:
+        pass
+
 
 class EnergyDepositRepositoryPort(ABC):
     @abstractmethod
@@ -84,14 +109,8 @@ class CurrencyMarketOrderRepositoryPort(ABC):
         pass
 
     @abstractmethod
-    async def create_order(
-        self, order: CurrencyMarketOrder
-    ) -> CurrencyMarketOrder | None:
-        pass
-
-    @abstractmethod
-    async def find_matching_orders(
-        self, market_code: str, trade_type: str, order_type: str, price: float
+    async def all_open_orders(
+        self, market_code: str = None
     ) -> list[CurrencyMarketOrder]:
         pass
 
@@ -110,21 +129,27 @@ class CurrencyMarketOrderRepositoryPort(ABC):
         pass
 
 
-class CurrencyMarketTradeRepositoryPort(ABC):
+class CurrencyMarketSettlementPort(ABC):
     @abstractmethod
-    async def last_24_info(self, market_code: str) -> Volume24Info:
+    async def settle(
+        self, settlement: CurrencyMarketSettlement
+    ) -> CurrencyMarketOrder | None:
+        """
+        Persists a whole trade in one batch per collection.
+        Raises StaleOrderException if any filled order changed since it was loaded, or
+        MarketLeaseLostException if its `fence` fails, nothing is written then.
+        :return: the stored taker order, None if the settlement had none
+        """
         pass
 
+
+class CurrencyMarketTradeRepositoryPort(ABC):
     @abstractmethod
     async def price_last_candle_data_grouped_time(
         self, market_code: str, interval: int
     ) -> list[PriceCandleDataGroupedByTimeInterval]:
         pass
 
-    @abstractmethod
-    async def last(self, market_code: str) -> list[CurrencyMarketTrade]:
-        pass
-
     @abstractmethod
     async def last_from(
         self, market_code: str, starting_from: datetime
@@ -140,7 +165,18 @@ class CurrencyMarketTradeRepositoryPort(ABC):
     @abstractmethod
     async def price_candle_data_grouped_time(
         self, market_code: str, time_start: datetime, interval: str
-    ) -> list[PriceCandleDataGroupedByTimeInterval]:
+    ) -> list[CurrencyMarketCandle]:
+        pass
+
+    @abstractmethod
+    async def has_candles(self) -> bool:
+        pass
+
+    @abstractmethod
+    async def rebuild_candles(self):
+        """
+        Recomputes every candle from the stored trades.
+        """
         pass
 
     @abstractmethod
@@ -148,15 +184,20 @@ class CurrencyMarketTradeRepositoryPort(ABC):
         pass
 
     @abstractmethod
-    async def all_descending_limit_by_day(
-        self, market_code: str
-    ) -> list[CurrencyMarketTrade] | None:
+    async def all_from(self, time_start: datetime) -> list[CurrencyMarketTrade]:
+        pass
+
+    @abstractmethod
+    async def market_tickers(self, time_start: datetime) -> list[CurrencyMarketTicker]:
+        """
+        Last price of every market plus its first price and volumes since `time_start`.
+        """
         pass
 
     @abstractmethod
-    async def create_trade(
-        self, trade: CurrencyMarketTrade
-    ) -> CurrencyMarketTrade | None:
+    async def all_descending_limit_by_day(
+        self, market_code: str
+    ) -> list[CurrencyMarketTrade] | None:
         pass
 
 
@@ -171,7 +212,10 @@ class UserRepositoryPort(ABC):
         pass
 
     @abstractmethod
-    async def update(self, user: User) -> User:
+    async def update(self, user: User, reload=False) -> User:
+        """
+        Returns the saved instance itself, read back from the database only with `reload`.
+        """
         pass
 
     @abstractmethod
@@ -197,7 +241,9 @@ class PlanetRepositoryPort(ABC):
         pass
 
     @abstractmethod
-    async def planet_leaderboard(self, page: int, per_page: int) -> list[Planet] | None:
+    async def planet_leaderboard(
+        self, page: int, per_page: int
+    ) -> list[PlanetLeaderboardView]:
         pass
 
     @abstractmethod
@@ -211,7 +257,22 @@ class PlanetRepositoryPort(ABC):
         pass
 
     @abstractmethod
-    async def update(self, planet: Planet) -> Planet:
+    async def update(self, planet: Planet, reload=False) -> Planet:
+        """
+        Returns the saved instance itself, read back from the database only with `reload`.
+        """
+        pass
+
+    @abstractmethod
+    async def inc_resources(
+        self, deltas: dict[str, dict[str, float]], check_funds=False
+    ) -> bool:
+        """
+        Atomically adds signed amounts to planet resources, e.g. {planet_id: {"metal": -10.5}}.
+        :param check_funds: negative amounts are only applied if the planet holds enough of them,
+        if any planet is refused none of them is changed
+        :return: False if any planet was not updated
+        """
         pass
 
     @abstractmethod
@@ -228,18 +289,38 @@ class PlanetRepositoryPort(ABC):
     ) -> list[Planet]:
         pass
 
+    @abstractmethod
+    async def positions_by_range(
+        self,
+        galaxy: int,
+        from_solar_system: int,
+        to_solar_system: int,
+    ) -> list[PlanetPositionView]:
+        pass
+
     async def occupied_positions_by_range(
         self,
         galaxy: int,
         from_solar_system: int,
         to_solar_system: int,
     ) -> dict[str, bool]:
-        pass
+        positions = await self.positions_by_range(
+            galaxy, from_solar_system, to_solar_system
+        )
+
+        return {
+            f"{planet.galaxy}:{planet.solar_system}:{planet.position}": True
+            for planet in positions
+        }
 
     @abstractmethod
     async def get(self, planet_id: str, fetch_links=False) -> Planet | None:
         pass
 
+    @abstractmethod
+    async def get_many(self, planet_ids: list[str]) -> list[Planet]:
+        pass
+
     @abstractmethod
     async def get_my_planet(
         self, user_id: str, planet_id: str, fetch_links=False
@@ -254,6 +335,38 @@ class PlanetRepositoryPort(ABC):
     async def last_created_planet(self, fetch_links=False) -> Planet | bool:
         pass
 
+    @abstractmethod
+    async def tier_view(self, planet_id: str) -> PlanetTierView | None:
+        pass
+
+    @abstractmethod
+    async def save_tier(self, view: PlanetTierView):
+        """
+        Saves the tier of `view`, fails like `update` does if the planet changed since it was read.
+        """
+        pass
+
+    @abstractmethod
+    async def nft_view(self, planet_id: str) -> PlanetNftView | None:
+        pass
+
+    @abstractmethod
+    def resource_views(
+        self, batch_size: int = 1000
+    ) -> AsyncIterator[list[PlanetResourcesView]]:
+        """
+        Resources of every claimed planet, `batch_size` planets at a time.
+        """
+        pass
+
+    @abstractmethod
+    async def save_resources(self, views: list[PlanetResourcesView]) -> int:
+        """
+        Resources and reserves of `views` in a single round trip, skipping planets changed since
+        they were read. Returns how many were saved.
+        """
+        pass
+
 
 class ResponsePort(ABC):
     @abstractmethod
@@ -263,6 +376,7 @@ class ResponsePort(ABC):
 
 class CacheServicePort(ABC):
     FASTEST_RPC = "fastest_rpc"
+    MARKET_TICKER = "market_ticker"
 
     @abstractmethod
     async def set(self, key: str, value, expiry: int):
@@ -272,6 +386,83 @@ class CacheServicePort(ABC):
     async def get(self, key: str):
         pass
 
+    @abstractmethod
+    async def get_many(self, keys: list[str]) -> dict:
+        """
+        Found keys only, in a single round trip.
+        """
+        pass
+
+
+class PubSubPort(ABC):
+    """
+    Carries events between processes (websocket workers, http app). Every message published on
+    a channel reaches every handler subscribed to it, in every process, the publisher's included.
+    """
+
+    @abstractmethod
+    async def publish(self, channel: str, message: dict):
+        pass
+
+    @abstractmethod
+    async def subscribe(
+        self, channel: str, handler: Callable[[dict], Awaitable[None]]
+    ):
+        pass
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+
+class MarketLeasePort(ABC):
+    """
+    Expiring ownership of a market, so only one process at a time matches its orders.
+    """
+
+    @abstractmethod
+    async def acquire(self, market_code: str, owner: str, seconds: float) -> int | None:
+        """
+        Takes the lease or extends it when `owner` already holds it.
+        :return: the lease's epoch, it grows every time the lease is taken over.
+            None while another owner holds an unexpired lease
+        """
+        pass
+
+    @abstractmethod
+    async def owner(self, market_code: str) -> str | None:
+        """
+        Current holder, None when nobody holds an unexpired lease.
+        """
+        pass
+
+    @abstractmethod
+    async def release(self, market_code: str, owner: str):
+        pass
+
+    @abstractmethod
+    async def fence(self, market_code: str, owner: str, epoch: int, session=None) -> bool:
+        """
+        Whether `owner` still holds the lease at `epoch`. Checked by settlements before they
+        write, within their storage `session` when they have one.
+        """
+        pass
+
+
+class ChatRepositoryPort(ABC):
+    @abstractmethod
+    async def add(self, message: dict):
+        pass
+
+    @abstractmethod
+    async def last(
+        self, frequency: str, before: float | None, limit: int
+    ) -> list[dict]:
+        """
+        Up to `limit` messages of `frequency` older than `before` (newest if None), oldest first.
+        """
+        pass
+
 
 class SignedMessageDict(TypedDict):
     v: int
@@ -0,0 +1,81 @@
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+
+from core.shared.service.tier_benefit import tier_benefit_buildable_items
+from core.shared.static.game_data.DefenseData import DefenseData as DD
+from core.shared.static.game_data.InstallationData import InstallationData as ID
+from core.shared.static.game_data.ResearchData import ResearchData as RE
+from core.shared.static.game_data.ResourceData import ResourceData as RD
+from core.shared.static.game_data.StakingData import StakingData as SD
+
+
+@dataclass
+class GameCatalog:
+    """
+    The static side of the planet screens for one tier: names, descriptions and the upgrades of
+    every item. It only depends on the tier, so it's built and serialized once.
+    """
+
+    tier_code: str
+    data: dict
+    body: str
+    etag: str
+
+
+def buildable_catalog(game_data, tier_code: str) -> dict:
+    re = {}
+    for label in game_data.TYPES:
+        item = game_data.get_item(label)
+        re[label] = {
+            "type": game_data.TYPE,
+            "name": item.name,
+            "label": item.label,
+            "description": item.description,
+            "upgrades": {
+                info.level: asdict(tier_benefit_buildable_items(tier_code, info))
+                for info in item.builds.values()
+            },
+        }
+
+    return re
+
+
+def defense_catalog(tier_code: str) -> dict:
+    re = {}
+    for label in DD.TYPES:
+        item = DD.get_item(label)
+        re[label] = {
+            "type": DD.TYPE,
+            "name": item.name,
+            "label": label,
+            "description": item.description,
+            "data": asdict(
+                tier_benefit_buildable_items(tier_code, item.get_level_info())
+            ),
+        }
+
+    return re
+
+
+def build_catalog(tier_code: str) -> GameCatalog:
+    data = {
+        "tier_code": tier_code,
+        "resources": buildable_catalog(RD, tier_code),
+        "research": buildable_catalog(RE, tier_code),
+        "installation": buildable_catalog(ID, tier_code),
+        "defense": defense_catalog(tier_code),
+    }
+    body = json.dumps(data, separators=(",", ":"))
+    etag = f'"{hashlib.sha1(body.encode()).hexdigest()}"'
+
+    return GameCatalog(tier_code, data, body, etag)
+
+
+CATALOGS: dict[str, GameCatalog] = {
+    tier_code: build_catalog(tier_code) for tier_code in SD.TIERS
+}
+
+
+def get_catalog(tier_code: str) -> GameCatalog:
+    return CATALOGS.get(tier_code, CATALOGS[SD.TIER_0])
@@ -1,4 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields
+
+import numpy as np
 
 
 class CommonKeys:
@@ -62,6 +64,39 @@ class BuildableItemLevelInfo:
     has_discount: bool = False
 
 
+@dataclass
+class LevelTable:
+    """
+    The numeric level info of an item as arrays indexed by level, for vectorized consumers.
+    """
+
+    cost_metal: np.ndarray
+    cost_petrol: np.ndarray
+    cost_crystal: np.ndarray
+    energy_usage: np.ndarray
+    production: np.ndarray
+    capacity: np.ndarray
+    time: np.ndarray
+    health: np.ndarray
+    attack: np.ndarray
+    experience: np.ndarray
+
+    @classmethod
+    def compile(cls, levels: list[BuildableItemLevelInfo]) -> "LevelTable":
+        return cls(
+            **{
+                column.name: np.array(
+                    [getattr(info, column.name) for info in levels], dtype=float
+                )
+                for column in fields(cls)
+            }
+        )
+
+    def index(self, levels: np.ndarray) -> np.ndarray:
+        # unknown levels read level 0, like get_level_info
+        return np.where((levels >= 0) & (levels < len(self.health)), levels, 0)
+
+
 @dataclass
 class BuildableItemBaseType:
     """
@@ -76,11 +111,19 @@ class BuildableItemBaseType:
 
     builds: dict[int, BuildableItemLevelInfo] = None
 
-    def get_level_info(self, level: int = 0) -> BuildableItemLevelInfo:
+    # compiled from builds when the game data is imported, gaps hold level 0 like lookups do
+    levels: list[BuildableItemLevelInfo] = field(init=False, repr=False)
+    table: LevelTable = field(init=False, repr=False)
 
-        try:
-            level_info = self.builds[level]
-        except:
-            level_info = self.builds[0]
+    def __post_init__(self):
+        top = max((level for level in self.builds if level >= 0), default=0)
+        self.levels = [
+            self.builds.get(level, self.builds[0]) for level in range(top + 1)
+        ]
+        self.table = LevelTable.compile(self.levels)
+
+    def get_level_info(self, level: int = 0) -> BuildableItemLevelInfo:
+        if 0 <= level < len(self.levels):
+            return self.levels[level]
 
-        return level_info
+        return self.levels[0]